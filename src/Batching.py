@@ -0,0 +1,126 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class Batch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Collects items submitted by concurrent threads with the same key for a short delay and processes them at once.
+    The thread which opened the batch processes it, the other threads wait for its results."""
+
+    def __init__(self, delay: float, max_size: int):
+        self._delay = delay
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # key: batch which still accepts items
+        self._open = {}
+        self._batches = 0
+        self._items = 0
+
+    def submit(self, key: Hashable, item: Any, process: Callable[[List[Any]], List[Any]]) -> Any:
+        """Returns result of item, process is called with all items of the batch and returns their results
+        (results which are exceptions are raised in threads which submitted the items)"""
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self._max_size:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self._delay)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self._batches += 1
+                self._items += len(batch.items)
+            try:
+                batch.results = process(batch.items)
+            except Exception as e:
+                batch.results = [e] * len(batch.items)
+            finally:
+                if batch.results is None:
+                    batch.results = [RuntimeError('Batch was not processed.')] * len(batch.items)
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        result = batch.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns number of processed batches and their average size"""
+        with self._lock:
+            return {'batches': self._batches,
+                    'items': self._items,
+                    'average_size': round(self._items / self._batches, 2) if self._batches else 0}
+
+
+class SingleFlight:
+    """Deduplication of identical concurrent tasks - the first task with the key runs, the other tasks wait for its
+    result instead of running again. It lives in state server, so tasks of all worker processes are deduplicated.
+    Tasks running longer than timeout (e.g. their process was terminated) are not waited for."""
+
+    def __init__(self, timeout: float):
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        # key: state of running task (start, done, result, number of waiting tasks)
+        self._flights = {}
+        self._started = 0
+        self._coalesced = 0
+
+    def begin(self, key: Hashable) -> bool:
+        """Returns whether task with the key has to run (True) or it waits for result of running one (False)"""
+        with self._condition:
+            flight = self._flights.get(key)
+            if flight is None or time.monotonic() - flight['start'] > self._timeout:
+                self._flights[key] = {'start': time.monotonic(), 'done': False, 'result': None, 'waiters': 0}
+                self._started += 1
+                return True
+            flight['waiters'] += 1
+            self._coalesced += 1
+            return False
+
+    def finish(self, key: Hashable, result: Any = None) -> None:
+        """Passes result of running task to waiting tasks, None means the task was abandoned without result"""
+        with self._condition:
+            flight = self._flights.get(key)
+            if flight is None or flight['done']:
+                return
+            flight['done'] = True
+            flight['result'] = result
+            if not flight['waiters']:
+                del self._flights[key]
+            self._condition.notify_all()
+
+    def wait(self, key: Hashable) -> Any:
+        """Returns result of running task with the key, None if it was abandoned or did not finish in time"""
+        with self._condition:
+            flight = self._flights.get(key)
+            if flight is None:
+                return None
+            self._condition.wait_for(lambda: flight['done'], flight['start'] + self._timeout - time.monotonic())
+            flight['waiters'] -= 1
+            if flight['done'] and not flight['waiters'] and self._flights.get(key) is flight:
+                del self._flights[key]
+            return flight['result']
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns number of running and coalesced tasks"""
+        with self._condition:
+            return {'running': len(self._flights),
+                    'started': self._started,
+                    'coalesced': self._coalesced}
@@ -0,0 +1,93 @@
+import math
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Union
+
+# calculation times are logged rounded to hundredths of second, shorter times are recorded as zero
+MIN_TIME = 0.005
+# regularization of slopes, it keeps the fit defined when all structures have the same number of molecules
+RIDGE = 1e-6
+
+
+def solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """Solves system of linear equations by gaussian elimination with partial pivoting"""
+    size = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        if rows[column][column] == 0:
+            raise ValueError('System of equations is singular.')
+        for row in range(column + 1, size):
+            factor = rows[row][column] / rows[column][column]
+            for index in range(column, size + 1):
+                rows[row][index] -= factor * rows[column][index]
+    solution = [0.0] * size
+    for row in reversed(range(size)):
+        value = rows[row][size] - sum(rows[row][index] * solution[index] for index in range(row + 1, size))
+        solution[row] = value / rows[row][row]
+    return solution
+
+
+def get_features(atoms: int, molecules: int) -> List[float]:
+    return [1.0, math.log(max(atoms, 1)), math.log(max(molecules, 1))]
+
+
+class CostModel:
+    """Predicts calculation time of method from number of atoms and molecules of structure.
+    Model of every method is power law time = a * atoms^b * molecules^c fitted by least squares in log-log space
+    to the last recorded calculations."""
+
+    def __init__(self, samples: int = 1000, min_samples: int = 10):
+        self._min_samples = min_samples
+        # method: last (atoms, molecules, time) samples
+        self._samples = defaultdict(lambda: deque(maxlen=samples))
+        # method: fitted coefficients (log a, b, c), methods with new samples are fitted again on demand
+        self._coefficients = {}
+
+    def add(self, method: str, atoms: int, molecules: int, time: float) -> None:
+        """Adds measured calculation time (in seconds)"""
+        self._samples[method].append((atoms, molecules, time))
+        self._coefficients.pop(method, None)
+
+    def fit(self, method: str) -> Union[None, List[float]]:
+        """Returns coefficients (log a, b, c) of method, None if there are not enough samples"""
+        if method in self._coefficients:
+            return self._coefficients[method]
+        samples = self._samples.get(method, ())
+        if len(samples) < self._min_samples:
+            return None
+        # normal equations of least squares
+        matrix = [[0.0] * 3 for _ in range(3)]
+        vector = [0.0] * 3
+        for atoms, molecules, time in samples:
+            features = get_features(atoms, molecules)
+            target = math.log(max(time, MIN_TIME))
+            for row in range(3):
+                vector[row] += features[row] * target
+                for column in range(3):
+                    matrix[row][column] += features[row] * features[column]
+        for index in (1, 2):
+            matrix[index][index] += RIDGE * len(samples)
+        self._coefficients[method] = solve(matrix, vector)
+        return self._coefficients[method]
+
+    def predict(self, method: str, atoms: int, molecules: int = 1) -> Union[None, float]:
+        """Returns predicted calculation time (in seconds), None if the method has not enough samples"""
+        coefficients = self.fit(method)
+        if coefficients is None:
+            return None
+        return math.exp(sum(coefficient * feature
+                            for coefficient, feature in zip(coefficients, get_features(atoms, molecules))))
+
+    def get_summary(self) -> Dict[str, Dict[str, Any]]:
+        """Returns fitted models of methods (time = a * atoms^b * molecules^c)"""
+        summary = {}
+        for method in sorted(self._samples):
+            coefficients = self.fit(method)
+            if coefficients is not None:
+                summary[method] = {'samples': len(self._samples[method]),
+                                   'a': float(f'{math.exp(coefficients[0]):.3g}'),
+                                   # adding zero turns negative zero into zero
+                                   'b': round(coefficients[1], 3) + 0.0,
+                                   'c': round(coefficients[2], 3) + 0.0}
+        return summary
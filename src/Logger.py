@@ -1,93 +1,189 @@
+import atexit
+import fcntl
+import json
 import logging
 import os
-from logging.handlers import QueueHandler
+import queue
+import threading
+from datetime import datetime
 from multiprocessing import Queue
-from typing import Union
-
-
-def logging_process(queue: Queue, error_file: Union[os.PathLike, str], stat_file: Union[os.PathLike, str]) -> None:
-    """Process of logging using queue"""
-    error_logger = Logger('error', file=error_file, level=logging.ERROR)
-    stat_logger = Logger('statistics', file=stat_file, level=logging.INFO)
-    for message in iter(queue.get, None):
-        error_logger.handle(message)
-        stat_logger.handle(message)
-
-
-class LevelFilter(logging.Filter):
-    def __init__(self, level: int) -> None:
-        self.__level = level
-
-    def filter(self, logRecord: logging.LogRecord) -> bool:
-        """Filtres record based on level"""
-        return logRecord.levelno == self.__level
+from typing import Any, Dict, List, Union
+
+
+class JsonLinesWriter:
+    def __init__(self, error_file: Union[os.PathLike, str], stat_file: Union[os.PathLike, str],
+                 max_bytes: int = 0, backup_count: int = 0):
+        self._error_file = error_file
+        self._stat_file = stat_file
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+
+    def rotate(self, path: Union[os.PathLike, str]) -> None:
+        """Renames file.log to file.log.1, file.log.1 to file.log.2, ... (only backup_count files are kept)"""
+        if self._backup_count <= 0:
+            os.truncate(path, 0)
+            return
+        for i in range(self._backup_count - 1, 0, -1):
+            if os.path.exists(f'{path}.{i}'):
+                os.replace(f'{path}.{i}', f'{path}.{i + 1}')
+        os.replace(path, f'{path}.1')
+
+    def write_lines(self, path: Union[os.PathLike, str], lines: List[str]) -> None:
+        """Appends lines to file, rotates the file before it would exceed max_bytes.
+        Processes writing the same file are serialized by lock on sibling file, so the file is rotated only once."""
+        data = ''.join(lines)
+        with open(f'{path}.lock', mode='a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._max_bytes > 0 and os.path.exists(path) and \
+                    os.path.getsize(path) + len(data) > self._max_bytes:
+                self.rotate(path)
+            with open(path, mode='a') as file:
+                file.write(data)
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        """Writes statistics records to statistics file and error and warning records to error file"""
+        error_lines = []
+        stat_lines = []
+        for record in records:
+            line = json.dumps(record, default=str) + '\n'
+            if record['level'] == 'INFO':
+                stat_lines.append(line)
+            else:
+                error_lines.append(line)
+        if error_lines:
+            self.write_lines(self._error_file, error_lines)
+        if stat_lines:
+            self.write_lines(self._stat_file, stat_lines)
+
+
+class QueueWriter:
+    def __init__(self, queue: Queue):
+        self._queue = queue
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        """Sends whole batch of records to logging process"""
+        self._queue.put(records)
+
+
+def logging_process(queue: Queue, error_file: Union[os.PathLike, str], stat_file: Union[os.PathLike, str],
+                    max_bytes: int = 0, backup_count: int = 0) -> None:
+    """Process of logging - writes batches of records received through queue"""
+    writer = JsonLinesWriter(error_file, stat_file, max_bytes, backup_count)
+    for records in iter(queue.get, None):
+        writer.write(records)
+
+
+class BufferedLogSink(logging.Handler):
+    def __init__(self, writer: Union[JsonLinesWriter, QueueWriter], capacity: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 1.0):
+        super().__init__()
+        self._writer = writer
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._records = queue.Queue(maxsize=capacity)
+        self._dropped = 0
+        self._thread = None
+        self._pid = None
+        self._write_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    @property
+    def dropped(self) -> int:
+        """Number of records dropped because the buffer was full"""
+        return self._dropped
+
+    def start(self) -> None:
+        """Starts flushing thread (in every process the sink is used in)"""
+        if self._pid != os.getpid():
+            with self.lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self.run, name='log-sink', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def to_dict(self, record: logging.LogRecord) -> Dict[str, Any]:
+        """Returns record with its structured fields"""
+        return {'timestamp': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'process': record.process,
+                'level': record.levelname,
+                **getattr(record, 'fields', {'message': record.getMessage()})}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Buffers record without blocking, record is dropped if the buffer is full"""
+        self.start()
+        try:
+            self._records.put_nowait(self.to_dict(record))
+        except queue.Full:
+            with self.lock:
+                self._dropped += 1
+
+    def get_batch(self, timeout: Union[None, float]) -> List[Dict[str, Any]]:
+        """Returns buffered records (at most batch_size), waits for the first one at most timeout"""
+        batch = []
+        try:
+            batch.append(self._records.get(timeout=timeout) if timeout else self._records.get_nowait())
+            while len(batch) < self._batch_size:
+                batch.append(self._records.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Writes batch of records together with number of records dropped since last write"""
+        with self.lock:
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            batch.append({'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+                          'process': os.getpid(),
+                          'level': 'WARNING',
+                          'message': 'Log records dropped, buffer of log sink was full.',
+                          'dropped_records': dropped})
+        if batch:
+            with self._write_lock:
+                try:
+                    self._writer.write(batch)
+                except Exception:
+                    with self.lock:
+                        self._dropped += len(batch)
+
+    def run(self) -> None:
+        """Flushes buffered records in batches"""
+        while True:
+            self.write_batch(self.get_batch(self._flush_interval))
+
+    def flush(self) -> None:
+        """Writes all buffered records"""
+        batch = self.get_batch(None)
+        while batch:
+            self.write_batch(batch)
+            batch = self.get_batch(None)
 
 
 class Logger:
-    def __init__(self, type: str, level: int, queue: Queue = None, file: os.PathLike = None):
-        if type == 'error':
-            self._logger = self.get_error_logger(level=level, file=file)
-        elif type == 'statistics':
-            self._logger = self.get_statistics_logger(level=level, file=file)
-        elif type == 'simple':
-            self._logger = self.get_simple_logger(queue)
-        else:
-            raise ValueError('Wrong type of logger')
-
-    def setup_logger(self, name: str, log_file: os.PathLike, level: int) -> logging.Logger:
-        """Setups logger"""
-        formatter = logging.Formatter(f'%(asctime)s'
-                                      f'%(process)d, '
-                                      f'%(message)s')
-        handler = logging.FileHandler(log_file)
-        handler.setFormatter(formatter)
-
-        logger = logging.getLogger(name)
-        logger.setLevel(level)
-        logger.addHandler(handler)
-        logger.addFilter(LevelFilter(level))
-
-        return logger
-
-    def get_error_logger(self, file: os.PathLike, level: int = logging.ERROR) -> logging.Logger:
-        """Returns logger for error messages"""
-        return self.setup_logger('error_logger', file, level)
-
-    def get_statistics_logger(self, file: os.PathLike, level=logging.INFO) -> logging.Logger:
-        """Returns logger for statistics messages"""
-        return self.setup_logger('collect_statistics_logger', file, level)
-
-    def get_simple_logger(self, queue: Queue) -> logging.Logger:
-        """Returns basic simple logger with QueueHandler"""
-        logger = logging.getLogger('api')
-        # add a handler that uses the shared queue
-        logger.addHandler(QueueHandler(queue))
-        logger.setLevel(logging.INFO)
-        return logger
+    def __init__(self, sink: logging.Handler, level: int = logging.INFO, name: str = 'api'):
+        self._logger = logging.getLogger(name)
+        # logger is shared by all applications created in process (e.g. by tests or reload),
+        # records are written only by sink of the latest one
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+            handler.flush()
+            handler.close()
+        self._logger.addHandler(sink)
+        self._logger.setLevel(level)
+        # records are written only by the sink
+        self._logger.propagate = False
 
     def log_statistics_message(self, remote_add: str, endpoint_name: str, **kwargs) -> None:
         """Logs statistics messages"""
-        result_message = []
-        result_message.append(f'{remote_add}')
-        result_message.append(f'endpoint_name={endpoint_name}')
-        if kwargs:
-            for key, value in kwargs.items():
-                result_message.append(f'{key}={value}')
-        message = ', '.join(result_message)
-        self._logger.info(message)
+        fields = {'remote_addr': remote_add, 'endpoint_name': endpoint_name, **kwargs}
+        self._logger.info('statistics', extra={'fields': fields})
 
     def log_error_message(self, remote_add: str, endpoint_name: str, error_message: str, **kwargs) -> None:
         """Logs error messages"""
-        result_message = []
-        result_message.append(f'{remote_add}')
-        result_message.append(f'endpoint_name={endpoint_name}')
-        result_message.append(f'error_message={error_message}')
-        if kwargs:
-            for key, value in kwargs.items():
-                result_message.append(f'{key}={value}')
-        message = ', '.join(result_message)
-        self._logger.error(message)
-
-    def handle(self, message):
+        fields = {'remote_addr': remote_add, 'endpoint_name': endpoint_name, 'error_message': error_message,
+                  **kwargs}
+        self._logger.error(error_message, extra={'fields': fields})
+
+    def handle(self, message: logging.LogRecord) -> None:
         """Handles message"""
         self._logger.handle(message)
@@ -0,0 +1,48 @@
+import cProfile
+import hmac
+import os
+import threading
+import time
+import uuid
+from typing import Union
+
+
+class RequestProfiler:
+    def __init__(self, token: str, directory: Union[str, os.PathLike]):
+        self._token = token
+        self._directory = directory
+        # only one profiler can be active in interpreter (sys.monitoring since python 3.12)
+        self._lock = threading.Lock()
+
+    def is_requested(self, token: Union[None, str]) -> bool:
+        """Returns whether profiling was requested with valid admin token"""
+        return bool(token) and hmac.compare_digest(token, self._token)
+
+    def start(self) -> Union[None, cProfile.Profile]:
+        """Starts deterministic profiling of current thread,
+        returns None if another request is being profiled"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # profiler not started by this object is active
+            self._lock.release()
+            return None
+        return profile
+
+    def discard(self, profile: cProfile.Profile) -> None:
+        """Stops profiling without saving the profile"""
+        try:
+            profile.disable()
+        finally:
+            self._lock.release()
+
+    def stop(self, profile: cProfile.Profile) -> str:
+        """Stops profiling and saves profile in pstats format, returns ID of profile"""
+        self.discard(profile)
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        os.makedirs(self._directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self._directory, f'{profile_id}.pstats'))
+        return profile_id
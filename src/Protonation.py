@@ -0,0 +1,156 @@
+import copy
+import multiprocessing
+import os
+from multiprocessing.pool import AsyncResult
+from typing import Any, Callable, Union
+
+from Workers import WorkerPool
+
+# set in every worker process by init_pdb2pqr_worker
+_parser = None
+_main_driver = None
+_forcefields = {}
+
+# two-letter elements of hetero residues which are not ions, names of their atoms start with the element (e.g. FE)
+HETERO_ELEMENTS = {'HEM': ('FE',), 'HEC': ('FE',), 'HEA': ('FE',), 'HEB': ('FE',), 'SF4': ('FE',), 'FES': ('FE',),
+                   'F3S': ('FE',), 'CLA': ('MG',), 'BCL': ('MG',), 'CHL': ('MG',), 'B12': ('CO',), 'CNC': ('CO',),
+                   'COB': ('CO',), 'ZNH': ('ZN',), 'CUA': ('CU',)}
+# halogens of ligands are named by their element (e.g. CL1, BR2)
+HETERO_HALOGENS = ('CL', 'BR')
+
+
+class Pdb2pqrError(ValueError):
+    """Error reported by pdb2pqr while protonating structure"""
+
+
+def init_pdb2pqr_worker() -> None:
+    """Imports pdb2pqr and loads its residue definitions and force fields only once per worker process"""
+    global _parser, _main_driver
+    from pdb2pqr import io, forcefield
+    from pdb2pqr.main import build_main_parser, main_driver
+
+    definition = io.get_definitions()
+    original_forcefield = forcefield.Forcefield
+
+    def get_definitions(*args, **kwargs):
+        # definitions are modified while protonating, every run gets its own copy
+        return copy.deepcopy(definition)
+
+    def get_forcefield(ff_name, definition, userff=None, usernames=None):
+        key = (ff_name, userff, usernames)
+        if key not in _forcefields:
+            _forcefields[key] = original_forcefield(ff_name, definition, userff, usernames)
+        return _forcefields[key]
+
+    io.get_definitions = get_definitions
+    forcefield.Forcefield = get_forcefield
+    _parser = build_main_parser()
+    _main_driver = main_driver
+
+
+def protonate(input_file: Union[str, os.PathLike], output_file: Union[str, os.PathLike],
+              ph: Union[str, float], noopt: bool) -> str:
+    """Adds hydrogens to input_file and saves result to output_file in .pqr format (runs in worker process)"""
+    options = ['--noopt'] if noopt else []
+    options += ['--pH', f'{ph}', f'{input_file}', f'{output_file}']
+    try:
+        _main_driver(_parser.parse_args(options))
+    except SystemExit as e:
+        # argparse and pdb2pqr exit on invalid options
+        raise Pdb2pqrError(f'invalid options (exit status {e.code})')
+    except Exception as e:
+        raise Pdb2pqrError(f'{type(e).__name__}: {e}')
+    if not os.path.exists(output_file):
+        raise Pdb2pqrError('no .pqr file was produced')
+    return str(output_file)
+
+
+class Pdb2pqr:
+    def __init__(self, workers: int, max_tasks_per_worker: int, timeout: float):
+        self._pool = WorkerPool(workers, init_pdb2pqr_worker, maxtasksperchild=max_tasks_per_worker)
+        self._timeout = timeout
+
+    def submit(self, input_file: Union[str, os.PathLike], output_file: Union[str, os.PathLike],
+               ph: Union[str, float], noopt: bool, callback: Union[None, Callable[[Any], None]] = None) -> AsyncResult:
+        """Submits protonation to worker pool, callback is called when it finishes"""
+        return self._pool.submit(protonate, (str(input_file), str(output_file), ph, noopt), callback)
+
+    def wait(self, result: AsyncResult) -> str:
+        """Waits for submitted protonation and returns path to .pqr file"""
+        try:
+            return result.get(self._timeout)
+        except multiprocessing.TimeoutError:
+            raise Pdb2pqrError(f'calculation exceeded {self._timeout}s')
+
+    def run(self, input_file: Union[str, os.PathLike], output_file: Union[str, os.PathLike],
+            ph: Union[str, float], noopt: bool) -> str:
+        """Adds hydrogens using pdb2pqr, returns path to .pqr file"""
+        return self.wait(self.submit(input_file, output_file, ph, noopt))
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+def get_element(atom_name: str, residue_name: str, record: str, element: str = '') -> str:
+    """Returns element symbol - element column if it is present, otherwise element derived from atom name"""
+    if element.strip().isalpha():
+        return element.strip().upper()
+    # ions and other single atom hetero residues are named by their element (e.g. ZN, MG)
+    if record == 'HETATM' and atom_name == residue_name and len(atom_name) <= 2:
+        return atom_name
+    if record == 'HETATM':
+        for two_letter_element in HETERO_ELEMENTS.get(residue_name, ()) + HETERO_HALOGENS:
+            if atom_name.upper().startswith(two_letter_element):
+                return two_letter_element
+    for char in atom_name:
+        if char.isalpha():
+            return char
+    raise ValueError(f'Not possible to derive element from atom name {atom_name}.')
+
+
+def format_atom_name(atom_name: str, element: str) -> str:
+    """Returns atom name aligned to pdb columns 13-16"""
+    if len(atom_name) < 4 and len(element) == 1:
+        return f' {atom_name:<3s}'
+    return f'{atom_name:<4s}'
+
+
+def pqr_to_pdb_line(line: str, charges_to_columns: bool = False) -> str:
+    """Converts ATOM/HETATM record from whitespace separated .pqr format to fixed column .pdb format"""
+    # element is in columns 77-78 of fixed column records, whitespace separated records may end with it
+    element = line[76:78] if len(line.rstrip('\n')) >= 78 else ''
+    fields = line.split()
+    if fields and fields[-1].isalpha():
+        element = fields.pop()
+    if len(fields) not in (10, 11):
+        raise ValueError(f'Invalid .pqr record: {line.strip()}')
+    record, serial, atom_name, residue_name = fields[:4]
+    # chain identifier is optional in .pqr format
+    chain = fields[4] if len(fields) == 11 else ''
+    residue_number = fields[-6]
+    x, y, z, charge, radius = map(float, fields[-5:])
+    insertion_code = ''
+    if not residue_number.lstrip('-').isdigit():
+        residue_number, insertion_code = residue_number[:-1], residue_number[-1]
+    element = get_element(atom_name, residue_name, record, element)
+    if charges_to_columns:
+        occupancy, temperature_factor = f'{charge:6.3f}', f'{radius:6.3f}'
+    else:
+        occupancy, temperature_factor = '  1.00', '  0.00'
+    return (f'{record:<6s}{int(serial) % 100000:5d} {format_atom_name(atom_name, element)} '
+            f'{residue_name:>3s} {chain[:1]:1s}{int(residue_number):4d}{insertion_code:1s}   '
+            f'{x:8.3f}{y:8.3f}{z:8.3f}{occupancy}{temperature_factor}'
+            f'          {element:>2s}\n')
+
+
+def convert_pqr_to_pdb(pqr_file: Union[str, os.PathLike], pdb_file: Union[str, os.PathLike],
+                       charges_to_columns: bool = False) -> None:
+    """Converts .pqr to .pdb format line by line, keeps residue and atom naming of pdb2pqr.
+    If charges_to_columns is set, pdb2pqr charges and radii are written to occupancy and B-factor columns."""
+    with open(pqr_file) as pqr, open(pdb_file, mode='w') as pdb:
+        for line in pqr:
+            if line.startswith(('ATOM', 'HETATM')):
+                pdb.write(pqr_to_pdb_line(line, charges_to_columns))
+            elif line.startswith('TER'):
+                pdb.write('TER\n')
+        pdb.write('END\n')
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 from flask import jsonify, request
 from typing import Any, Dict, Tuple, Union
 from Logger import Logger
+from Timing import get_phase_durations
 from werkzeug.local import LocalProxy
 
 
@@ -37,8 +38,10 @@ class OKResponse(Response):
             args['number_of_sent_files'] = len(self._request.files.getlist('file[]'))
         if self._request.args.getlist('pid[]'):
             args['number_of_requested_structures'] = len(self._request.args.getlist('pid[]'))
+            args['pdb_ids'] = self._request.args.getlist('pid[]')
         if self._request.args.getlist('cid[]'):
             args['number_of_requested_structures'] = len(self._request.args.getlist('cid[]'))
+            args['cids'] = self._request.args.getlist('cid[]')
         if self._request.args.get('structure_id'):
             args['structure_id'] = self._request.args.get('structure_id')
         if self._request.args.get('pH'):
@@ -49,18 +52,27 @@ class OKResponse(Response):
             args['number_of_individual_atoms'] = self._data['Number of individual atoms']
         if 'suitable_methods' in self._request.path:
             args['suitable_methods'] = self._data['suitable_methods']
+        durations = get_phase_durations()
+        if durations:
+            args['phase_durations'] = durations
         logger.log_statistics_message(self._request.remote_addr, endpoint_name=self._request.path, **args)
 
 
 class ErrorResponse(Response):
-    def __init__(self, message: str, status_code: int = 404, request: LocalProxy = request):
+    def __init__(self, message: str, status_code: int = 404, request: LocalProxy = request,
+                 headers: Dict[str, str] = None):
         super().__init__(status_code, message)
         self._request = request
+        self._headers = headers
 
     @property
-    def json(self) -> Tuple[Dict[str, Union[str, int]], int]:
-        return {'status_code': self._status_code,
-                'message': self._message}, self._status_code
+    def json(self) -> Union[Tuple[Dict[str, Union[str, int]], int],
+                            Tuple[Dict[str, Union[str, int]], int, Dict[str, str]]]:
+        body = {'status_code': self._status_code,
+                'message': self._message}
+        if self._headers:
+            return body, self._status_code, self._headers
+        return body, self._status_code
 
     def log(self, logger: Logger) -> None:
         """Logs error messages"""
@@ -0,0 +1,212 @@
+import heapq
+import math
+import os
+import socket
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, Tuple, Union
+
+from Statistics import get_percentiles
+
+# waiting tasks check tickets of terminated processes at least this often (in seconds)
+RECLAIM_INTERVAL = 1.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when task cannot be admitted - the queue is full or task waited too long"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, retry_after)
+        self.message = message
+        self.retry_after = retry_after
+
+    def __str__(self) -> str:
+        return self.message
+
+
+def get_rounded_percentiles(values: Iterable[float]) -> Dict[str, float]:
+    values = list(values)
+    if not values:
+        return {}
+    return {key: round(value, 3) for key, value in get_percentiles(values, (50, 95, 99)).items()}
+
+
+def get_owner() -> Tuple[str, int]:
+    """Returns owner of tickets acquired by current process"""
+    return socket.gethostname(), os.getpid()
+
+
+def is_process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class CalculationScheduler:
+    """Limits number of concurrently running CPU demanding tasks, the other tasks wait in bounded queue.
+    Waiting tasks are started in order of weighted fair queuing - every user gets share of capacity
+    proportional to its weight, regardless of number of tasks he submitted.
+    Scheduler lives in state server, so the limit is global for all worker processes using it.
+    Tickets which were not released (their process was terminated or they are held longer than lease)
+    are reclaimed, so that they do not block the capacity forever."""
+
+    def __init__(self, max_concurrent: int, queue_size: int, max_wait: float, user_queue_size: int = 0,
+                 lease: float = 0.0, window: float = 60.0, samples: int = 1000):
+        self._max_concurrent = max_concurrent
+        self._queue_size = queue_size
+        self._user_queue_size = user_queue_size or queue_size
+        self._max_wait = max_wait
+        self._lease = lease
+        self._host = socket.gethostname()
+        self._window = window
+        self._condition = threading.Condition()
+        # heap of waiting tasks (virtual finish time, ticket, user)
+        self._queue = []
+        self._queued_users = Counter()
+        # virtual time of scheduler and virtual finish time of the last task of every user
+        self._virtual_time = 0.0
+        self._finish_times = {}
+        # ticket: (start, owner) of running tasks
+        self._running = {}
+        self._next_ticket = 0
+        self._created = time.monotonic()
+        # finish times of tasks in the last window, durations and waits of the last tasks
+        self._completions = deque()
+        self._durations = deque(maxlen=samples)
+        self._waits = deque(maxlen=samples)
+        self._admitted = 0
+        self._rejected = 0
+        self._reclaimed = 0
+
+    def _get_throughput(self, now: float) -> float:
+        """Returns number of tasks finished per second in the last window"""
+        while self._completions and now - self._completions[0] > self._window:
+            self._completions.popleft()
+        elapsed = min(self._window, now - self._created)
+        return len(self._completions) / elapsed if elapsed > 0 else 0.0
+
+    def _estimate_wait(self, position: int, now: float) -> int:
+        """Returns estimated time (in seconds) until task at position in queue is started"""
+        throughput = self._get_throughput(now)
+        if throughput > 0:
+            wait = position / throughput
+        elif self._durations:
+            wait = sum(self._durations) / len(self._durations) * math.ceil(position / self._max_concurrent)
+        else:
+            wait = self._max_wait
+        return max(1, math.ceil(wait))
+
+    def _get_position(self, entry: Tuple[float, int, str]) -> int:
+        return sum(1 for other in self._queue if other < entry) + 1
+
+    def _remove(self, entry: Tuple[float, int, str]) -> None:
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._queued_users[entry[2]] -= 1
+        if not self._queued_users[entry[2]]:
+            del self._queued_users[entry[2]]
+
+    def _reclaim(self, now: float) -> None:
+        """Releases tickets held longer than lease and tickets of terminated processes of this host"""
+        for ticket, (start, owner) in list(self._running.items()):
+            if (self._lease and now - start > self._lease) or \
+                    (owner is not None and owner[0] == self._host and not is_process_running(owner[1])):
+                del self._running[ticket]
+                self._reclaimed += 1
+
+    def _forget_idle_users(self) -> None:
+        """Users without backlog start from current virtual time, their finish times are not needed"""
+        for user in [user for user, finish in self._finish_times.items()
+                     if finish <= self._virtual_time and user not in self._queued_users]:
+            del self._finish_times[user]
+
+    def acquire(self, user: str = '', weight: float = 1.0, cost: float = 1.0,
+                owner: Union[None, Tuple[str, int]] = None) -> int:
+        """Waits until task of user may run, returns ticket which has to be released when task finishes.
+        Task with higher cost (e.g. estimated time) or user with lower weight gets smaller share of capacity.
+        Owner (host name, process ID) is the process which releases the ticket."""
+        with self._condition:
+            now = time.monotonic()
+            self._reclaim(now)
+            if len(self._queue) >= self._queue_size:
+                self._rejected += 1
+                raise AdmissionRejected('Server is busy, too many calculations are waiting.',
+                                        self._estimate_wait(len(self._queue) + 1, now))
+            if self._queued_users[user] >= self._user_queue_size:
+                self._rejected += 1
+                raise AdmissionRejected('Too many of your calculations are waiting.',
+                                        self._estimate_wait(self._queued_users[user] + 1, now))
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            previous_finish = self._finish_times.get(user)
+            finish = max(self._virtual_time, previous_finish or 0.0) + cost / weight
+            self._finish_times[user] = finish
+            entry = (finish, ticket, user)
+            heapq.heappush(self._queue, entry)
+            self._queued_users[user] += 1
+            deadline = now + self._max_wait
+            while self._queue[0] != entry or len(self._running) >= self._max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    position = self._get_position(entry)
+                    self._remove(entry)
+                    # task which did not run is not charged to user (unless his later tasks were queued after it)
+                    if self._finish_times.get(user) == finish:
+                        if previous_finish is None:
+                            del self._finish_times[user]
+                        else:
+                            self._finish_times[user] = previous_finish
+                    self._rejected += 1
+                    # next task may be able to start now
+                    self._condition.notify_all()
+                    raise AdmissionRejected(f'Server is busy, calculation waited more than {self._max_wait}s.',
+                                            self._estimate_wait(position, time.monotonic()))
+                self._condition.wait(min(remaining, RECLAIM_INTERVAL))
+                self._reclaim(time.monotonic())
+            self._remove(entry)
+            self._virtual_time = max(self._virtual_time, finish - cost / weight)
+            self._forget_idle_users()
+            start = time.monotonic()
+            self._running[ticket] = (start, owner)
+            self._waits.append(start - now)
+            self._admitted += 1
+            self._condition.notify_all()
+            return ticket
+
+    def charge(self, user: str, weight: float = 1.0, cost: float = 1.0) -> None:
+        """Charges user for work which runs as part of task of another user (e.g. in batch of calculations),
+        the next tasks of user wait as if the work was his own task"""
+        with self._condition:
+            self._finish_times[user] = max(self._virtual_time, self._finish_times.get(user, 0.0)) + cost / weight
+
+    def release(self, ticket: int) -> None:
+        """Marks task as finished, the first waiting task is started"""
+        with self._condition:
+            start, _ = self._running.pop(ticket, (None, None))
+            if start is not None:
+                now = time.monotonic()
+                self._durations.append(now - start)
+                self._completions.append(now)
+            self._condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns current queue depth and statistics of waiting and running tasks (times in seconds)"""
+        with self._condition:
+            self._reclaim(time.monotonic())
+            return {'max_concurrent': self._max_concurrent,
+                    'queue_size': self._queue_size,
+                    'running': len(self._running),
+                    'waiting': len(self._queue),
+                    'waiting_users': len(self._queued_users),
+                    'admitted': self._admitted,
+                    'rejected': self._rejected,
+                    'reclaimed': self._reclaimed,
+                    'throughput': round(self._get_throughput(time.monotonic()), 3),
+                    'wait': get_rounded_percentiles(self._waits),
+                    'duration': get_rounded_percentiles(self._durations)}
+
@@ -0,0 +1,306 @@
+import configparser
+import logging
+import math
+import os
+import threading
+from multiprocessing import Process, Queue, current_process
+from typing import Any, Callable, Dict, Union
+
+from Batching import MicroBatcher, SingleFlight
+from Logger import Logger, BufferedLogSink, JsonLinesWriter, QueueWriter, logging_process
+from Protonation import Pdb2pqr
+from Scheduler import CalculationScheduler
+from State import Election, StateManager, connect_state_manager, forget_connections
+from Statistics import StatisticsAggregator
+from Structures import MethodCatalogue, get_method_catalogue
+from Workers import WorkerPool
+from remove_old_files import RepeatTimer, delete_old_records, increase_limit
+
+# lanes of CPU demanding tasks - small tasks optimised for latency, large tasks for throughput
+LANES = ('fast', 'slow')
+# minimal cost (estimated time in seconds) of task in fair queuing
+MIN_COST = 0.001
+# services created again in forked process - proxies of state server (and services using them),
+# services running threads and pools of processes
+FORKED_SERVICES = ('manager', 'file_manager', 'user_id_manager', 'sidecar_manager', 'long_calculations', 'used_space',
+                   'schedulers', 'single_flight', 'statistics', 'micro_batcher', 'calculation_pool', 'pdb2pqr')
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """Parses comma separated user:weight pairs (user may be IPv6 address containing colons)"""
+    weights = {}
+    for item in value.split(','):
+        if item.strip():
+            user, _, weight = item.strip().rpartition(':')
+            error = f'Invalid weight of user in fair queuing: {item.strip()} (expected user:positive weight).'
+            try:
+                weights[user] = float(weight)
+            except ValueError:
+                raise ValueError(error)
+            if not user or not 0 < weights[user] < math.inf:
+                raise ValueError(error)
+    return weights
+
+
+class Services:
+    """Background services and state of API. Nothing is started until it is used for the first time,
+    so that worker processes start quickly and processes forked from them do not inherit running threads."""
+
+    def __init__(self, config: configparser.ConfigParser):
+        self.config = config
+        self.limitations_on = config['limits']['on'] == 'True'
+        self._address = config['state']['address']
+        # weights are parsed at start, so that invalid configuration is not found by requests
+        self.user_weights = parse_weights(config['scheduler']['weights'])
+        self._lock = threading.RLock()
+        self._services = {}
+        self._timers = []
+        self._manager_pid = None
+        self._parent_manager_address = None
+        self._cost_model_timer = None
+        self._sweeper = Election(os.path.join(config['state']['lock_dir'], 'api_acc2_sweeper.lock')
+                                 if self._address else None)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        """Threads and locks are not inherited by forked process (e.g. worker forked from preloaded application),
+        connections to state server must not be shared with parent process, services using them are created
+        again on the first use"""
+        self._lock = threading.RLock()
+        self._timers = []
+        self._cost_model_timer = None
+        manager = self._services.get('manager')
+        if manager is not None and not self._address:
+            # private state of parent process is shared with processes forked from it
+            self._parent_manager_address = manager.address
+        # log sink restarts its thread by itself
+        for name in FORKED_SERVICES:
+            self._services.pop(name, None)
+        forget_connections()
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    service = self._services[name] = factory()
+        return service
+
+    def _create_manager(self) -> StateManager:
+        if self._address:
+            if not self.config['state']['authkey']:
+                raise ValueError('Authentication key of state server is not set.')
+            return connect_state_manager(self._address, self.config['state']['authkey'].encode(),
+                                         os.path.join(self.config['state']['lock_dir'], 'api_acc2_state.lock'))
+        if self._parent_manager_address is not None:
+            # manager started by parent process authenticates with authentication key inherited from it
+            manager = StateManager(address=self._parent_manager_address, authkey=current_process().authkey)
+            manager.connect()
+            return manager
+        manager = StateManager()
+        manager.start()
+        self._manager_pid = os.getpid()
+        return manager
+
+    @property
+    def manager(self) -> StateManager:
+        return self._get('manager', self._create_manager)
+
+    def _get_state(self, name: str) -> Dict:
+        self.start_sweeper()
+        return self._get(name, lambda: self.manager.get_dict(name))
+
+    @property
+    def file_manager(self) -> Dict:
+        return self._get_state('file_manager')
+
+    @property
+    def user_id_manager(self) -> Dict:
+        return self._get_state('user_id_manager')
+
+    @property
+    def sidecar_manager(self) -> Dict:
+        return self._get_state('sidecar_manager')
+
+    @property
+    def long_calculations(self) -> Dict:
+        return self._get_state('long_calculations')
+
+    @property
+    def used_space(self) -> Dict:
+        return self._get_state('used_space')
+
+    def is_sweeper(self) -> bool:
+        """Returns whether current process removes old files and decreases restrictions.
+        Shared state is swept by single elected process, private state by the process which owns it."""
+        if self._address:
+            return self._sweeper.is_elected()
+        return self._manager_pid == os.getpid()
+
+    def sweep(self) -> None:
+        """Removes old records of file manager together with files"""
+        if self.is_sweeper():
+            delete_old_records(self.file_manager, self.user_id_manager, float(self.config['remove_tmp']['older_than']),
+                               self.config['remove_tmp']['log'], self.sidecar_manager)
+
+    def decrease_restrictions(self) -> None:
+        """Decreases number of long calculations of users"""
+        if self.is_sweeper():
+            increase_limit(self.long_calculations)
+
+    def start_sweeper(self) -> None:
+        """Starts periodical removing of old files (and decreasing of restrictions) in current process"""
+        if self._timers:
+            return
+        with self._lock:
+            if self._timers:
+                return
+            timers = [RepeatTimer(float(self.config['remove_tmp']['every_x_seconds']), self.sweep)]
+            if self.limitations_on:
+                timers.append(RepeatTimer(float(self.config['limits']['decrease_restriction']),
+                                          self.decrease_restrictions))
+            for timer in timers:
+                timer.daemon = True
+                timer.start()
+            self._timers = timers
+
+    def _create_scheduler(self, lane: str) -> CalculationScheduler:
+        # admission of CPU demanding tasks is global for all processes sharing state server
+        config = self.config[f'{lane}_lane']
+        max_concurrent = int(config['max_concurrent'])
+        if not max_concurrent:
+            max_concurrent = max(1, os.cpu_count() - int(self.config['fast_lane']['max_concurrent']))
+        return self.manager.get_object(f'scheduler_{lane}', CalculationScheduler, max_concurrent,
+                                       int(config['queue_size']), float(config['max_wait']),
+                                       int(config['user_queue_size']), float(self.config['scheduler']['lease']))
+
+    @property
+    def schedulers(self) -> Dict[str, CalculationScheduler]:
+        return self._get('schedulers', lambda: {lane: self._create_scheduler(lane) for lane in LANES})
+
+    def get_scheduler(self, atoms: Union[None, int]) -> CalculationScheduler:
+        """Returns scheduler of lane for task processing given number of atoms (slow lane if it is not known)"""
+        if atoms is not None and atoms <= int(self.config['scheduler']['fast_lane_atoms']):
+            return self.schedulers['fast']
+        return self.schedulers['slow']
+
+    @property
+    def single_flight(self) -> SingleFlight:
+        # identical calculations are deduplicated across all processes sharing state server
+        return self._get('single_flight', lambda: self.manager.get_object(
+            'single_flight', SingleFlight, float(self.config['single_flight']['timeout'])))
+
+    @property
+    def micro_batcher(self) -> MicroBatcher:
+        # batches are collected only from threads of current process
+        return self._get('micro_batcher', lambda: MicroBatcher(float(self.config['batching']['delay']),
+                                                               int(self.config['batching']['max_size'])))
+
+    @property
+    def calculation_pool(self) -> WorkerPool:
+        # pool of processes calculating chunks of large structures, processes are started by the first chunk,
+        # number of chunks running at once is limited by scheduler
+        return self._get('calculation_pool',
+                         lambda: WorkerPool(int(self.config['chunking']['workers']) or os.cpu_count(),
+                                            start_method=self.config['chunking']['start_method']))
+
+    def _create_logger(self) -> Logger:
+        # log records are buffered in process and written in batches by separate thread,
+        # either directly to files or through logging process
+        config = self.config
+        log_writer = JsonLinesWriter(config['paths']['log_error'], config['paths']['save_statistics_file'],
+                                     max_bytes=int(config['logging']['max_bytes']),
+                                     backup_count=int(config['logging']['backup_count']))
+        if config['logging']['sink'] == 'process':
+            queue = Queue()
+            log_process = Process(target=logging_process,
+                                  args=(queue, config['paths']['log_error'], config['paths']['save_statistics_file'],
+                                        int(config['logging']['max_bytes']), int(config['logging']['backup_count'])),
+                                  daemon=True)
+            log_process.start()
+            log_writer = QueueWriter(queue)
+        log_sink = BufferedLogSink(log_writer,
+                                   capacity=int(config['logging']['capacity']),
+                                   batch_size=int(config['logging']['batch_size']),
+                                   flush_interval=float(config['logging']['flush_interval']))
+        return Logger(log_sink, logging.INFO)
+
+    @property
+    def simple_logger(self) -> Logger:
+        return self._get('simple_logger', self._create_logger)
+
+    @property
+    def method_catalogue(self) -> MethodCatalogue:
+        # catalogue of methods is loaded once per worker process
+        return self._get('method_catalogue', get_method_catalogue)
+
+    @property
+    def pdb2pqr(self) -> Pdb2pqr:
+        # pool of pdb2pqr workers is started by the first protonation
+        return self._get('pdb2pqr', lambda: Pdb2pqr(workers=int(self.config['pdb2pqr']['workers']),
+                                                    max_tasks_per_worker=int(self.config['pdb2pqr']
+                                                                             ['max_tasks_per_worker']),
+                                                    timeout=float(self.config['pdb2pqr']['timeout'])))
+
+    @property
+    def statistics(self) -> StatisticsAggregator:
+        # statistics log is ingested incrementally, only newly appended records are read
+        return self._get('statistics', lambda: StatisticsAggregator(
+            samples=int(self.config['statistics']['samples']), top=int(self.config['statistics']['top']),
+            min_samples=int(self.config['cost_model']['min_samples'])))
+
+    def refresh_cost_model(self, blocking: bool = True) -> None:
+        """Reads new records of statistics log into cost model"""
+        self.statistics.ingest_file(self.config['paths']['save_statistics_file'], blocking)
+
+    def refresh_statistics(self) -> None:
+        """Starts reading of new records of statistics log in background (unless it is being read already),
+        statistics ingested so far are available immediately"""
+        self.start_cost_model()
+        threading.Thread(target=self.refresh_cost_model, args=(False,), name='statistics', daemon=True).start()
+
+    def start_cost_model(self) -> None:
+        """Starts periodical reading of statistics log by cost model in current process,
+        requests do not wait for reading of the log"""
+        if self._cost_model_timer is not None:
+            return
+        with self._lock:
+            if self._cost_model_timer is not None:
+                return
+            timer = RepeatTimer(float(self.config['cost_model']['refresh_interval']), self.refresh_cost_model)
+            timer.daemon = True
+            timer.start()
+            # the first reading does not wait for the interval
+            threading.Thread(target=self.refresh_cost_model, name='cost-model', daemon=True).start()
+            self._cost_model_timer = timer
+
+    def estimate_calc_time(self, method: str, atoms: int, molecules: int = 1) -> Union[None, float]:
+        """Returns calculation time (in seconds) predicted by cost model fitted to statistics log,
+        None if the method was not calculated enough times yet"""
+        self.start_cost_model()
+        return self.statistics.predict_calc_time(method, atoms, molecules)
+
+    def get_cost(self, atoms: Union[None, int], estimated_time: Union[None, float] = None) -> float:
+        """Returns cost of task in fair queuing - its estimated time (in seconds), time of task which is not
+        predicted by cost model (e.g. pdb2pqr, conversions) is estimated from number of atoms"""
+        if estimated_time is None:
+            if atoms is None:
+                estimated_time = float(self.config['cost_model']['unpredicted_time'])
+            else:
+                estimated_time = float(self.config['cost_model']['unpredicted_time_per_atom']) * atoms
+        return max(estimated_time, MIN_COST)
+
+    def close(self) -> None:
+        """Stops background threads of current process"""
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        if self._cost_model_timer is not None:
+            self._cost_model_timer.cancel()
+            self._cost_model_timer = None
+        self._sweeper.resign()
+        if 'pdb2pqr' in self._services:
+            self._services['pdb2pqr'].close()
+        if 'calculation_pool' in self._services:
+            self._services['calculation_pool'].close()
@@ -0,0 +1,159 @@
+import argparse
+import fcntl
+import os
+import signal
+import time
+from multiprocessing import current_process
+from multiprocessing.managers import BaseProxy, DictProxy, SyncManager
+from typing import Any, Callable, Dict, Tuple, Union
+
+# environment variable used to pass authentication key to state server started from command line
+# (it is not visible in list of processes)
+AUTHKEY_VARIABLE = 'API_ACC2_STATE_AUTHKEY'
+# signals whose handlers of worker process (e.g. of application server) are reset in state server
+RESET_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2)
+
+# objects living in state server, created on the first request
+_shared_dicts = {}
+_shared_objects = {}
+
+
+def get_shared_dict(name: str) -> Dict:
+    """Returns dictionary of state server shared by all connected processes"""
+    return _shared_dicts.setdefault(name, {})
+
+
+def get_shared_object(name: str, factory: Callable[..., Any], *args: Any) -> Any:
+    """Returns object of state server shared by all connected processes,
+    it is created by factory (class or function importable by state server) on the first request"""
+    if name not in _shared_objects:
+        _shared_objects[name] = factory(*args)
+    return _shared_objects[name]
+
+
+class StateManager(SyncManager):
+    """Manager of state shared by worker processes of API"""
+
+
+StateManager.register('get_dict', callable=get_shared_dict, proxytype=DictProxy)
+StateManager.register('get_object', callable=get_shared_object)
+
+
+def forget_connections() -> None:
+    """Forgets connections to state servers inherited by forked process, new proxies open their own connections.
+    Only processes started by multiprocessing forget them by themselves, processes forked by application server
+    (e.g. from preloaded application) would share them with parent process."""
+    BaseProxy._address_to_local.clear()
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """Returns address of state server - (host, port) or path to unix socket"""
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def start_state_server(address: str, authkey: bytes) -> None:
+    """Starts state server in detached process, it outlives the process which started it.
+    The process is forked (not executed by sys.executable, which is not python interpreter
+    when API is embedded in web server, e.g. by mod_wsgi)."""
+    pid = os.fork()
+    if pid:
+        # intermediate process exits immediately after forking the server
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        # server must not hold locks and sockets of worker process (e.g. lock of state server start)
+        os.closerange(3, os.sysconf('SC_OPEN_MAX'))
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+        if devnull > 2:
+            os.close(devnull)
+        for signal_number in RESET_SIGNALS:
+            signal.signal(signal_number, signal.SIG_DFL)
+        serve(address, authkey)
+    finally:
+        os._exit(0)
+
+
+def try_connect(manager: StateManager) -> bool:
+    try:
+        manager.connect()
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    return True
+
+
+def connect_state_manager(address: str, authkey: bytes, lock_file: Union[str, os.PathLike],
+                          timeout: float = 10.0) -> StateManager:
+    """Connects to state server, starts it if it is not running.
+    Only the process holding lock on lock file starts the server, the other processes wait for it."""
+    # proxies nested in shared objects (e.g. lists of user's structures) authenticate with key of process
+    current_process().authkey = authkey
+    manager = StateManager(address=parse_address(address), authkey=authkey)
+    if try_connect(manager):
+        return manager
+    with open(lock_file, mode='a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if try_connect(manager):
+            return manager
+        if not isinstance(manager.address, tuple) and os.path.exists(manager.address):
+            # socket left by terminated server
+            os.remove(manager.address)
+        start_state_server(address, authkey)
+        deadline = time.monotonic() + timeout
+        while not try_connect(manager):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'State server at {address} did not start.')
+            time.sleep(0.05)
+    return manager
+
+
+class Election:
+    """Election of single process among processes sharing the lock file (e.g. to run periodical tasks).
+    Lock is released when the elected process terminates, so another process is elected by the next call."""
+
+    def __init__(self, lock_file: Union[None, str, os.PathLike]):
+        self._lock_file = lock_file
+        self._lock = None
+        self._pid = os.getpid()
+
+    def is_elected(self) -> bool:
+        """Returns whether current process is elected, tries to acquire lock if it is not"""
+        if self._lock_file is None:
+            return True
+        if self._pid != os.getpid():
+            # lock inherited from parent process is still held by parent
+            self._lock = None
+            self._pid = os.getpid()
+        if self._lock is None:
+            lock = open(self._lock_file, mode='a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                return False
+            self._lock = lock
+        return True
+
+    def resign(self) -> None:
+        if self._lock is not None and self._pid == os.getpid():
+            self._lock.close()
+        self._lock = None
+
+
+def serve(address: str, authkey: bytes) -> None:
+    """Runs state server until it is terminated"""
+    StateManager(address=parse_address(address), authkey=authkey).get_server().serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Server of state shared by worker processes of API')
+    parser.add_argument('--address', required=True, help='host:port or path to unix socket')
+    args = parser.parse_args()
+    serve(args.address, os.environ[AUTHKEY_VARIABLE].encode())
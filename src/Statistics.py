@@ -0,0 +1,200 @@
+import argparse
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, Iterable, List, Union
+
+from CostModel import CostModel
+
+# legacy text records: '<asctime><pid>, <remote address>, key=value, key=value, ...'
+LEGACY_RECORD = re.compile(r'^(?P<timestamp>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3})(?P<process>\d+), '
+                           r'(?P<remote_addr>[^,]*), (?P<fields>.*)$')
+LEGACY_FIELD_SEPARATOR = re.compile(r', (?=\w+=)')
+
+# calculation times are bucketed by number of atoms of the structure
+ATOM_COUNT_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+# records read from statistics log are added in batches of this size
+INGEST_BATCH = 1000
+
+
+def convert_value(value: str) -> Any:
+    """Converts value of legacy record to int or float if possible"""
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_record(line: str) -> Union[None, Dict[str, Any]]:
+    """Parses record of statistics log - json line or legacy text record"""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    match = LEGACY_RECORD.match(line)
+    if not match:
+        return None
+    record = {'timestamp': match['timestamp'].replace(',', '.'),
+              'process': int(match['process']),
+              'level': 'INFO',
+              'remote_addr': match['remote_addr']}
+    for field in LEGACY_FIELD_SEPARATOR.split(match['fields']):
+        key, _, value = field.partition('=')
+        record[key] = convert_value(value)
+    return record
+
+
+def get_atom_count_bucket(atom_count: int) -> str:
+    """Returns label of atom count bucket (e.g. '<1000')"""
+    for bound in ATOM_COUNT_BUCKETS:
+        if atom_count < bound:
+            return f'<{bound}'
+    return f'>={ATOM_COUNT_BUCKETS[-1]}'
+
+
+def get_percentiles(values: Iterable[float], percentiles: Iterable[int] = (50, 90, 99)) -> Dict[str, float]:
+    """Returns percentiles of values (nearest rank)"""
+    values = sorted(values)
+    result = {}
+    for percentile in percentiles:
+        rank = max(1, math.ceil(percentile / 100 * len(values)))
+        result[f'p{percentile}'] = values[rank - 1]
+    return result
+
+
+class StatisticsAggregator:
+    def __init__(self, samples: int = 1000, top: int = 10, min_samples: int = 10):
+        self._samples = samples
+        self._top = top
+        self._endpoints = Counter()
+        self._methods = Counter()
+        # (method, atom count bucket): last calculation times
+        self._calc_times = defaultdict(lambda: deque(maxlen=self._samples))
+        self._pdb_ids = Counter()
+        self._cids = Counter()
+        # predicts calculation times from the same records
+        self._cost_model = CostModel(samples, min_samples)
+        self._records = 0
+        # file: (inode, offset) of already ingested part
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._ingest_lock = threading.Lock()
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """Adds record of statistics log"""
+        self._records += 1
+        endpoint = record.get('endpoint_name')
+        self._endpoints[endpoint] += 1
+        if endpoint == '/calculate_charges' and record.get('method') and not record.get('dry_run'):
+            self._methods[record['method']] += 1
+            # time of batched calculation is time of the whole batch and chunked calculation runs in parallel,
+            # they do not describe calculation of the structure, coalesced calculation is already recorded
+            if isinstance(record.get('time'), (int, float)) and isinstance(record.get('number_of_atoms'), int) \
+                    and not record.get('calculation_mode') and not record.get('coalesced'):
+                bucket = get_atom_count_bucket(record['number_of_atoms'])
+                self._calc_times[(record['method'], bucket)].append(record['time'])
+                self._cost_model.add(record['method'], record['number_of_atoms'],
+                                    record.get('number_of_molecules') or 1, record['time'])
+        for pdb_id in record.get('pdb_ids', []):
+            self._pdb_ids[pdb_id.lower()] += 1
+        for cid in record.get('cids', []):
+            self._cids[str(cid)] += 1
+
+    def add_lines(self, lines: Iterable[str]) -> None:
+        """Adds records from lines of statistics log"""
+        for line in lines:
+            record = parse_record(line)
+            if record is not None:
+                self.add(record)
+
+    def ingest_file(self, path: Union[str, os.PathLike], blocking: bool = True) -> None:
+        """Adds records appended to statistics log since the last call (log rotation is detected).
+        File is read without blocking predictions, only adding of read records holds their lock.
+        Non-blocking call returns immediately when the log is being read by another thread."""
+        if not self._ingest_lock.acquire(blocking):
+            return
+        try:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return
+            inode, offset = self._positions.get(path, (stat.st_ino, 0))
+            if inode != stat.st_ino or stat.st_size < offset:
+                offset = 0
+            records = []
+            with open(path, 'rb') as file:
+                file.seek(offset)
+                for line in file:
+                    # incomplete last line is processed by the next call
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    record = parse_record(line.decode(errors='replace'))
+                    if record is not None:
+                        records.append(record)
+                    if len(records) >= INGEST_BATCH:
+                        self._add_batch(records)
+                        records = []
+            self._add_batch(records)
+            self._positions[path] = (stat.st_ino, offset)
+        finally:
+            self._ingest_lock.release()
+
+    def _add_batch(self, records: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for record in records:
+                self.add(record)
+
+    def predict_calc_time(self, method: str, atoms: int, molecules: int = 1) -> Union[None, float]:
+        """Returns calculation time (in seconds) predicted from ingested records, None if it cannot be predicted"""
+        with self._lock:
+            return self._cost_model.predict(method, atoms, molecules)
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Returns aggregated statistics"""
+        with self._lock:
+            calc_times = defaultdict(dict)
+            for (method, bucket), times in sorted(self._calc_times.items()):
+                if times:
+                    calc_times[method][bucket] = {'count': len(times), **get_percentiles(times)}
+            return {'number_of_records': self._records,
+                    'endpoints': dict(self._endpoints.most_common()),
+                    'methods': dict(self._methods.most_common()),
+                    'calculation_times': calc_times,
+                    'cost_model': self._cost_model.get_summary(),
+                    'top_pdb_ids': dict(self._pdb_ids.most_common(self._top)),
+                    'top_cids': dict(self._cids.most_common(self._top))}
+
+
+def main(files: List[str], samples: int, top: int) -> Dict[str, Any]:
+    aggregator = StatisticsAggregator(samples=samples, top=top)
+    for path in files:
+        with open(path, errors='replace') as file:
+            aggregator.add_lines(file)
+    return aggregator.get_summary()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate statistics from log_statistics.txt files')
+    parser.add_argument('files', nargs='+', help='Statistics log files (json lines or legacy text records)')
+    parser.add_argument('--samples', type=int, default=100000,
+                        help='Number of calculation times kept for every method and atom count bucket')
+    parser.add_argument('--top', type=int, default=10, help='Number of the most requested PDB IDs and CIDs')
+    parser.add_argument('--output', help='Path to output json file (default: standard output)')
+    args = parser.parse_args()
+
+    summary = json.dumps(main(args.files, args.samples, args.top), indent=2)
+    if args.output:
+        with open(args.output, mode='w') as output:
+            output.write(summary)
+    else:
+        print(summary)
@@ -1,16 +1,206 @@
 import os
 import chargefw2_python
+import gemmi
+import hashlib
+import json
+import math
 import pathlib
-import subprocess
-from typing import Dict, Union, List
+import tempfile
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Union, List, Tuple
+
+
+# asymptotic complexity (exponent of number of atoms) and accuracy class of methods of chargefw2,
+# methods solving system of equations of the whole structure are cubic, methods using only neighbourhood are linear
+METHOD_PROPERTIES = {
+    'eem': (3, 'equalization'), 'abeem': (3, 'equalization'), 'qeq': (3, 'equalization'),
+    'smpqeq': (3, 'equalization'), 'eqeq': (3, 'equalization'), 'eqeqc': (3, 'equalization'),
+    'sqe': (3, 'equalization'), 'sqeqp': (3, 'equalization'), 'sqeqpc': (3, 'equalization'),
+    'qtpie': (3, 'equalization'), 'acks2': (3, 'equalization'), 'tsef': (3, 'equalization'),
+    'denr': (3, 'equalization'), 'mgc': (3, 'equalization'), 'kcm': (3, 'equalization'),
+    'sfkeem': (2, 'equalization'),
+    'peoe': (1, 'partial_equalization'), 'mpeoe': (1, 'partial_equalization'),
+    'gdac': (1, 'partial_equalization'), 'delre': (1, 'partial_equalization'),
+    'charge2': (1, 'partial_equalization'), 'veem': (1, 'partial_equalization'),
+    'formal': (1, 'formal'), 'dummy': (1, 'formal'),
+}
+UNKNOWN_METHOD_PROPERTIES = (3, None)
+# policies of selection of method when it is not specified by user
+METHOD_SELECTION_POLICIES = ('default', 'fastest', 'budget')
+
+
+def convert_cif_to_pdb(cif_file: Union[str, os.PathLike], pdb_file: Union[str, os.PathLike]) -> None:
+    """Converts .cif to .pdb format using gemmi"""
+    try:
+        structure = gemmi.read_structure(str(cif_file))
+        structure.write_pdb(str(pdb_file))
+    except (RuntimeError, ValueError) as e:
+        raise ValueError(f'Error converting from .cif to .pdb using gemmi: {e}')
+
+
+def scan_structure_file(path_to_file: Union[str, os.PathLike]) -> Tuple[int, int]:
+    """Returns number of molecules and atoms in structure file found by scan of lines, without parsing the structure"""
+    suffix = pathlib.Path(path_to_file).suffix.lower()
+    molecules = 0
+    atoms = 0
+    with open(path_to_file, errors='replace') as file:
+        if suffix == '.sdf':
+            # counts line is the fourth line of every molecule
+            line_number = 0
+            for line in file:
+                line_number += 1
+                if line_number == 4:
+                    molecules += 1
+                    atoms += int(line[:3]) if line[:3].strip().isdigit() else 0
+                elif line.startswith('$$$$'):
+                    line_number = 0
+        elif suffix == '.mol2':
+            # counts are on the second line after molecule header
+            lines_to_counts = 0
+            for line in file:
+                if line.startswith('@<TRIPOS>MOLECULE'):
+                    molecules += 1
+                    lines_to_counts = 2
+                elif lines_to_counts:
+                    lines_to_counts -= 1
+                    if not lines_to_counts and line.split() and line.split()[0].isdigit():
+                        atoms += int(line.split()[0])
+        else:
+            # pdb and mmcif (atom_site records)
+            molecules = 1
+            for line in file:
+                if line.startswith(('ATOM', 'HETATM')):
+                    atoms += 1
+    return molecules, atoms
+
+
+def count_atoms(path_to_file: Union[str, os.PathLike]) -> int:
+    """Returns number of atoms in structure file found by scan of lines, without parsing the structure"""
+    return scan_structure_file(path_to_file)[1]
+
+
+def split_molecule_records(path_to_file: Union[str, os.PathLike]) -> List[List[str]]:
+    """Returns lines of every molecule of sdf or mol2 file, the first line of sdf record and
+    the second line of mol2 record is name of molecule"""
+    with open(path_to_file, errors='replace') as file:
+        lines = file.read().splitlines(keepends=True)
+    records = []
+    if pathlib.Path(path_to_file).suffix.lower() == '.sdf':
+        record = []
+        for line in lines:
+            record.append(line)
+            if line.startswith('$$$$'):
+                records.append(record)
+                record = []
+        if any(line.strip() for line in record):
+            records.append(record)
+    else:
+        for line in lines:
+            if line.startswith('@<TRIPOS>MOLECULE'):
+                records.append([])
+            if records:
+                records[-1].append(line)
+    return records
+
+
+def split_molecule_file(path_to_file: Union[str, os.PathLike], chunk_size: int,
+                        directory: Union[str, os.PathLike]) -> List[str]:
+    """Splits sdf or mol2 file into files with chunk_size molecules (in original order), returns their paths"""
+    suffix = pathlib.Path(path_to_file).suffix.lower()
+    records = split_molecule_records(path_to_file)
+    chunk_files = []
+    for start in range(0, len(records), chunk_size):
+        chunk_file = os.path.join(directory, f'chunk_{len(chunk_files)}{suffix}')
+        with open(chunk_file, mode='w') as file:
+            for record in records[start:start + chunk_size]:
+                file.writelines(record)
+                if not record[-1].endswith('\n'):
+                    file.write('\n')
+        chunk_files.append(chunk_file)
+    return chunk_files
+
+
+def calculate_chunk_charges(path_to_file: Union[str, os.PathLike], method: str, parameters: Union[None, str],
+                            read_hetatm: bool, ignore_water: bool) -> Dict[str, List[float]]:
+    """Calculates charges of molecules of chunk file (runs in calculation worker process)"""
+    molecules = chargefw2_python.Molecules(str(path_to_file), read_hetatm, ignore_water)
+    return chargefw2_python.calculate_charges(molecules, method, parameters)
+
+
+def split_models(path_to_file: Union[str, os.PathLike], directory: Union[str, os.PathLike]) -> List[str]:
+    """Splits models of pdb or mmcif file into pdb files (frames), returns their paths in order of models.
+    Header records are copied to every frame, file without MODEL records is single frame."""
+    if pathlib.Path(path_to_file).suffix.lower() in ('.cif', '.mmcif'):
+        pdb_file = os.path.join(directory, 'structure.pdb')
+        convert_cif_to_pdb(path_to_file, pdb_file)
+        path_to_file = pdb_file
+    header = []
+    models = []
+    model = None
+    with open(path_to_file, errors='replace') as file:
+        for line in file:
+            record = line[:6].strip()
+            if record == 'MODEL':
+                model = []
+            elif record == 'ENDMDL':
+                if model is not None:
+                    models.append(model)
+                model = None
+            elif model is not None:
+                model.append(line)
+            elif not models and record not in ('END', 'CONECT', 'MASTER'):
+                header.append(line)
+    if model:
+        models.append(model)
+    if not models:
+        # atoms of single model are in header
+        models = [[]]
+    frames = []
+    for index, model in enumerate(models):
+        frame = os.path.join(directory, f'frame_{index}.pdb')
+        with open(frame, mode='w') as file:
+            file.writelines(header)
+            file.writelines(model)
+            file.write('END\n')
+        frames.append(frame)
+    return frames
+
+
+def merge_molecule_files(paths: List[Union[str, os.PathLike]], output: Union[str, os.PathLike]) -> List[List[str]]:
+    """Writes molecules of sdf or mol2 files into single file, molecules are renamed to unique names
+    <file index>_<molecule index>. Returns original names of molecules of every file."""
+    names = []
+    name_line = 0 if pathlib.Path(output).suffix.lower() == '.sdf' else 1
+    with open(output, mode='w') as file:
+        for file_index, path in enumerate(paths):
+            names.append([])
+            for record in split_molecule_records(path):
+                if len(record) <= name_line:
+                    continue
+                record[name_line], name = f'{file_index}_{len(names[-1])}\n', record[name_line].strip()
+                names[-1].append(name)
+                if not record[-1].endswith('\n'):
+                    record[-1] += '\n'
+                file.writelines(record)
+    return names
+
+
+def split_merged_charges(charges: Dict[str, List[float]], names: List[List[str]]) -> List[Dict[str, List[float]]]:
+    """Splits charges of molecules of file written by merge_molecule_files back to the merged files,
+    molecules get their original names"""
+    return [{name: charges[f'{file_index}_{molecule_index}'] for molecule_index, name in enumerate(file_names)}
+            for file_index, file_names in enumerate(names)]
 
 
 class Structure:
-    def __init__(self, structure_id: str, file_manager: Dict[str, os.PathLike]):
+    def __init__(self, structure_id: str, file_manager: Dict[str, os.PathLike],
+                 sidecar_manager: Dict[str, List[os.PathLike]] = None):
         if structure_id not in file_manager:
             raise ValueError(f'Structure ID {structure_id} does not exists.')
         self._structure_id = structure_id
         self._file_manager = file_manager
+        self._sidecar_manager = sidecar_manager if sidecar_manager is not None else {}
+        self._new_sidecar_files = []
 
     def set_file_manager(self, file_manager: Dict[str, os.PathLike]) -> None:
         """Sets file manager of structure"""
@@ -32,6 +222,13 @@ class Structure:
         except RuntimeError as e:
             raise ValueError(e)
 
+    def estimate_atom_count(self) -> int:
+        """Returns number of atoms in the structure file (cheap estimate of size of calculation)"""
+        path_to_file = self.get_structure_file()
+        if path_to_file is None:
+            raise ValueError(f'Structure ID {self._structure_id} does not exist.')
+        return count_atoms(path_to_file)
+
     def get_parameters_without_suffix(self, params: List[str]) -> List[str]:
         """Returns parameters of method without suffixes"""
         new_params = []
@@ -66,36 +263,174 @@ class Structure:
                 return True
         return False
 
+    def get_sidecar_files(self) -> List[Union[str, os.PathLike]]:
+        """Returns files derived from the structure file"""
+        return list(self._sidecar_manager.get(self._structure_id, []))
+
+    def add_sidecar_file(self, path_to_file: Union[str, os.PathLike]) -> None:
+        """Records file derived from the structure file"""
+        sidecar_files = self.get_sidecar_files()
+        if path_to_file not in sidecar_files:
+            # reassign the list, change of nested list would not propagate through manager
+            self._sidecar_manager[self._structure_id] = sidecar_files + [path_to_file]
+            self._new_sidecar_files.append(path_to_file)
+
+    def remove_sidecar_file(self, path_to_file: Union[str, os.PathLike]) -> int:
+        """Removes file derived from the structure file, returns size of removed file"""
+        sidecar_files = self.get_sidecar_files()
+        if path_to_file in sidecar_files:
+            sidecar_files.remove(path_to_file)
+            if sidecar_files:
+                self._sidecar_manager[self._structure_id] = sidecar_files
+            else:
+                del self._sidecar_manager[self._structure_id]
+        if path_to_file in self._new_sidecar_files:
+            self._new_sidecar_files.remove(path_to_file)
+        if not os.path.exists(path_to_file):
+            return 0
+        size = pathlib.Path(path_to_file).stat().st_size
+        os.remove(path_to_file)
+        return size
+
+    @property
+    def new_sidecar_files(self) -> List[Union[str, os.PathLike]]:
+        """Files derived from the structure file during life of this object"""
+        return self._new_sidecar_files
+
     def get_pdb_input_file(self) -> Union[str, os.PathLike]:
         """Returns input file in pdb format (pdb2pqr can process only pdb files)"""
         input_file = self.get_structure_file()
         if not input_file:
             raise ValueError(f'Structure ID {self._structure_id} does not exist.')
-        # cif format convert to pdb using gemmi convert
+        # cif format convert to pdb using gemmi, converted file is reused by later calls
         if input_file.endswith('.cif'):
-            try:
-                subprocess.run(['gemmi', 'convert', f'{input_file}', f'{input_file[:-4]}.pdb'], check=True)
-            except subprocess.CalledProcessError:
-                raise ValueError(f'Error converting from .cif to .pdb using gemmi convert.')
-            input_file = input_file[:-4] + '.pdb'
+            pdb_file = input_file[:-4] + '.pdb'
+            if pdb_file not in self.get_sidecar_files() or not os.path.exists(pdb_file):
+                # file is converted aside and moved into place, concurrent requests do not read half-written file
+                descriptor, converted_file = tempfile.mkstemp(suffix='.pdb', dir=os.path.dirname(pdb_file))
+                os.close(descriptor)
+                try:
+                    convert_cif_to_pdb(input_file, converted_file)
+                    os.replace(converted_file, pdb_file)
+                finally:
+                    if os.path.exists(converted_file):
+                        os.remove(converted_file)
+                self.add_sidecar_file(pdb_file)
+            input_file = pdb_file
         if not input_file.endswith('pdb'):
             raise ValueError(f'{self._structure_id} is not in .pdb or .cif format')
         return input_file
 
 
+class MethodCatalogue:
+    def __init__(self, methods: Dict[str, List[str]]):
+        # order of methods is kept as provided by chargefw2
+        self._parameters = MappingProxyType({method: tuple(parameters) for method, parameters in methods.items()})
+        self._metadata = MappingProxyType({
+            method: MappingProxyType({'order': order,
+                                      'parameters': list(parameters),
+                                      'requires_parameters': bool(parameters),
+                                      'complexity': METHOD_PROPERTIES.get(method, UNKNOWN_METHOD_PROPERTIES)[0],
+                                      'accuracy': METHOD_PROPERTIES.get(method, UNKNOWN_METHOD_PROPERTIES)[1]})
+            for order, (method, parameters) in enumerate(self._parameters.items())
+        })
+        self._etag = hashlib.sha256(json.dumps(self.get_metadata(), sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def load(cls) -> 'MethodCatalogue':
+        """Loads methods and their parameters from chargefw2"""
+        return cls({method: chargefw2_python.get_available_parameters(method)
+                    for method in chargefw2_python.get_available_methods()})
+
+    def __contains__(self, method: str) -> bool:
+        return method in self._parameters
+
+    @property
+    def methods(self) -> List[str]:
+        """Available methods"""
+        return list(self._parameters)
+
+    @property
+    def etag(self) -> str:
+        """ETag of the catalogue, changes only when chargefw2 provides different methods or parameters"""
+        return self._etag
+
+    def get_parameters(self, method: str) -> List[str]:
+        """Returns available parameters for the method"""
+        if method not in self._parameters:
+            raise ValueError(f'Method {method} is not available.')
+        return list(self._parameters[method])
+
+    def get_metadata(self) -> Dict[str, Dict[str, Any]]:
+        """Returns metadata (order, parameters, requirement of parameters, complexity, accuracy class) of all methods"""
+        return {method: dict(metadata) for method, metadata in self._metadata.items()}
+
+    def select_method(self, suitable_methods: List[Dict[str, List[str]]], policy: str,
+                      estimate: Callable[[str], Union[None, float]],
+                      budget: Union[None, float] = None) -> Dict[str, Any]:
+        """Selects method (with its first parameters) from suitable methods of structure according to policy:
+        default - the first suitable method, fastest - the fastest method of the same accuracy class as the default one,
+        budget - the first method predicted to finish within budget (in seconds), if there is none, the fastest method
+        of the same accuracy class as the default one (the default method if no time is predicted).
+        Methods are compared by complexity and then by time predicted by estimate (None if it is not known)."""
+        if policy not in METHOD_SELECTION_POLICIES:
+            raise ValueError(f'Method selection policy {policy} is not available, '
+                             f'use one of {", ".join(METHOD_SELECTION_POLICIES)}.')
+        if not suitable_methods:
+            raise ValueError('No method is suitable for the structure.')
+        times = {item['method']: estimate(item['method']) for item in suitable_methods}
+
+        def get_cost(item: Dict[str, List[str]]) -> Tuple[int, float]:
+            metadata = self._metadata.get(item['method'], {})
+            time = times[item['method']]
+            return metadata.get('complexity', UNKNOWN_METHOD_PROPERTIES[0]), time if time is not None else math.inf
+
+        def get_fastest(default: Dict[str, List[str]]) -> Dict[str, List[str]]:
+            accuracy = self._metadata.get(default['method'], {}).get('accuracy')
+            return min((item for item in suitable_methods
+                        if self._metadata.get(item['method'], {}).get('accuracy') == accuracy),
+                       key=get_cost)
+
+        selected = suitable_methods[0]
+        if policy == 'fastest':
+            selected = get_fastest(selected)
+        elif policy == 'budget':
+            if budget is None:
+                raise ValueError('Time budget has to be specified for budget policy.')
+            within_budget = [item for item in suitable_methods
+                             if times[item['method']] is not None and times[item['method']] <= budget]
+            if within_budget:
+                selected = within_budget[0]
+            elif any(time is not None for time in times.values()):
+                # no method fits the budget, accuracy is not given up for speed
+                selected = get_fastest(selected)
+        return {'method': selected['method'],
+                'parameters': selected['parameters'][0] if selected['parameters'] else None,
+                'estimated_calc_time': times[selected['method']]}
+
+
+_method_catalogue = None
+
+
+def get_method_catalogue() -> MethodCatalogue:
+    """Returns catalogue of available methods, it is loaded only once per process"""
+    global _method_catalogue
+    if _method_catalogue is None:
+        _method_catalogue = MethodCatalogue.load()
+    return _method_catalogue
+
+
 class Method:
     def __init__(self, method: str):
         self._method = method
 
     def is_method_available(self) -> bool:
         """Returns wheter method is available or not"""
-        return self._method in chargefw2_python.get_available_methods()
+        return self._method in get_method_catalogue()
 
     def get_available_parameters(self) -> List[str]:
         """Returns available parameters for the method"""
-        if not self.is_method_available():
-            raise ValueError(f'Method {self._method} is not available.')
-        return chargefw2_python.get_available_parameters(self._method)
+        return get_method_catalogue().get_parameters(self._method)
 
 
 class CalculationResult:
@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+from flask import g
+from typing import Dict, Iterator
+
+
+class PhaseTimer:
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._phases = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Measures duration of phase, durations of repeated phases are summed"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[name] = self._phases.get(name, 0.0) + time.perf_counter() - start
+
+    def get_durations(self) -> Dict[str, float]:
+        """Returns durations of phases in milliseconds"""
+        return {name: round(duration * 1000, 2) for name, duration in self._phases.items()}
+
+    def get_header(self) -> str:
+        """Returns value of Server-Timing header (including total time of request)"""
+        metrics = [f'{name};dur={duration}' for name, duration in self.get_durations().items()]
+        metrics.append(f'total;dur={round((time.perf_counter() - self._start) * 1000, 2)}')
+        return ', '.join(metrics)
+
+
+def start_phase_timer() -> None:
+    """Starts measuring phases of current request"""
+    g.phase_timer = PhaseTimer()
+
+
+def span(name: str):
+    """Measures duration of phase of current request"""
+    if 'phase_timer' not in g:
+        start_phase_timer()
+    return g.phase_timer.span(name)
+
+
+def get_phase_durations() -> Dict[str, float]:
+    """Returns durations of already finished phases of current request in milliseconds"""
+    if 'phase_timer' not in g:
+        return {}
+    return g.phase_timer.get_durations()
@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing.pool import AsyncResult, Pool
+from typing import Any, Callable, Tuple, Union
+
+
+class WorkerPool:
+    def __init__(self, processes: int, initializer: Union[None, Callable] = None, initargs: Tuple = (),
+                 maxtasksperchild: Union[None, int] = None, start_method: Union[None, str] = None):
+        self._processes = processes
+        self._initializer = initializer
+        self._initargs = initargs
+        self._maxtasksperchild = maxtasksperchild
+        # e.g. forkserver - workers are not forked from process running threads of requests and background services
+        self._context = multiprocessing.get_context(start_method or None)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def processes(self) -> int:
+        """Returns number of worker processes"""
+        return self._processes or os.cpu_count()
+
+    def get_pool(self) -> Pool:
+        """Returns process pool - starts it on first use (and again in forked child processes)"""
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = self._context.Pool(self._processes, self._initializer, self._initargs,
+                                                self._maxtasksperchild)
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, func: Callable, args: Tuple = (), callback: Union[None, Callable[[Any], None]] = None) \
+            -> AsyncResult:
+        """Submits function to the pool and returns its pending result,
+        callback is called with result or exception when the function finishes"""
+        return self.get_pool().apply_async(func, args, callback=callback, error_callback=callback)
+
+    def apply(self, func: Callable, args: Tuple = (), timeout: Union[None, float] = None) -> Any:
+        """Runs function in the pool and returns its result"""
+        return self.submit(func, args).get(timeout)
+
+    def close(self) -> None:
+        """Terminates worker processes"""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+            self._pool = None
+            self._pid = None
@@ -1,47 +1,195 @@
-from flask import Flask, render_template, request, send_file, jsonify, send_from_directory
+from flask import Flask, Response, current_app, g, render_template, request, send_file, jsonify, send_from_directory, \
+    stream_with_context
 from flask_restx import Api, Resource, reqparse
 from werkzeug.datastructures import FileStorage
-from typing import Dict, Any, Union, List, Tuple, Callable
-from multiprocessing import Process, Manager
+from werkzeug.local import LocalProxy
+from typing import Dict, Any, Union, List, Tuple, Callable, Iterable, Iterator
+from contextlib import ExitStack, contextmanager
 import tempfile
 import os
+import shutil
 import chargefw2_python
 import requests
-import subprocess
 import time
 from datetime import date
 import configparser
 import pathlib
-import logging
-from io import BytesIO
-from zipfile import ZipFile
+import hashlib
+import json
+import math
+from io import RawIOBase
+from multiprocessing.pool import AsyncResult
+from zipfile import ZipFile, ZipInfo
 
 from Responses import OKResponse, ErrorResponse
-from Structures import Structure, Method, CalculationResult
-from Logger import Logger, logging_process
+from Structures import METHOD_SELECTION_POLICIES, Structure, Method, CalculationResult, calculate_chunk_charges, \
+    merge_molecule_files, scan_structure_file, split_merged_charges, split_molecule_file, split_models
 from File import File
-from remove_old_files import RepeatTimer, delete_id_from_user, delete_old_records
-
-config = configparser.ConfigParser()
-config.read(os.getcwd() + '/utils/api.ini')
-app = Flask(__name__)
-if config['limits']['on'] == 'True':
-    app.config['MAX_CONTENT_LENGTH'] = int(config['limits']['file_size'])
-api = Api(app,
-          title='Atomic Charge Calculator II - API',
+from remove_old_files import delete_id_from_user
+from Timing import span, start_phase_timer
+from Profiling import RequestProfiler
+from Protonation import Pdb2pqrError, convert_pqr_to_pdb
+from Scheduler import AdmissionRejected, get_owner
+from Services import Services
+
+api = Api(title='Atomic Charge Calculator II - API',
           description='Atomic Charge Calculator II is software tool '
                       'designated for calculation of partial atomic charges.\n'
                       '<br>'
                       '<a href="/documentation">Documentation</a>')
 
+# services of application handling current request, they are started lazily on the first use
+services = LocalProxy(lambda: current_app.extensions['api_acc2'])
+config = LocalProxy(lambda: services.config)
+limitations_on = LocalProxy(lambda: services.limitations_on)
+manager = LocalProxy(lambda: services.manager)
+file_manager = LocalProxy(lambda: services.file_manager)  # id: path_to_file
+user_id_manager = LocalProxy(lambda: services.user_id_manager)  # {user:[id1, id2]}
+sidecar_manager = LocalProxy(lambda: services.sidecar_manager)  # id: [path_to_derived_file]
+long_calculations = LocalProxy(lambda: services.long_calculations)
+used_space = LocalProxy(lambda: services.used_space)
+simple_logger = LocalProxy(lambda: services.simple_logger)
+method_catalogue = LocalProxy(lambda: services.method_catalogue)
+pdb2pqr = LocalProxy(lambda: services.pdb2pqr)
+statistics = LocalProxy(lambda: services.statistics)
+schedulers = LocalProxy(lambda: services.schedulers)
+micro_batcher = LocalProxy(lambda: services.micro_batcher)
+single_flight = LocalProxy(lambda: services.single_flight)
+calculation_pool = LocalProxy(lambda: services.calculation_pool)
+
+
+def load_config(path: Union[None, str, os.PathLike] = None) -> configparser.ConfigParser:
+    """Reads configuration, utils/api.ini in working directory by default"""
+    config = configparser.ConfigParser()
+    config.read(path or os.getcwd() + '/utils/api.ini')
+    return config
+
+
+def create_app(config: Union[None, str, os.PathLike, configparser.ConfigParser] = None) -> Flask:
+    """Creates application, no background service is started until it is used by some request"""
+    if not isinstance(config, configparser.ConfigParser):
+        config = load_config(config)
+    app = Flask(__name__)
+    if config['limits']['on'] == 'True':
+        app.config['MAX_CONTENT_LENGTH'] = int(config['limits']['file_size'])
+    app.extensions['api_acc2'] = Services(config)
+
+    app.before_request(before_request)
+    app.after_request(add_server_timing)
+    # profiling of single requests for admins, hooks are not registered at all without admin token
+    if config['admin']['token']:
+        app.extensions['api_acc2_profiler'] = RequestProfiler(config['admin']['token'], config['paths']['profiles'])
+        app.before_request(start_profiling)
+        app.after_request(stop_profiling)
+        app.teardown_request(discard_profiling)
+    app.add_url_rule('/documentation', view_func=documentation)
+    api.init_app(app)
+    return app
+
+
+def before_request() -> None:
+    """Starts measuring phases of request"""
+    start_phase_timer()
+
+
+def add_server_timing(response: Response) -> Response:
+    """Adds durations of measured phases of request to Server-Timing header"""
+    if 'phase_timer' in g:
+        response.headers['Server-Timing'] = g.phase_timer.get_header()
+    return response
+
+
+def start_profiling() -> Union[None, Tuple[Dict[str, Union[str, int]], int]]:
+    """Profiles request if it contains valid admin token in X-Profile header
+    (token is not accepted from URL, it would be saved in access logs),
+    requests are profiled one at a time"""
+    profiler = current_app.extensions['api_acc2_profiler']
+    if profiler.is_requested(request.headers.get('X-Profile')):
+        profile = profiler.start()
+        if profile is None:
+            response = ErrorResponse('Another request is being profiled, repeat the request later.',
+                                     status_code=409, request=request)
+            response.log(simple_logger)
+            return response.json
+        g.profile = profile
+    return None
+
+
+def stop_profiling(response: Response) -> Response:
+    """Saves profile of request, its ID is returned in X-Profile-ID header"""
+    if 'profile' in g:
+        response.headers['X-Profile-ID'] = current_app.extensions['api_acc2_profiler'].stop(g.pop('profile'))
+    return response
+
+
+def discard_profiling(exception: Union[None, BaseException]) -> None:
+    """Stops profiling of request which ended without response (after_request hooks did not run)"""
+    if 'profile' in g:
+        current_app.extensions['api_acc2_profiler'].discard(g.pop('profile'))
+
 
-@app.route('/documentation')
 def documentation():
     """Documentation"""
     path = os.getcwd() + '/doc'
     return send_from_directory(path, 'Documentation.pdf')
 
 
+def admit(atoms: Union[None, int] = None, estimated_time: Union[None, float] = None) -> Callable[..., None]:
+    """Waits until CPU demanding work is admitted by scheduler, returns function releasing the admission
+    (it may be called from another thread, e.g. as callback of worker pool)"""
+    user = request.remote_addr
+    scheduler = services.get_scheduler(atoms)
+    with span('queue'):
+        ticket = scheduler.acquire(user, services.user_weights.get(user, 1.0),
+                                   services.get_cost(atoms, estimated_time), get_owner())
+
+    def release(*args: Any) -> None:
+        try:
+            scheduler.release(ticket)
+        except Exception:
+            # ticket which was not released is reclaimed by scheduler after its lease
+            pass
+
+    return release
+
+
+@contextmanager
+def admitted(atoms: Union[None, int] = None, estimated_time: Union[None, float] = None) -> Iterator[None]:
+    """Runs CPU demanding work (calculation, pdb2pqr, conversion) after it is admitted by scheduler,
+    raises AdmissionRejected if the server is overloaded. Users (IP addresses) share capacity fairly
+    according to their weights, so a backlog of one user does not delay small jobs of the others.
+    Work on small structures (by number of atoms) runs in separate fast lane, it does not wait for large ones.
+    Cost of the work (share of capacity of user taken by it) is its time predicted by cost model
+    or estimated from number of atoms."""
+    release = admit(atoms, estimated_time)
+    try:
+        yield
+    finally:
+        release()
+
+
+def submit_admitted(submit: Callable[[Callable[..., None]], AsyncResult], atoms: Union[None, int] = None,
+                    estimated_time: Union[None, float] = None) -> AsyncResult:
+    """Submits job to worker pool after it is admitted by scheduler, submit is called with callback of the job.
+    Every job holds its own admission, which is released when the job finishes (not when its result is collected),
+    so that jobs running in parallel take their share of capacity."""
+    release = admit(atoms, estimated_time)
+    try:
+        return submit(release)
+    except BaseException:
+        release()
+        raise
+
+
+@api.errorhandler(AdmissionRejected)
+def handle_admission_rejected(error: AdmissionRejected) -> Tuple[Dict[str, Union[str, int]], int, Dict[str, str]]:
+    """Server is overloaded, client should repeat the request after Retry-After seconds"""
+    response = ErrorResponse(str(error), status_code=503, request=request,
+                             headers={'Retry-After': str(error.retry_after)})
+    response.log(simple_logger)
+    return response.json
+
+
 # namespace for sending files - for documentation
 send_files = api.namespace('send_files',
                            description='Send file containing structure '
@@ -75,6 +223,11 @@ get_info = api.namespace('get_info',
 hydrogens = api.namespace('add_hydrogens',
                           description='Add hydrogens to your structure.')
 
+# namespace for adding hydrogens to structure under multiple pH values
+ph_sweep = api.namespace('ph_sweep',
+                         description='Add hydrogens to your structure under multiple pH values '
+                                     'and optionally calculate partial atomic charges.')
+
 get_structure_file = api.namespace('get_structure_file',
                                    description='Get structure file saved under specific ID.')
 
@@ -101,6 +254,9 @@ get_calculation_results = api.namespace('get_calculation_results',
 get_limits = api.namespace('get_limits',
                            description='Get info about limits, your files.')
 
+stats = api.namespace('stats',
+                      description='Get statistics of usage of API and calculation times of methods.')
+
 
 def calculate_time(func: Callable) -> Callable:
     """Decorator for time measurement of function run"""
@@ -125,31 +281,47 @@ def calculate_time(func: Callable) -> Callable:
     return inner
 
 
-manager = Manager()
-queue = manager.Queue()
-log_process = Process(target=lambda: logging_process(queue, config['paths']['log_error'],
-                                                     config['paths']['save_statistics_file']))
-log_process.start()
-simple_logger = Logger('simple', logging.INFO, queue)
+def add_caching_headers(response: Response, etag: str) -> Response:
+    """Allows clients and proxies to cache response and revalidate it using ETag"""
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = int(config['catalogue']['max_age'])
+    return response
+
+
+def catalogue_not_modified() -> Union[None, Response]:
+    """Returns 304 response if client already has current version of methods catalogue"""
+    if request.if_none_match.contains(method_catalogue.etag):
+        return add_caching_headers(Response(status=304), method_catalogue.etag)
+    return None
 
 
 @avail_methods.route('')
+@api.doc(params={'details': {'description': 'Return also parameters of methods and their metadata.\nDefault: False',
+                             'type': 'boolean', 'in': 'query'}},
+         responses={304: 'Not modified', 200: 'OK'})
 class AvailableMethodsEndpoint(Resource):
-    def get(self) -> Dict[str, Union[List[str], int]]:
+    def get(self) -> Union[Response, Dict[str, Union[List[str], int]]]:
         """Returns list of methods available for calculation of partial atomic charges"""
-        available_methods = chargefw2_python.get_available_methods()
-        response = OKResponse(data={'available_methods': available_methods}, request=request)
+        not_modified = catalogue_not_modified()
+        if not_modified:
+            return not_modified
+        data = {'available_methods': method_catalogue.methods}
+        if get_bool_value(request.args.get('details')):
+            data['methods'] = method_catalogue.get_metadata()
+        response = OKResponse(data=data, request=request)
         response.log(simple_logger)
-        return response.json
+        return add_caching_headers(response.json, method_catalogue.etag)
 
 
 @avail_params.route('')
 @api.doc(params={'method': {'description': 'Calculation method', 'type': 'string', 'required': True, 'in': 'query'}},
          responses={404: 'Method not specified',
                     400: 'Method not available',
+                    304: 'Not modified',
                     200: 'OK'})
 class AvailableParametersEndpoint(Resource):
-    def get(self) -> Union[Tuple[Dict[str, Union[str, int]], int], Dict[str, Union[List[str], int]]]:
+    def get(self) -> Union[Tuple[Dict[str, Union[str, int]], int], Response]:
         """Returns list of available parameters for specific method"""
         method = request.args.get('method')
         if not method:
@@ -158,15 +330,18 @@ class AvailableParametersEndpoint(Resource):
             return response.json
 
         try:
-            parameters = Method(method).get_available_parameters()
+            parameters = method_catalogue.get_parameters(method)
         except ValueError as e:
             response = ErrorResponse(str(e), status_code=400, request=request)
             response.log(simple_logger)
             return response.json
 
+        not_modified = catalogue_not_modified()
+        if not_modified:
+            return not_modified
         response = OKResponse(data={'parameters': parameters}, request=request)
         response.log(simple_logger)
-        return response.json
+        return add_caching_headers(response.json, method_catalogue.etag)
 
 
 def save_file_identifiers(identifiers: Dict[str, Union[str, os.PathLike]]) -> None:
@@ -227,13 +402,15 @@ class SendFilesEndpoint(Resource):
                 response.log(simple_logger)
                 return response.json
 
-            file.save()
+            with span('save'):
+                file.save()
             # user has limited space
             if user_has_no_space(file, request.remote_addr):
                 all_uploaded = False
                 break
 
-            file.convert_line_endings_to_unix_style()
+            with span('dos2unix'):
+                file.convert_line_endings_to_unix_style()
             uploaded_files[file.get_id()] = file.get_path()
             user_response[file.get_filename()[:-4]] = file.get_id()
 
@@ -298,7 +475,8 @@ class PdbID(Resource):
         all_uploaded = True
         for pdb_id in pdb_identifiers:
             # get file from pdb
-            request_response = send_pdb_request(pdb_id)
+            with span('fetch'):
+                request_response = send_pdb_request(pdb_id)
             if not request_response['successfull']:
                 error_message = request_response['error_message']
                 response = ErrorResponse(message=f'{error_message}',
@@ -309,7 +487,8 @@ class PdbID(Resource):
 
             # save requested pdb structure
             file = File(os.path.join(f'{pdb_id}.cif'), tmpdir)
-            successfully_written_file = file.write_file(request_response['response'], config)
+            with span('download'):
+                successfully_written_file = file.write_file(request_response['response'], config)
             if not successfully_written_file:
                 response = ErrorResponse(message=f'Not possible to upload {pdb_id}. It is bigger than 10 Mb.',
                                          status_code=413,
@@ -374,7 +553,8 @@ class PubchemCID(Resource):
         all_uploaded = True
         for cid in cid_identifiers:
             # get file from pubchem
-            request_response = send_pubchem_request(cid)
+            with span('fetch'):
+                request_response = send_pubchem_request(cid)
             if not request_response['successfull']:
                 error_message = request_response['error_message']
                 response = ErrorResponse(message=f'{error_message}',
@@ -385,7 +565,8 @@ class PubchemCID(Resource):
 
             # save requested cid compound
             file = File(os.path.join(f'{cid}.sdf'), tmpdir)
-            successfully_written_file = file.write_file(request_response['response'], config)
+            with span('download'):
+                successfully_written_file = file.write_file(request_response['response'], config)
             if not successfully_written_file:
                 response = ErrorResponse(message=f'Not possible to upload {cid}. It is bigger than 10 Mb.',
                                          status_code=413,
@@ -420,13 +601,24 @@ class PubchemCID(Resource):
 
 def release_space(file_size: float, user: str) -> None:
     """Release space on disk for specific user"""
-    if limitations_on:
+    if limitations_on and user in used_space:
         if used_space[user] - file_size <= 0:
             del used_space[user]
         else:
             used_space[user] = used_space[user] - file_size
 
 
+def charge_sidecar_files(structure: Structure, user: str) -> bool:
+    """Counts files newly derived from the structure into space used by user.
+    Returns False (and removes the derived file) if the granted space was exceeded."""
+    for sidecar_file in list(structure.new_sidecar_files):
+        path_to_file = pathlib.Path(sidecar_file)
+        if user_has_no_space(File(path_to_file.name, path_to_file.parent), user):
+            structure.remove_sidecar_file(sidecar_file)
+            return False
+    return True
+
+
 remove_file_parser = reqparse.RequestParser()
 remove_file_parser.add_argument('structure_id',
                                 type=str,
@@ -447,7 +639,7 @@ class RemoveFile(Resource):
             response.log(simple_logger)
             return response.json
         try:
-            structure = Structure(structure_id, file_manager)
+            structure = Structure(structure_id, file_manager, sidecar_manager)
         except ValueError:
             response = ErrorResponse(message=f'Structure ID {structure_id} does not exist.',
                                      status_code=400,
@@ -465,6 +657,10 @@ class RemoveFile(Resource):
         path_to_file = pathlib.Path(structure.get_structure_file())
         file = File(str(pathlib.Path(path_to_file.name)), path_to_file.parent)
 
+        # remove files derived from the structure and release their space
+        for sidecar_file in structure.get_sidecar_files():
+            release_space(structure.remove_sidecar_file(sidecar_file), request.remote_addr)
+
         # remove from file_manager and user_id_manager
         del file_manager[structure_id]
         delete_id_from_user(structure_id, user_id_manager)
@@ -477,25 +673,9 @@ class RemoveFile(Resource):
         return response.json
 
 
-def convert_pqr_to_pdb(pqr_file: os.PathLike, pdb_file: os.PathLike) -> None:
-    """Converts .pqr to .pdb format - using open babel"""
-    try:
-        subprocess.run(['obabel', f'-ipqr', f'{pqr_file}', f'-opdb', f'-O{pdb_file}'], check=True)
-    except subprocess.CalledProcessError:
-        raise ValueError('Error converting from .pqr to .pdb format using openbabel.')
-
-
-def run_pqr(noopt: bool, ph: str, input_file: os.PathLike, path_to_pqr: os.PathLike) -> bool:
-    """Add hydrogens using pdb2pqr"""
-    successfull = True
-    try:
-        if noopt:
-            subprocess.run(['pdb2pqr30', f'--noopt', f'--pH', f'{ph}', f'{input_file}', f'{path_to_pqr}'], check=True)
-        else:
-            subprocess.run(['pdb2pqr30', f'--pH', f'{ph}', f'{input_file}', f'{path_to_pqr}'], check=True)
-    except subprocess.CalledProcessError:
-        successfull = False
-    return successfull
+def run_pqr(noopt: bool, ph: str, input_file: os.PathLike, path_to_pqr: os.PathLike) -> None:
+    """Add hydrogens using pdb2pqr running in worker pool"""
+    pdb2pqr.run(input_file, path_to_pqr, ph, noopt)
 
 
 # parser for query arguments
@@ -514,10 +694,16 @@ hydro_parser.add_argument('noopt',
                           help='Use in case that you would not like to '
                                'optimize hydrogen bonds.\n'
                                'Default: True')
+hydro_parser.add_argument('pqr_charges',
+                          type=bool,
+                          help='Use in case that you would like to keep charges and radii '
+                               'assigned by pdb2pqr in occupancy and B-factor columns.\n'
+                               'Default: False')
 @hydrogens.route('')
 @api.doc(responses={404: 'Structure ID not specified',
                     400: 'Structure ID does not exist / Structure not in correct format',
-                    405: 'Error in using pdb2pqr / openbabel',
+                    405: 'Error in using pdb2pqr / converting .pqr to .pdb',
+                    503: 'Server is overloaded, repeat the request after Retry-After seconds',
                     200: 'OK'})
 @api.expect(hydro_parser)
 class AddHydrogens(Resource):
@@ -534,52 +720,313 @@ class AddHydrogens(Resource):
             ph = float(config['pH']['default'])
 
         try:
-            structure = Structure(structure_id, file_manager)
-            input_file = structure.get_pdb_input_file()
+            structure = Structure(structure_id, file_manager, sidecar_manager)
+            atoms = structure.estimate_atom_count()
         except ValueError as e:
             response = ErrorResponse(f'{str(e)}', status_code=400, request=request)
             response.log(simple_logger)
             return response.json
 
-        output_dir = generate_tmp_directory()
-        pqr_file = File(structure_id + '.pqr', output_dir)
-        path_to_pqr = pathlib.Path(pqr_file.get_path())
-        pdb_file = File(structure_id + 'pdb', output_dir)
-        path_to_pdb = pathlib.Path(pdb_file.get_path())
+        # conversion of input, pdb2pqr and conversion of its output are admitted at once
+        with admitted(atoms):
+            try:
+                with span('pdb_input'):
+                    input_file = structure.get_pdb_input_file()
+            except ValueError as e:
+                response = ErrorResponse(f'{str(e)}', status_code=400, request=request)
+                response.log(simple_logger)
+                return response.json
 
-        # hydrogen bond optimalization
-        noopt = request.args.get('noopt')
+            if not charge_sidecar_files(structure, request.remote_addr):
+                response = ErrorResponse(message='Grounted disk space exceeded', status_code=413, request=request)
+                response.log(simple_logger)
+                return response.json
 
-        successful = run_pqr(noopt, ph, input_file, path_to_pqr)
-        if not successful:
-            response = ErrorResponse(f'Error occurred when using pdb2pqr30 on structure {structure_id}',
-                                     status_code=405,
-                                     request=request)
+            output_dir = generate_tmp_directory()
+            pqr_file = File(structure_id + '.pqr', output_dir)
+            path_to_pqr = pathlib.Path(pqr_file.get_path())
+            pdb_file = File(structure_id + '.pdb', output_dir)
+            path_to_pdb = pathlib.Path(pdb_file.get_path())
+
+            # hydrogen bond optimalization
+            noopt = request.args.get('noopt')
+            pqr_charges = get_bool_value(request.args.get('pqr_charges'))  # default False
+
+            try:
+                with span('pdb2pqr'):
+                    run_pqr(noopt, ph, input_file, path_to_pqr)
+            except Pdb2pqrError as e:
+                response = ErrorResponse(f'Error occurred when using pdb2pqr30 on structure {structure_id}: {str(e)}',
+                                         status_code=405,
+                                         request=request)
+                response.log(simple_logger)
+                return response.json
+
+            pdb_file_id = pdb_file.get_id()
+            try:
+                with span('pqr_to_pdb'):
+                    convert_pqr_to_pdb(path_to_pqr, path_to_pdb, charges_to_columns=pqr_charges)
+            except (ValueError, OSError) as e:
+                response = ErrorResponse(f'{str(e)}', status_code=405, request=request)
+                response.log(simple_logger)
+                return response.json
+        save_file_identifiers({pdb_file_id: path_to_pdb})
+
+        response = OKResponse(data={'structure_id': pdb_file_id}, request=request)
+        response.log(simple_logger)
+        return response.json
+
+
+def get_ph_values(ph_values: List[str], ph_start: Union[None, str], ph_end: Union[None, str],
+                  ph_step: Union[None, str]) -> List[float]:
+    """Returns list of pH values given explicitly or as range (end included)"""
+    max_sweep = int(config['pH']['max_sweep'])
+    too_many = f'It is allowed to specify at most {max_sweep} pH values.'
+    try:
+        result = [float(ph) for ph in ph_values]
+        if ph_start is not None or ph_end is not None:
+            if ph_start is None or ph_end is None:
+                raise ValueError('Both pH_start and pH_end have to be specified.')
+            start, end = float(ph_start), float(ph_end)
+            step = float(ph_step) if ph_step else 1.0
+            if not all(math.isfinite(value) for value in (start, end, step)):
+                raise ValueError('pH range has to be finite.')
+            if step <= 0 or end < start:
+                raise ValueError('pH range has to be increasing with positive pH_step.')
+            # size of range is checked before the range is built
+            count = int(round((end - start) / step, 6)) + 1
+            if count + len(result) > max_sweep:
+                raise OverflowError(too_many)
+            result += [round(start + i * step, 4) for i in range(count)]
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid pH values: {e}')
+    except OverflowError:
+        raise ValueError(too_many)
+    if not result:
+        raise ValueError('No pH values specified.')
+    if len(result) > max_sweep:
+        raise ValueError(too_many)
+    # remove duplicates, keep order
+    return list(dict.fromkeys(result))
+
+
+# parser for query arguments
+ph_sweep_parser = reqparse.RequestParser()
+ph_sweep_parser.add_argument('structure_id',
+                             type=str,
+                             help='Obtained structure identifier of your structure',
+                             required=True)
+ph_sweep_parser.add_argument('pH[]',
+                             type=float,
+                             action='append',
+                             help='pH values under which hydrogens are added.')
+ph_sweep_parser.add_argument('pH_start',
+                             type=float,
+                             help='Start of range of pH values (alternative to pH[]).')
+ph_sweep_parser.add_argument('pH_end',
+                             type=float,
+                             help='End of range of pH values (included).')
+ph_sweep_parser.add_argument('pH_step',
+                             type=float,
+                             help='Step of range of pH values.\n'
+                                  'Default: 1.0')
+ph_sweep_parser.add_argument('noopt',
+                             type=bool,
+                             help='Use in case that you would not like to '
+                                  'optimize hydrogen bonds.\n'
+                                  'Default: True')
+ph_sweep_parser.add_argument('pqr_charges',
+                             type=bool,
+                             help='Use in case that you would like to keep charges and radii '
+                                  'assigned by pdb2pqr in occupancy and B-factor columns.\n'
+                                  'Default: False')
+ph_sweep_parser.add_argument('calculate_charges',
+                             type=bool,
+                             help='Use in case that you would like to calculate partial atomic charges '
+                                  'of every protonated structure.\n'
+                                  'Default: False')
+ph_sweep_parser.add_argument('method',
+                             type=str,
+                             help='Calculation method (used with calculate_charges).')
+ph_sweep_parser.add_argument('parameters',
+                             type=str,
+                             help='Parameters set by specific method (used with calculate_charges).')
+@ph_sweep.route('')
+@api.doc(responses={404: 'Structure ID not specified',
+                    400: 'Structure ID does not exist / Structure not in correct format / invalid pH values',
+                    413: 'The grounded disk space was exceeded',
+                    503: 'Server is overloaded, repeat the request after Retry-After seconds',
+                    200: 'OK'})
+@api.expect(ph_sweep_parser)
+class PhSweep(Resource):
+    def post(self) -> Union[Tuple[Dict[str, Union[str, int]], int], Dict[str, Any]]:
+        """Add hydrogens to your structure under multiple pH values in parallel"""
+        structure_id = request.args.get('structure_id')
+        if not structure_id:
+            response = ErrorResponse(message=f'Structure ID not specified', request=request)
             response.log(simple_logger)
             return response.json
 
-        pdb_file_id = pdb_file.get_id()
+        noopt = request.args.get('noopt')
+        pqr_charges = get_bool_value(request.args.get('pqr_charges'))  # default False
+        with_charges = get_bool_value(request.args.get('calculate_charges'))  # default False
+        method = request.args.get('method')
+        parameters = request.args.get('parameters')
+
         try:
-            convert_pqr_to_pdb(path_to_pqr, path_to_pdb)
+            ph_values = get_ph_values(request.args.getlist('pH[]'), request.args.get('pH_start'),
+                                      request.args.get('pH_end'), request.args.get('pH_step'))
+            if with_charges and method and not Method(method).is_method_available():
+                raise ValueError(f'Method {method} is not available.')
+            structure = Structure(structure_id, file_manager, sidecar_manager)
+            # input is converted only once and shared by all protonation variants
+            atoms = structure.estimate_atom_count()
+            with admitted(atoms), span('pdb_input'):
+                input_file = structure.get_pdb_input_file()
         except ValueError as e:
-            response = ErrorResponse(f'{str(e)}', status_code=405, request=request)
+            response = ErrorResponse(f'{str(e)}', status_code=400, request=request)
             response.log(simple_logger)
             return response.json
-        save_file_identifiers({pdb_file_id: path_to_pdb})
 
-        response = OKResponse(data={'structure_id': pdb_file_id}, request=request)
-        response.log(simple_logger)
+        if not charge_sidecar_files(structure, request.remote_addr):
+            response = ErrorResponse(message='Grounted disk space exceeded', status_code=413, request=request)
+            response.log(simple_logger)
+            return response.json
+
+        results = {}
+        uploaded_files = {}
+        saved_files = {}
+        # protonation variants run in parallel in pdb2pqr worker pool, every variant is admitted by itself
+        directories = {}
+        variants = {}
+        try:
+            for ph in ph_values:
+                output_dir = directories[ph] = generate_tmp_directory()
+                pqr_file = File(f'{structure_id}.pqr', output_dir)
+                pdb_file = File(f'{structure_id}.pdb', output_dir)
+                variants[ph] = (pdb_file, submit_admitted(
+                    lambda callback: pdb2pqr.submit(input_file, pqr_file.get_path(), ph, noopt, callback), atoms))
+
+            for ph, (pdb_file, pending) in variants.items():
+                try:
+                    with span('pdb2pqr'):
+                        path_to_pqr = pdb2pqr.wait(pending)
+                except Pdb2pqrError as e:
+                    results[str(ph)] = {'error': f'Error occurred when using pdb2pqr30 on structure '
+                                                 f'{structure_id}: {str(e)}'}
+                    continue
+                try:
+                    with admitted(atoms), span('pqr_to_pdb'):
+                        convert_pqr_to_pdb(path_to_pqr, pdb_file.get_path(), charges_to_columns=pqr_charges)
+                except (ValueError, OSError) as e:
+                    results[str(ph)] = {'error': str(e)}
+                    continue
+                uploaded_files[pdb_file.get_id()] = pdb_file.get_path()
+                results[str(ph)] = {'structure_id': pdb_file.get_id()}
+            save_file_identifiers(uploaded_files)
+            saved_files = uploaded_files
+        finally:
+            # directories of failed variants (all of them when the sweep is rejected) are removed,
+            # after protonations still running in them finish
+            for ph, output_dir in directories.items():
+                if ph in variants:
+                    pdb_file, pending = variants[ph]
+                    if pdb_file.get_id() in saved_files:
+                        continue
+                    try:
+                        pdb2pqr.wait(pending)
+                    except Exception:
+                        pass
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+        if with_charges:
+            for ph, result in results.items():
+                if 'structure_id' in result:
+                    result.update(calculate_ph_variant_charges(result['structure_id'], method, parameters))
+
+        response = OKResponse(data={'results': results}, request=request)
+        response.log(simple_logger, pH_values=ph_values)
         return response.json
 
 
-def create_zip_file(folder: pathlib.Path) -> BytesIO:
-    """Returns zip file"""
-    stream = BytesIO()
+def exceeds_long_calculations(estimated_time: Union[None, float]) -> bool:
+    """Returns whether user performed all allowed long calculations and this one may be long too,
+    calculations predicted to be short are always allowed"""
+    if not limitations_on or \
+            long_calculations.get(request.remote_addr, 0) < int(config['limits']['max_long_calc']):
+        return False
+    return estimated_time is None or estimated_time > float(config['limits']['calc_time'])
+
+
+def calculate_ph_variant_charges(structure_id: str, method: Union[None, str],
+                                 parameters: Union[None, str]) -> Dict[str, Any]:
+    """Calculates charges of protonated structure, returns charges or error message"""
+    try:
+        structure = Structure(structure_id, file_manager)
+        if not method:
+            suitable_methods = structure.get_suitable_methods()
+            method = suitable_methods[0]['method']
+            parameters = suitable_methods[0]['parameters'][0] if suitable_methods[0]['parameters'] else None
+        molecules = structure.get_molecules()
+    except ValueError as e:
+        return {'error': str(e)}
+    molecules_count, atom_count, _ = chargefw2_python.get_info(molecules)
+    estimated_time = services.estimate_calc_time(method, atom_count, molecules_count)
+
+    if exceeds_long_calculations(estimated_time):
+        return {'error': f'It is allowed to perform only {config["limits"]["max_long_calc"]} '
+                         f'time demanding calculations per day.'}
+    try:
+        result_of_calculation = calculate_charges(molecules, method, parameters, atom_count, estimated_time)
+    except (RuntimeError, AdmissionRejected) as e:
+        return {'error': str(e)}
+    if limitations_on and result_of_calculation.calc_time > float(config['limits']['calc_time']):
+        add_long_calc(long_calculations, request.remote_addr)
+    return {'charges': result_of_calculation.get_charges(),
+            'method': result_of_calculation.method,
+            'parameters': result_of_calculation.parameters}
+
+
+class ZipStream(RawIOBase):
+    """Unseekable write-only buffer, collects data written by ZipFile until they are sent"""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def get_written_data(self) -> bytes:
+        """Returns data written since last call"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def generate_zip_file(folder: pathlib.Path, chunk_size: int = 65536) -> Iterator[bytes]:
+    """Yields zip file containing files of folder - files are read and compressed while sending"""
+    stream = ZipStream()
     with ZipFile(stream, 'w') as zf:
-        for file in folder.glob('*'):
-            zf.write(file, file.name)
-    stream.seek(0)
-    return stream
+        for file in sorted(folder.glob('*')):
+            with open(file, 'rb') as source, zf.open(ZipInfo.from_file(file, file.name), 'w') as entry:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    entry.write(chunk)
+                    data = stream.get_written_data()
+                    if data:
+                        yield data
+    yield stream.get_written_data()
+
+
+def get_etag(files: Iterable[pathlib.Path]) -> str:
+    """Returns ETag of files computed from their names, sizes and modification times (files are not read)"""
+    digest = hashlib.sha256()
+    for file in sorted(files):
+        stat = file.stat()
+        digest.update(f'{file.name}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
 
 
 # parser for query arguments
@@ -588,9 +1035,15 @@ file_parser.add_argument('structure_id',
                          type=str,
                          help='Obtained structure identifier of your structure',
                          required=True)
+file_parser.add_argument('archive',
+                         type=bool,
+                         help='Use False in case that you would like to download only '
+                              'the structure file instead of zip archive of all files related to it.\n'
+                              'Default: True')
 @get_structure_file.route('')
 @api.doc(responses={404: 'Structure ID not specified',
-                    400: 'Structure ID does not exist'})
+                    400: 'Structure ID does not exist',
+                    304: 'Not modified since the last download'})
 @api.expect(file_parser)
 class StructureFile(Resource):
     """Allows to download the structure specified by structure ID"""
@@ -607,8 +1060,26 @@ class StructureFile(Resource):
             response.log(simple_logger)
             return response.json
 
-        zip_file = create_zip_file(pathlib.Path(file).parent)
-        return send_file(zip_file, download_name='structures.zip', as_attachment=True)
+        archive = request.args.get('archive')
+        archive = archive is None or get_bool_value(archive)  # default True
+        path_to_file = pathlib.Path(file)
+        if archive:
+            etag = get_etag(path_to_file.parent.glob('*'))
+        else:
+            etag = get_etag([path_to_file])
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        if not archive:
+            return send_file(path_to_file, as_attachment=True, etag=etag)
+
+        response = Response(generate_zip_file(path_to_file.parent), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=structures.zip'
+        response.set_etag(etag)
+        return response
 
 
 def get_bool_value(original: Union[None, str]) -> bool:
@@ -738,17 +1209,272 @@ def round_charges(charges: Dict[str, Union[str, List[str]]]) -> Dict[str, Union[
     return rounded_charges
 
 
-def calculate_charges(molecules: chargefw2_python.Molecules, method: str, parameters: str) -> CalculationResult:
-    """Function calculates charges"""
-    calc_start = time.perf_counter()
-    charges = chargefw2_python.calculate_charges(molecules, method, parameters)
-    calc_end = time.perf_counter()
+def calculate_charges(molecules: chargefw2_python.Molecules, method: str, parameters: str,
+                      atoms: Union[None, int] = None, estimated_time: Union[None, float] = None) -> CalculationResult:
+    """Function calculates charges, number of atoms selects lane of scheduler,
+    estimated time (if it is known) is the cost of calculation in fair queuing"""
+    with admitted(atoms, estimated_time):
+        return calculate_admitted_charges(molecules, method, parameters)
 
-    rounded_charges = round_charges(charges)
+
+def calculate_admitted_charges(molecules: chargefw2_python.Molecules, method: str,
+                               parameters: str) -> CalculationResult:
+    """Calculates charges of molecules whose calculation was already admitted by scheduler"""
+    with span('calculation'):
+        calc_start = time.perf_counter()
+        charges = chargefw2_python.calculate_charges(molecules, method, parameters)
+        calc_end = time.perf_counter()
+
+    with span('round_charges'):
+        rounded_charges = round_charges(charges)
     result_of_calculation = CalculationResult(round(calc_end - calc_start, 2), rounded_charges, method, parameters)
     return result_of_calculation
 
 
+def get_calculation_mode(structure: Structure, method: Union[None, str],
+                         generate_mol2: bool) -> Tuple[Union[None, str], Union[None, Tuple[int, int]]]:
+    """Returns how structure is calculated and its number of molecules and atoms found by scan of file:
+    batched - small sdf or mol2 structure with given method is calculated together with structures of other requests,
+    chunked - large sdf or mol2 structure is split into chunks of molecules calculated in parallel,
+    None - structure is loaded and calculated by request (size is not scanned)"""
+    batching = config['batching']['on'] == 'True' and method
+    chunking = config['chunking']['on'] == 'True'
+    path_to_file = structure.get_structure_file()
+    if generate_mol2 or not (batching or chunking) or \
+            pathlib.Path(path_to_file).suffix.lower() not in ('.sdf', '.mol2'):
+        return None, None
+    molecules_count, atom_count = scan_structure_file(path_to_file)
+    if batching and molecules_count and atom_count <= int(config['batching']['max_atoms']):
+        return 'batched', (molecules_count, atom_count)
+    if chunking and molecules_count >= int(config['chunking']['min_molecules']):
+        return 'chunked', (molecules_count, atom_count)
+    return None, None
+
+
+def calculate_charges_batch(items: List[Tuple[str, str, float, int]], method: str, parameters: Union[None, str],
+                            read_hetatm: bool, ignore_water: bool) -> List[Union[CalculationResult, Exception]]:
+    """Calculates charges of structures (path, user, cost, number of atoms) of several requests at once -
+    molecules of all structures are merged into one file, charges are split per structure afterwards.
+    If calculation of merged structures fails, structures are calculated one by one, so that error of one structure
+    does not affect the others. Batch is admitted as one task of the user who opened it, the other users are charged
+    for costs of their structures."""
+    atoms = sum(item[3] for item in items)
+    with admitted(atoms, items[0][2]):
+        scheduler = services.get_scheduler(atoms)
+        for _, user, cost, _ in items[1:]:
+            scheduler.charge(user, services.user_weights.get(user, 1.0), cost)
+        return calculate_admitted_charges_batch([item[0] for item in items], method, parameters, read_hetatm,
+                                                ignore_water)
+
+
+def calculate_admitted_charges_batch(paths: List[str], method: str, parameters: Union[None, str], read_hetatm: bool,
+                                     ignore_water: bool) -> List[Union[CalculationResult, Exception]]:
+    """Calculates charges of structures of batch which was already admitted by scheduler"""
+    if len(paths) > 1:
+        with tempfile.TemporaryDirectory(dir=config['paths']['save_user_files']) as directory:
+            merged_file = os.path.join(directory, 'batch' + pathlib.Path(paths[0]).suffix.lower())
+            names = merge_molecule_files(paths, merged_file)
+            try:
+                molecules = chargefw2_python.Molecules(merged_file, read_hetatm, ignore_water)
+                result = calculate_admitted_charges(molecules, method, parameters)
+                return [CalculationResult(result.calc_time, charges, result.method, result.parameters)
+                        for charges in split_merged_charges(result.get_charges(), names)]
+            except (RuntimeError, KeyError):
+                pass
+
+    results = []
+    for path in paths:
+        try:
+            molecules = chargefw2_python.Molecules(path, read_hetatm, ignore_water)
+        except RuntimeError as e:
+            results.append(ValueError(e))
+            continue
+        try:
+            results.append(calculate_admitted_charges(molecules, method, parameters))
+        except RuntimeError as e:
+            results.append(e)
+    return results
+
+
+def calculate_charges_chunked(path_to_file: str, method: str, parameters: Union[None, str], read_hetatm: bool,
+                              ignore_water: bool, atoms: int, estimated_time: Union[None, float]) -> CalculationResult:
+    """Calculates charges of large structure in parallel - molecules are split into chunks calculated
+    by calculation worker pool, charges are merged in original order of molecules.
+    Charges of molecule do not depend on the other molecules, so they are the same as of whole structure.
+    Every chunk is admitted by scheduler by itself, so that chunks of all requests and worker processes
+    do not run on more CPUs than the lane allows."""
+    with tempfile.TemporaryDirectory(dir=config['paths']['save_user_files']) as directory:
+        with span('chunks'):
+            chunk_files = split_molecule_file(path_to_file, int(config['chunking']['chunk_size']), directory)
+        chunk_time = services.get_cost(atoms, estimated_time) / len(chunk_files)
+        with span('calculation'):
+            calc_start = time.perf_counter()
+            pending = [submit_admitted(lambda callback: calculation_pool.submit(
+                calculate_chunk_charges, (chunk_file, method, parameters, read_hetatm, ignore_water), callback),
+                atoms, chunk_time) for chunk_file in chunk_files]
+            charges = {}
+            for chunk_charges in pending:
+                charges.update(chunk_charges.get())
+            calc_end = time.perf_counter()
+
+    with span('round_charges'):
+        rounded_charges = round_charges(charges)
+    return CalculationResult(round(calc_end - calc_start, 2), rounded_charges, method, parameters)
+
+
+def get_frame_charges(charges: Dict[str, List[float]]) -> List[float]:
+    """Returns charges of all atoms of frame in order of atoms"""
+    return [round(charge, 4) for molecule_charges in charges.values() for charge in molecule_charges]
+
+
+def generate_trajectory_charges(header: Dict[str, Any], frames: List[str], pending: List[AsyncResult],
+                                submit_frame: Callable[[str], AsyncResult], with_statistics: bool,
+                                resources: ExitStack, log: Callable[[float, int], None]) -> Iterator[str]:
+    """Yields json lines - header, charges of frames (in order of frames) calculated in parallel by calculation worker
+    pool and mean and variance of charge of every atom across frames (if requested).
+    Frames are submitted (admitted one by one) ahead of the sent frame, at most one per worker of the pool,
+    pending are frames which were already submitted. Directory with frames is removed when all frames are sent."""
+    try:
+        yield json.dumps(header) + '\n'
+        calc_start = time.perf_counter()
+        window = calculation_pool.processes
+        rejected = None
+        # running mean and sum of squared deviations (Welford) of charges of atoms
+        count = 0
+        mean = []
+        deviations = []
+        for index in range(len(frames)):
+            while rejected is None and len(pending) < min(index + window, len(frames)):
+                try:
+                    pending.append(submit_frame(frames[len(pending)]))
+                except AdmissionRejected as e:
+                    # response is already streamed, frames which were not admitted are reported as failed
+                    rejected = e
+            if index >= len(pending):
+                yield json.dumps({'frame': index, 'error': str(rejected)}) + '\n'
+                continue
+            try:
+                charges = get_frame_charges(pending[index].get())
+            except RuntimeError as e:
+                yield json.dumps({'frame': index, 'error': str(e)}) + '\n'
+                continue
+            yield json.dumps({'frame': index, 'charges': charges}, separators=(',', ':')) + '\n'
+            if not with_statistics or (count and len(charges) != len(mean)):
+                continue
+            count += 1
+            if count == 1:
+                mean = [0.0] * len(charges)
+                deviations = [0.0] * len(charges)
+            for atom, charge in enumerate(charges):
+                delta = charge - mean[atom]
+                mean[atom] += delta / count
+                deviations[atom] += delta * (charge - mean[atom])
+        calc_time = round(time.perf_counter() - calc_start, 2)
+        if with_statistics:
+            yield json.dumps({'frames': count,
+                              'mean': [round(value, 4) for value in mean],
+                              'variance': [round(value / count, 6) for value in deviations] if count else []},
+                             separators=(',', ':')) + '\n'
+        log(calc_time, len(frames))
+    finally:
+        resources.close()
+
+
+def calculate_trajectory(structure: Structure, method: Union[None, str], parameters: Union[None, str],
+                         read_hetatm: bool, ignore_water: bool, with_statistics: bool,
+                         method_selection: str = 'default', budget: Union[None, float] = None) -> Response:
+    """Calculates charges of every model of pdb or mmcif structure as frame of trajectory,
+    charges are streamed as json lines - header, one line per frame and optional statistics of atoms"""
+    path_to_file = structure.get_structure_file()
+    suffix = pathlib.Path(path_to_file).suffix.lower()
+    if suffix not in ('.pdb', '.cif', '.mmcif'):
+        raise ValueError('Trajectory can be calculated only for .pdb or .cif structures.')
+    resources = ExitStack()
+    try:
+        directory = resources.enter_context(tempfile.TemporaryDirectory(dir=config['paths']['save_user_files']))
+        with span('frames'):
+            frames = split_models(path_to_file, directory)
+        try:
+            molecules = chargefw2_python.Molecules(frames[0], read_hetatm, ignore_water)
+        except RuntimeError as e:
+            raise ValueError(e)
+        molecules_count, atom_count, _ = chargefw2_python.get_info(molecules)
+
+        def estimate(suitable_method: str) -> Union[None, float]:
+            frame_time = services.estimate_calc_time(suitable_method, atom_count, molecules_count)
+            return frame_time * len(frames) if frame_time is not None else None
+
+        if not method:
+            suitable_methods = structure.format_methods(chargefw2_python.get_suitable_methods(molecules))
+            # method is selected by the same policies as for single structure, budget is time of whole trajectory
+            selection = method_catalogue.select_method(suitable_methods, method_selection, estimate, budget)
+            method = selection['method']
+            parameters = selection['parameters']
+        else:
+            method_selection = None
+        frame_time = services.estimate_calc_time(method, atom_count, molecules_count)
+        estimated_time = round(frame_time * len(frames), 3) if frame_time is not None else None
+        if exceeds_long_calculations(estimated_time):
+            raise ValueError(f'It is allowed to perform only {config["limits"]["max_long_calc"]} '
+                             f'time demanding calculations per day.')
+
+        def submit_frame(frame: str) -> AsyncResult:
+            # every frame is admitted separately and releases its admission when it is calculated
+            return submit_admitted(lambda callback: calculation_pool.submit(
+                calculate_chunk_charges, (frame, method, parameters, read_hetatm, ignore_water), callback),
+                atom_count, frame_time)
+
+        # the first frame is admitted before response is streamed, so overloaded server rejects the request
+        pending = [submit_frame(frames[0])]
+    except BaseException:
+        resources.close()
+        raise
+
+    response = OKResponse(data={}, request=request)
+
+    def log(calc_time: float, frames_count: int) -> None:
+        if limitations_on and calc_time > float(config['limits']['calc_time']):
+            add_long_calc(long_calculations, request.remote_addr)
+        response.log(simple_logger, time=calc_time, suffix=suffix, number_of_molecules=molecules_count,
+                     number_of_atoms=atom_count, number_of_frames=frames_count, method=method,
+                     parameters=parameters, estimated_time=estimated_time, calculation_mode='trajectory')
+
+    header = {'method': method, 'parameters': parameters, 'method_selection': method_selection,
+              'number_of_frames': len(frames), 'number_of_atoms': atom_count, 'estimated_calc_time': estimated_time}
+    lines = generate_trajectory_charges(header, frames, pending, submit_frame, with_statistics, resources, log)
+    result = Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    # resources are released also when client disconnects before the stream starts
+    result.call_on_close(resources.close)
+    return result
+
+
+def calculate_coalesced(key: Tuple, calculate: Callable[[], CalculationResult]) -> Tuple[CalculationResult, bool]:
+    """Runs calculation, identical concurrent calculations (in all worker processes) wait for result of the first one
+    instead of running again. Returns result and whether it was taken from identical calculation."""
+    if config['single_flight']['on'] != 'True':
+        return calculate(), False
+    if single_flight.begin(key):
+        try:
+            result = calculate()
+        except RuntimeError as e:
+            single_flight.finish(key, {'error': str(e)})
+            raise
+        except BaseException:
+            # waiting calculations run by themselves (e.g. when calculation was not admitted)
+            single_flight.finish(key, None)
+            raise
+        single_flight.finish(key, {'calc_time': result.calc_time, 'charges': result.get_charges(),
+                                   'method': result.method, 'parameters': result.parameters})
+        return result, False
+    with span('coalesced'):
+        shared = single_flight.wait(key)
+    if shared is None:
+        return calculate(), False
+    if 'error' in shared:
+        raise RuntimeError(shared['error'])
+    return CalculationResult(shared['calc_time'], shared['charges'], shared['method'], shared['parameters']), True
+
+
 calc_parser = reqparse.RequestParser()
 calc_parser.add_argument('structure_id',
                          type=str,
@@ -775,6 +1501,31 @@ calc_parser.add_argument('generate_mol2',
                          help='Use in case that you want to generate charges '
                               'into mol2 format instead of returning list of charges.\n'
                               'Default: False')
+calc_parser.add_argument('method_selection',
+                         type=str,
+                         choices=METHOD_SELECTION_POLICIES,
+                         help='Selection of method when it is not specified: default - the first suitable method, '
+                              'fastest - the fastest method of the same accuracy class, '
+                              'budget - the first method predicted to finish within time_budget.\n'
+                              'Default: default')
+calc_parser.add_argument('time_budget',
+                         type=float,
+                         help='Time budget (in seconds) of calculation for budget method selection')
+calc_parser.add_argument('trajectory',
+                         type=bool,
+                         help='Use in case that you want to calculate charges of every model of pdb or mmcif '
+                              'structure as frame of trajectory, charges are streamed as json lines.\n'
+                              'Default: False')
+calc_parser.add_argument('frame_statistics',
+                         type=bool,
+                         help='Use in case that you want also mean and variance of charge of every atom '
+                              'across frames of trajectory.\n'
+                              'Default: False')
+calc_parser.add_argument('dry_run',
+                         type=bool,
+                         help='Use in case that you want only to know estimated time of calculation '
+                              '(in seconds), charges are not calculated.\n'
+                              'Default: False')
 @calc_charges.route('')
 @api.doc(responses={404: 'Structure ID not specified',
                     400: 'Structure ID does not exist/'
@@ -782,6 +1533,7 @@ calc_parser.add_argument('generate_mol2',
                          'method is not available/'
                          'method is not suitable for dataset/'
                          'wrong or incompatible parameters',
+                    503: 'Server is overloaded, repeat the request after Retry-After seconds',
                     200: 'OK'})
 @api.expect(calc_parser)
 class CalculateCharges(Resource):
@@ -800,6 +1552,10 @@ class CalculateCharges(Resource):
         read_hetatm = get_bool_value(read_hetatm)  # default: True
         ignore_water = get_bool_value(ignore_water)  # default False
         generate_mol2 = get_bool_value(generate_mol2)  # default False
+        dry_run = get_bool_value(request.args.get('dry_run'))  # default False
+        method_selection = request.args.get('method_selection', 'default')
+        time_budget = request.args.get('time_budget')
+        trajectory = get_bool_value(request.args.get('trajectory'))  # default False
 
         if not structure_id:
             response = ErrorResponse(message=f'Structure ID not specified', request=request)
@@ -807,7 +1563,8 @@ class CalculateCharges(Resource):
             return response.json
 
         try:
-            structure = Structure(structure_id, file_manager)
+            with span('structure'):
+                structure = Structure(structure_id, file_manager)
         except ValueError as e:
             response = ErrorResponse(str(e), 400, request)
             response.log(simple_logger)
@@ -815,74 +1572,127 @@ class CalculateCharges(Resource):
 
         if method:
             # method is not available
-            if method not in chargefw2_python.get_available_methods():
+            if method not in method_catalogue:
                 response = ErrorResponse(f'Method {method} is not available.', status_code=400, request=request)
                 response.log(simple_logger)
                 return response.json
 
-        if not method:
-            suitable_methods = structure.get_suitable_methods(read_hetatm, ignore_water)
-            method = suitable_methods[0]['method']
-            if not suitable_methods[0]['parameters']:
-                parameters = None
-            else:
-                parameters = suitable_methods[0]['parameters'][0]
+        if trajectory:
+            try:
+                return calculate_trajectory(structure, method, parameters, read_hetatm, ignore_water,
+                                            get_bool_value(request.args.get('frame_statistics')), method_selection,
+                                            float(time_budget) if time_budget else None)
+            except ValueError as e:
+                response = ErrorResponse(str(e), request=request)
+                response.log(simple_logger)
+                return response.json
 
         try:
-            molecules = structure.get_molecules(read_hetatm, ignore_water)
+            mode, scanned_size = (None, None) if dry_run else get_calculation_mode(structure, method, generate_mol2)
+            if mode:
+                # batched and chunked structures are not loaded by request
+                molecules = None
+                molecules_count, atom_count = scanned_size
+            else:
+                with span('molecules'):
+                    molecules = structure.get_molecules(read_hetatm, ignore_water)
+                # number of atoms is known before calculation, it routes the calculation to fast or slow lane
+                with span('info'):
+                    molecules_count, atom_count, atoms_list_count = chargefw2_python.get_info(molecules)
+
+            if not method:
+                with span('suitable_methods'):
+                    suitable_methods = structure.get_suitable_methods(read_hetatm, ignore_water)
+                # method is selected by policy using complexity of methods and their predicted times
+                selection = method_catalogue.select_method(
+                    suitable_methods, method_selection,
+                    lambda suitable_method: services.estimate_calc_time(suitable_method, atom_count, molecules_count),
+                    float(time_budget) if time_budget else None)
+                method = selection['method']
+                parameters = selection['parameters']
+                estimated_time = selection['estimated_calc_time']
+            else:
+                method_selection = None
+                with span('estimate'):
+                    estimated_time = services.estimate_calc_time(method, atom_count, molecules_count)
         except ValueError as e:
             response = ErrorResponse(str(e), request=request)
             response.log(simple_logger)
             return response.json
 
-        if config['limits']['on'] == 'True':
-            if request.remote_addr in long_calculations and \
-                    long_calculations[request.remote_addr] >= int(config['limits']['max_long_calc']):
-                response = ErrorResponse(message=f'It is allowed to perform only {config["limits"]["max_long_calc"]} '
-                                                 f'time demanding calculations per day.',
-                                         request=request)
-                response.log(simple_logger)
-                return response.json
+        suffix = pathlib.Path(structure.get_structure_file()).suffix
+        if estimated_time is not None:
+            estimated_time = round(estimated_time, 3)
+
+        if dry_run:
+            response = OKResponse(data={'method': method, 'parameters': parameters,
+                                        'method_selection': method_selection,
+                                        'number_of_molecules': molecules_count, 'number_of_atoms': atom_count,
+                                        'estimated_calc_time': estimated_time},
+                                  request=request)
+            response.log(simple_logger, method=method, parameters=parameters, dry_run=True)
+            return response.json
+
+        if exceeds_long_calculations(estimated_time):
+            response = ErrorResponse(message=f'It is allowed to perform only {config["limits"]["max_long_calc"]} '
+                                             f'time demanding calculations per day.',
+                                     request=request)
+            response.log(simple_logger)
+            return response.json
+
+        def calculate() -> CalculationResult:
+            if mode == 'chunked':
+                return calculate_charges_chunked(structure.get_structure_file(), method, parameters, read_hetatm,
+                                                 ignore_water, atom_count, estimated_time)
+            if mode == 'batched':
+                with span('batch'):
+                    return micro_batcher.submit(
+                        (method, parameters, suffix.lower(), read_hetatm, ignore_water),
+                        (structure.get_structure_file(), request.remote_addr,
+                         services.get_cost(atom_count, estimated_time), atom_count),
+                        lambda items: calculate_charges_batch(items, method, parameters, read_hetatm, ignore_water))
+            return calculate_charges(molecules, method, parameters, atom_count, estimated_time)
 
         try:
-            result_of_calculation = calculate_charges(molecules, method, parameters)
-        except RuntimeError as e:
+            result_of_calculation, coalesced = calculate_coalesced(
+                (structure_id, method, parameters, read_hetatm, ignore_water), calculate)
+        except (RuntimeError, ValueError) as e:
             response = ErrorResponse(str(e), request=request)
             response.log(simple_logger)
             return response.json
 
-        if config['limits']['on'] == 'True':
+        # coalesced calculation did not take any time of server, time of batched calculation is time of whole batch
+        if config['limits']['on'] == 'True' and not coalesced and mode != 'batched':
             if result_of_calculation.calc_time > float(config['limits']['calc_time']):
                 add_long_calc(long_calculations, request.remote_addr)
 
-        suffix = pathlib.Path(structure.get_structure_file()).suffix
-        molecules_count, atom_count, atoms_list_count = chargefw2_python.get_info(molecules)
-
         response = OKResponse(data={'charges': result_of_calculation.get_charges(), 'method': result_of_calculation.method,
-                                    'parameters': result_of_calculation.parameters},
+                                    'parameters': result_of_calculation.parameters,
+                                    'method_selection': method_selection,
+                                    'estimated_calc_time': estimated_time,
+                                    'coalesced': coalesced},
                               request=request)
-        if not request.args.get('method'):
-            response.log(simple_logger,
-                         time=result_of_calculation.calc_time,
-                         suffix=suffix,
-                         number_of_molecules=molecules_count,
-                         number_of_atoms=atom_count,
-                         method=method,
-                         parameters=parameters)
-        else:
-            response.log(simple_logger,
-                         time=result_of_calculation.calc_time,
-                         suffix=suffix,
-                         number_of_molecules=molecules_count,
-                         number_of_atoms=atom_count)
-
         if generate_mol2:
-            tmpdir = generate_tmp_directory()
-            mol2_file = tmpdir + structure_id + '.mol2'
-            chargefw2_python.save_mol2(molecules, result_of_calculation.get_charges(), mol2_file)
-            return send_file(mol2_file, as_attachment=True)
-
-        return response.json
+            with span('mol2'):
+                mol2_file = os.path.join(generate_tmp_directory(), structure_id + '.mol2')
+                chargefw2_python.save_mol2(molecules, result_of_calculation.get_charges(), mol2_file)
+                result = send_file(mol2_file, as_attachment=True)
+        else:
+            with span('serialization'):
+                result = response.json
+
+        # statistics record contains durations of all phases, method and parameters allow replay of the calculation
+        response.log(simple_logger,
+                     time=result_of_calculation.calc_time,
+                     suffix=suffix,
+                     number_of_molecules=molecules_count,
+                     number_of_atoms=atom_count,
+                     method=method,
+                     parameters=parameters,
+                     estimated_time=estimated_time,
+                     calculation_mode=mode,
+                     coalesced=coalesced)
+        return result
 
 
 class Limits:
@@ -936,44 +1746,28 @@ class GetLimitsEndpoint(Resource):
         return limits.get_limits()
 
 
+@stats.route('')
+class StatisticsEndpoint(Resource):
+    def get(self) -> Dict[str, Any]:
+        """Returns counts of requests per endpoint and method, calculation times by structure size,
+        the most requested PDB IDs and Pubchem CIDs and state of queue of calculations"""
+        # log is read in background, response contains statistics ingested so far
+        services.refresh_statistics()
+        response = OKResponse(data={**statistics.get_summary(),
+                                    'scheduler': {lane: scheduler.get_stats()
+                                                  for lane, scheduler in schedulers.items()},
+                                    # batches of current worker process
+                                    'batching': micro_batcher.get_stats(),
+                                    'single_flight': single_flight.get_stats()},
+                              request=request)
+        response.log(simple_logger)
+        return response.json
+
+
 def add_long_calc(long_calc: Dict[Any, Any], user_add: str) -> None:
     """Add long calculation to user"""
     long_calc[user_add] = long_calc.get(user_add, 0) + 1
 
 
-def increase_limit() -> None:
-    """Increase number of long calculation"""
-    to_delete = []
-    for user in long_calculations:
-        if long_calculations[user] > 1:
-            long_calculations[user] -= 1
-        else:
-            to_delete.append(user)
-    for user in to_delete:
-        del long_calculations[user]
-
-
-limitations_on = False
-
-# limits in api.ini are enabled
-if config['limits']['on'] == 'True':
-    limitations_on = True
-    long_calculations = manager.dict()
-    used_space = manager.dict()
-    del_timer = RepeatTimer(float(config['limits']['decrease_restriction']), increase_limit)
-    del_timer.start()
-
-file_manager = manager.dict()  # id: path_to_file
-user_id_manager = manager.dict()  # {user:[id1, id2]}
-
-
-# Remove file manager and tmp files repeatedly
-remove_tmp = RepeatTimer(float(config['remove_tmp']['every_x_seconds']),
-                         lambda: delete_old_records(file_manager, user_id_manager,
-                                                    float(config['remove_tmp']['older_than']),
-                                                    config['remove_tmp']['log']))
-remove_tmp.start()
-
-
 if __name__ == '__main__':
-    app.run(host='0.0.0.0')
+    create_app().run(host='0.0.0.0')
@@ -16,7 +16,8 @@ def delete_id_from_user(identifier: str, user_id_manager: Dict[str, List[str]])
 
 
 def delete_old_records(file_manager: Dict[str, Union[str, os.PathLike]], user_id_manager: Dict[str, List[str]],
-                       config_older_than: float, log_file: Union[str, os.PathLike]) -> None:
+                       config_older_than: float, log_file: Union[str, os.PathLike],
+                       sidecar_manager: Dict[str, List[Union[str, os.PathLike]]] = None) -> None:
     identifiers = file_manager.keys()
     for identifier in identifiers:
         path_to_id = pathlib.Path(file_manager[identifier])
@@ -26,6 +27,9 @@ def delete_old_records(file_manager: Dict[str, Union[str, os.PathLike]], user_id
             del file_manager[identifier]
             # delete id from ids of user
             delete_id_from_user(identifier, user_id_manager)
+            # files derived from structure are removed together with its directory
+            if sidecar_manager is not None:
+                sidecar_manager.pop(identifier, None)
             with open(log_file, mode='a') as output:
                 output.write(f'{date.today().strftime("%d/%m/%Y")}, '
                              f'{time.strftime("%H:%M:%S", time.localtime())} '
@@ -40,6 +44,18 @@ def delete_old_records(file_manager: Dict[str, Union[str, os.PathLike]], user_id
                 path_to_id.parent.rmdir()
 
 
+def increase_limit(long_calculations: Dict[str, int]) -> None:
+    """Increase number of long calculation"""
+    to_delete = []
+    for user in long_calculations:
+        if long_calculations[user] > 1:
+            long_calculations[user] -= 1
+        else:
+            to_delete.append(user)
+    for user in to_delete:
+        del long_calculations[user]
+
+
 class RepeatTimer(Timer):
     def run(self) -> None:
         while not self.finished.wait(self.interval):
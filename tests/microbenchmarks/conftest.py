@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+BASELINES = Path(__file__).resolve().parent / 'baselines.json'
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--update-baselines', action='store_true', help='Store measured times as new baselines'
+    )
+    parser.addoption(
+        '--regression-threshold', action='store', type=float,
+        default=float(os.environ.get('REGRESSION_THRESHOLD', 0.25)),
+        help='Allowed slowdown against baseline (0.25 - 25 %%)'
+    )
+    parser.addoption(
+        '--rounds', action='store', type=int, default=5, help='Number of measured rounds of every benchmark'
+    )
+
+
+class Benchmark:
+    def __init__(self, baselines, update, threshold, rounds):
+        self._baselines = baselines
+        self._update = update
+        self._threshold = threshold
+        self._rounds = rounds
+        self.results = {}
+
+    def __call__(self, name, func, *args, number=100, **kwargs):
+        """Measures time of one call of function (minimum over rounds) and compares it with baseline,
+        fails only when it regressed against existing baseline"""
+        func(*args, **kwargs)  # warm up
+        times = []
+        for _ in range(self._rounds):
+            start = time.perf_counter()
+            for _ in range(number):
+                func(*args, **kwargs)
+            times.append((time.perf_counter() - start) / number)
+        measured = min(times)
+        self.results[name] = measured
+        if self._update:
+            return measured
+        baseline = self._baselines.get(name)
+        if baseline is None:
+            # baselines depend on machine, they are measured on reference machine with --update-baselines
+            pytest.skip(f'{name} has no baseline ({measured * 1e6:.1f} us)')
+        assert measured <= baseline * (1 + self._threshold), \
+            f'{name} regressed: {measured * 1e6:.1f} us, baseline {baseline * 1e6:.1f} us'
+        return measured
+
+
+@pytest.fixture(scope='session')
+def benchmark(request):
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    update = request.config.getoption('--update-baselines')
+    bench = Benchmark(baselines, update, request.config.getoption('--regression-threshold'),
+                      request.config.getoption('--rounds'))
+    yield bench
+    if update:
+        baselines.update(bench.results)
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+
+
+@pytest.fixture(scope='session')
+def api_acc2():
+    pytest.importorskip('chargefw2_python')
+    pytest.importorskip('flask_restx')
+    sys.path.insert(0, str(ROOT / 'src'))
+    import api_acc2
+    return api_acc2
+
+
+@pytest.fixture(scope='session')
+def app(api_acc2, tmp_path_factory):
+    """Application with configuration writing files and logs to temporary directory,
+    its context is active during the whole session"""
+    workdir = tmp_path_factory.mktemp('api')
+    config = api_acc2.load_config(ROOT / 'utils/api.ini')
+    for key in config['paths']:
+        config['paths'][key] = str(workdir / Path(config['paths'][key]).name)
+    config['remove_tmp']['log'] = str(workdir / 'log_removing_user_files.txt')
+    config['limits']['granted_space'] = str(10 ** 12)
+    config['state']['lock_dir'] = str(workdir)
+    os.makedirs(config['paths']['save_user_files'], exist_ok=True)
+
+    app = api_acc2.create_app(config)
+    with app.app_context():
+        yield app
+    app.extensions['api_acc2'].close()
+
+
+@pytest.fixture(scope='session')
+def client(app):
+    return app.test_client()
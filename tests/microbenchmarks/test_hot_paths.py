@@ -0,0 +1,82 @@
+import random
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+VALID_FILE = ROOT / 'tests/unit_tests/dependencies/1ner.pdb'
+
+
+@pytest.fixture(scope='module')
+def charges():
+    rng = random.Random(0)
+    return {f'molecule_{i}': [rng.uniform(-1, 1) for _ in range(1000)] for i in range(10)}
+
+
+@pytest.fixture(scope='module')
+def structure_id(api_acc2, client):
+    with open(VALID_FILE, 'rb') as file:
+        response = client.post('/send_files', data={'file[]': (file, VALID_FILE.name)})
+    return response.get_json()['structure_ids'][VALID_FILE.stem]
+
+
+def test_round_charges(api_acc2, app, benchmark, charges):
+    benchmark('round_charges', api_acc2.round_charges, charges, number=10)
+
+
+def test_format_methods(api_acc2, app, benchmark, structure_id):
+    structure = api_acc2.Structure(structure_id, api_acc2.file_manager)
+    methods = [(f'method_{i}', [f'/usr/local/share/chargefw2/parameters/params_{i}_{j}.json' for j in range(10)])
+               for i in range(20)]
+    benchmark('format_methods', structure.format_methods, methods, number=1000)
+
+
+def test_get_individual_atoms_count(api_acc2, benchmark):
+    atoms_count = [(element, count) for count, element in enumerate(['C', 'H', 'N', 'O', 'S', 'P', 'Fe', 'Zn'])]
+    benchmark('get_individual_atoms_count', api_acc2.get_individual_atoms_count, atoms_count, number=10000)
+
+
+def test_ok_response_json(api_acc2, app, benchmark, charges):
+    with app.test_request_context('/calculate_charges'):
+        response = api_acc2.OKResponse(data={'charges': charges, 'method': 'eem', 'parameters': None},
+                                       request=api_acc2.request)
+        benchmark('ok_response_json', lambda: response.json, number=10)
+
+
+def test_save_file_identifiers(api_acc2, app, benchmark):
+    with app.test_request_context('/send_files', environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        benchmark('save_file_identifiers', api_acc2.save_file_identifiers,
+                  {'benchmark_id': str(VALID_FILE)}, number=100)
+
+
+def test_delete_old_records(api_acc2, app, benchmark, structure_id, tmp_path):
+    from remove_old_files import delete_old_records
+    # nothing is old enough to be removed, only the scan of records is measured
+    benchmark('delete_old_records', delete_old_records, api_acc2.file_manager, api_acc2.user_id_manager,
+              time.time(), str(tmp_path / 'log_removing.txt'), number=10)
+
+
+def test_manager_proxy_lookups(api_acc2, app, benchmark, structure_id):
+    def lookup():
+        return structure_id in api_acc2.file_manager and api_acc2.file_manager[structure_id]
+
+    benchmark('manager_proxy_lookup', lookup, number=1000)
+
+
+@pytest.mark.parametrize('path', [
+    '/available_methods',
+    '/get_limits',
+])
+def test_client_endpoints(client, benchmark, path):
+    benchmark(f'client{path}', client.get, path, number=100)
+
+
+def test_client_get_info(client, benchmark, structure_id):
+    benchmark('client/get_info', client.get, '/get_info', query_string={'structure_id': structure_id}, number=20)
+
+
+def test_client_calculate_charges(client, benchmark, structure_id):
+    benchmark('client/calculate_charges', client.get, '/calculate_charges',
+              query_string={'structure_id': structure_id, 'method': 'eem',
+                            'parameters': 'EEM_00_NEEMP_ccd2016_npa'}, number=5)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import math
+import sys
+
+from results import load_records
+
+# layers from the innermost - overhead of layer is difference to the previous layer
+LAYERS = ('chargefw2', 'pybind', 'api')
+
+
+def betainc(a, b, x):
+    """Regularized incomplete beta function (continued fraction, Numerical Recipes 6.4)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - betainc(b, a, 1.0 - x)
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)) / a
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 201):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * result
+
+
+def welch_test(first, second):
+    """Returns t statistic and two-sided p-value of Welch's t-test of two records (None if it cannot be computed)"""
+    if first['count'] < 2 or second['count'] < 2:
+        return None, None
+    first_variance = first['stdev'] ** 2 / first['count']
+    second_variance = second['stdev'] ** 2 / second['count']
+    variance = first_variance + second_variance
+    if variance == 0:
+        return None, 0.0 if first['mean'] != second['mean'] else 1.0
+    t = (second['mean'] - first['mean']) / math.sqrt(variance)
+    df = variance ** 2 / (first_variance ** 2 / (first['count'] - 1) + second_variance ** 2 / (second['count'] - 1))
+    return t, betainc(df / 2, 0.5, df / (df + t ** 2))
+
+
+def get_key(record):
+    return record['suite'], record['layer'], record['method'], record['parameters'], record['input']
+
+
+def compare_records(baseline, candidate, alpha, threshold):
+    """Compares measurements present in both runs, significant changes bigger than threshold are flagged"""
+    baseline = {get_key(record): record for record in baseline}
+    comparisons = []
+    for record in candidate:
+        key = get_key(record)
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        t, p_value = welch_test(old, record)
+        change = (record['mean'] - old['mean']) / old['mean'] if old['mean'] else 0.0
+        verdict = 'unchanged'
+        if p_value is not None and p_value < alpha and abs(change) > threshold:
+            verdict = 'regression' if change > 0 else 'improvement'
+        comparisons.append({'suite': key[0], 'layer': key[1], 'method': key[2], 'parameters': key[3],
+                            'input': key[4], 'baseline_mean': old['mean'], 'baseline_stdev': old['stdev'],
+                            'candidate_mean': record['mean'], 'candidate_stdev': record['stdev'],
+                            'change': change, 't': t, 'p_value': p_value, 'verdict': verdict})
+    return comparisons
+
+
+def get_overheads(records):
+    """Returns overhead of every layer over the layer below it, e.g. api - pybind (in seconds)"""
+    means = {get_key(record): record['mean'] for record in records}
+    overheads = {}
+    for suite, layer, method, parameters, input_name in means:
+        if layer not in LAYERS[1:]:
+            continue
+        inner = LAYERS[LAYERS.index(layer) - 1]
+        inner_key = (suite, inner, method, parameters, input_name)
+        if inner_key in means:
+            overheads[(suite, f'{layer}-{inner}', method, parameters, input_name)] = \
+                means[(suite, layer, method, parameters, input_name)] - means[inner_key]
+    return overheads
+
+
+def attribute_overheads(baseline, candidate):
+    """Returns overheads of layers in both runs and their change"""
+    old, new = get_overheads(baseline), get_overheads(candidate)
+    return [{'suite': key[0], 'layers': key[1], 'method': key[2], 'parameters': key[3], 'input': key[4],
+             'baseline': old[key], 'candidate': value, 'change': value - old[key]}
+            for key, value in new.items() if key in old]
+
+
+def compare(baseline, candidate, alpha=0.05, threshold=0.05):
+    """Compares two runs"""
+    warnings = []
+    if baseline[0]['host'] != candidate[0]['host']:
+        warnings.append('Runs were measured on different hosts, differences may not be caused by code changes.')
+    return {'baseline': {'run_id': baseline[0]['run_id'], 'git_revision': baseline[0]['git_revision']},
+            'candidate': {'run_id': candidate[0]['run_id'], 'git_revision': candidate[0]['git_revision']},
+            'warnings': warnings,
+            'comparisons': compare_records(baseline, candidate, alpha, threshold),
+            'overheads': attribute_overheads(baseline, candidate)}
+
+
+def format_report(report):
+    lines = [f'Baseline: {report["baseline"]["run_id"]} ({report["baseline"]["git_revision"]})',
+             f'Candidate: {report["candidate"]["run_id"]} ({report["candidate"]["git_revision"]})']
+    lines += [f'Warning: {warning}' for warning in report['warnings']]
+    lines.append('')
+    for item in report['comparisons']:
+        p_value = 'n/a' if item['p_value'] is None else f'{item["p_value"]:.4f}'
+        lines.append(f'{item["suite"]:<13} {item["layer"]:<10} {item["method"]}/{item["parameters"]} '
+                     f'{item["input"]}: {item["baseline_mean"]:.4f}±{item["baseline_stdev"]:.4f}s -> '
+                     f'{item["candidate_mean"]:.4f}±{item["candidate_stdev"]:.4f}s '
+                     f'({item["change"]:+.1%}, p={p_value}) {item["verdict"].upper()}')
+    if report['overheads']:
+        lines += ['', 'Overhead of layers:']
+    for item in report['overheads']:
+        lines.append(f'{item["suite"]:<13} {item["layers"]:<17} {item["method"]}/{item["parameters"]} '
+                     f'{item["input"]}: {item["baseline"]:.4f}s -> {item["candidate"]:.4f}s '
+                     f'({item["change"]:+.4f}s)')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark runs stored by tests.py --results_file')
+    parser.add_argument('baseline', help='Json lines file with baseline run')
+    parser.add_argument('candidate', help='Json lines file with candidate run')
+    parser.add_argument('--baseline_run', help='Run ID in baseline file (default: the last run)')
+    parser.add_argument('--candidate_run', help='Run ID in candidate file (default: the last run)')
+    parser.add_argument('--alpha', type=float, default=0.05, help='Significance level of Welch\'s t-test')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='Minimal relative change of mean reported as regression or improvement')
+    parser.add_argument('--json', action='store_true', help='Print report as json')
+    args = parser.parse_args()
+
+    result = compare(load_records(args.baseline, args.baseline_run), load_records(args.candidate, args.candidate_run),
+                     args.alpha, args.threshold)
+    print(json.dumps(result, indent=2) if args.json else format_report(result))
+    # non-zero exit status allows usage in CI
+    sys.exit(1 if any(item['verdict'] == 'regression' for item in result['comparisons']) else 0)
@@ -0,0 +1,281 @@
+import argparse
+import itertools
+import math
+import random
+from pathlib import Path
+
+# backbone geometry of beta strand (bond lengths in A, angles and torsions in degrees)
+N_CA, CA_C, C_N, C_O, CA_CB, N_H, C_H = 1.458, 1.525, 1.329, 1.231, 1.530, 1.010, 1.090
+PHI, PSI, OMEGA = -120.0, 120.0, 180.0
+RESIDUES_PER_CHAIN = 200
+CHAIN_IDS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+CHAIN_SPACING = 12.0
+# minimal distance (in A) of atoms of waters and ligands from all other atoms
+MIN_DISTANCE = 2.5
+# slab of waters and ligands is made thicker after this number of unsuccessful placements
+PLACEMENT_ATTEMPTS = 100
+
+
+def subtract(a, b):
+    return [a[0] - b[0], a[1] - b[1], a[2] - b[2]]
+
+
+def cross(a, b):
+    return [a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]]
+
+
+def normalize(a):
+    length = math.sqrt(a[0] ** 2 + a[1] ** 2 + a[2] ** 2)
+    return [a[0] / length, a[1] / length, a[2] / length]
+
+
+def place(a, b, c, bond, angle, torsion):
+    """Returns position of atom d bonded to c (bond length, angle b-c-d and torsion a-b-c-d)"""
+    angle, torsion = math.radians(angle), math.radians(torsion)
+    bc = normalize(subtract(c, b))
+    n = normalize(cross(subtract(b, a), bc))
+    m = cross(n, bc)
+    d2 = [-bond * math.cos(angle), bond * math.sin(angle) * math.cos(torsion), bond * math.sin(angle) * math.sin(torsion)]
+    return [c[i] + bc[i] * d2[0] + m[i] * d2[1] + n[i] * d2[2] for i in range(3)]
+
+
+def build_chain(residues):
+    """Returns atoms (name, element, residue number, coordinates) of polyalanine beta strand"""
+    atoms = []
+    n, ca = [0.0, 0.0, 0.0], [N_CA, 0.0, 0.0]
+    c = place([0.0, 1.0, 0.0], n, ca, CA_C, 111.2, PSI)
+    previous_c = place(c, ca, n, C_N, 121.7, PHI)
+    for number in range(1, residues + 1):
+        residue = [('N', 'N', n),
+                   ('CA', 'C', ca),
+                   ('C', 'C', c),
+                   ('O', 'O', place(n, ca, c, C_O, 120.5, PSI + 180.0)),
+                   ('CB', 'C', place(c, n, ca, CA_CB, 110.5, -122.5))]
+        cb = residue[-1][2]
+        residue += [('H', 'H', place(ca, previous_c, n, N_H, 119.0, 180.0) if number > 1
+                     else place(c, ca, n, N_H, 109.5, 60.0)),
+                    ('HA', 'H', place(c, n, ca, C_H, 109.5, 120.0)),
+                    ('HB1', 'H', place(n, ca, cb, C_H, 109.5, 60.0)),
+                    ('HB2', 'H', place(n, ca, cb, C_H, 109.5, 180.0)),
+                    ('HB3', 'H', place(n, ca, cb, C_H, 109.5, -60.0))]
+        atoms += [(name, element, number, position) for name, element, position in residue]
+        last_n, last_ca, last_c = n, ca, c
+        # next residue
+        next_n = place(n, ca, c, C_N, 116.2, PSI)
+        next_ca = place(ca, c, next_n, N_CA, 121.7, OMEGA)
+        next_c = place(c, next_n, next_ca, CA_C, 111.2, PHI)
+        previous_c, n, ca, c = c, next_n, next_ca, next_c
+    # terminal oxygen takes position of nitrogen of the next residue
+    atoms.append(('OXT', 'O', residues, place(last_n, last_ca, last_c, C_O, 116.2, PSI)))
+    return atoms
+
+
+def get_cell(position):
+    return tuple(math.floor(coordinate / MIN_DISTANCE) for coordinate in position)
+
+
+def add_to_cells(cells, positions):
+    """Adds positions to grid of cells with edge MIN_DISTANCE"""
+    for position in positions:
+        cells.setdefault(get_cell(position), []).append(position)
+
+
+def clashes(cells, positions):
+    """Returns whether some of positions is closer than MIN_DISTANCE to position in grid of cells"""
+    for position in positions:
+        x, y, z = get_cell(position)
+        for cell in itertools.product((x - 1, x, x + 1), (y - 1, y, y + 1), (z - 1, z, z + 1)):
+            for other in cells.get(cell, ()):
+                if sum((position[i] - other[i]) ** 2 for i in range(3)) < MIN_DISTANCE ** 2:
+                    return True
+    return False
+
+
+def build_protein(residues, waters=0, hetatms=0, seed=0):
+    """Returns records (group, name, element, residue name, chain, residue number, coordinates)
+    of protein of polyalanine chains, optionally with water molecules and ethanol ligands around"""
+    rng = random.Random(seed)
+    records = []
+    chains = [RESIDUES_PER_CHAIN] * (residues // RESIDUES_PER_CHAIN)
+    if residues % RESIDUES_PER_CHAIN:
+        chains.append(residues % RESIDUES_PER_CHAIN)
+    if len(chains) > len(CHAIN_IDS):
+        raise ValueError(f'At most {len(CHAIN_IDS) * RESIDUES_PER_CHAIN} residues are supported.')
+    grid = math.ceil(math.sqrt(len(chains)))
+    for index, length in enumerate(chains):
+        shift = [0.0, (index % grid) * CHAIN_SPACING, (index // grid) * CHAIN_SPACING]
+        for name, element, number, position in build_chain(length):
+            records.append(('ATOM', name, element, 'ALA', CHAIN_IDS[index], number,
+                            [position[i] + shift[i] for i in range(3)]))
+
+    # ligands and waters are placed in slab next to the protein, without clashes with already placed atoms
+    extent = grid * CHAIN_SPACING
+    cells = {}
+    add_to_cells(cells, [record[-1] for record in records])
+    depth = 6.0
+
+    def place_molecule(template):
+        nonlocal depth
+        while True:
+            for _ in range(PLACEMENT_ATTEMPTS):
+                origin = [rng.uniform(-4.0 - depth, -4.0), rng.uniform(0.0, extent), rng.uniform(0.0, extent)]
+                positions = [[origin[i] + position[i] for i in range(3)] for _, _, position in template]
+                if not clashes(cells, positions):
+                    add_to_cells(cells, positions)
+                    return positions
+            depth += MIN_DISTANCE
+
+    hetero_chain = CHAIN_IDS[len(chains) % len(CHAIN_IDS)]
+    for number in range(1, hetatms + 1):
+        for (name, element, _), position in zip(ETHANOL, place_molecule(ETHANOL)):
+            records.append(('HETATM', name, element, 'EOH', hetero_chain, number, position))
+    for number in range(hetatms + 1, hetatms + waters + 1):
+        for (name, element, _), position in zip(WATER, place_molecule(WATER)):
+            records.append(('HETATM', name, element, 'HOH', hetero_chain, number, position))
+    return records
+
+
+WATER = [('O', 'O', [0.0, 0.0, 0.0]), ('H1', 'H', [0.957, 0.0, 0.0]), ('H2', 'H', [-0.240, 0.927, 0.0])]
+ETHANOL = [('C1', 'C', [0.0, 0.0, 0.0]), ('C2', 'C', [1.520, 0.0, 0.0]), ('O', 'O', [2.020, 1.340, 0.0]),
+           ('H11', 'H', [-0.360, -1.030, 0.0]), ('H12', 'H', [-0.360, 0.510, 0.890]),
+           ('H13', 'H', [-0.360, 0.510, -0.890]), ('H21', 'H', [1.880, -0.510, 0.890]),
+           ('H22', 'H', [1.880, -0.510, -0.890]), ('HO', 'H', [2.980, 1.320, 0.0])]
+
+
+def format_atom_name(name, element):
+    return f' {name:<3s}' if len(name) < 4 and len(element) == 1 else f'{name:<4s}'
+
+
+def write_pdb(path, records):
+    with open(path, mode='w') as file:
+        previous_chain = None
+        for serial, (group, name, element, residue, chain, number, (x, y, z)) in enumerate(records, start=1):
+            if previous_chain is not None and chain != previous_chain:
+                file.write('TER\n')
+            previous_chain = chain
+            file.write(f'{group:<6s}{serial % 100000:5d} {format_atom_name(name, element)} {residue:>3s} '
+                       f'{chain}{number % 10000:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00          {element:>2s}\n')
+        file.write('END\n')
+
+
+def write_cif(path, records, name='SYNTHETIC'):
+    with open(path, mode='w') as file:
+        file.write(f'data_{name}\n#\n_entry.id {name}\n#\nloop_\n')
+        for item in ('group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id', 'label_comp_id',
+                     'label_asym_id', 'label_entity_id', 'label_seq_id', 'pdbx_PDB_ins_code', 'Cartn_x',
+                     'Cartn_y', 'Cartn_z', 'occupancy', 'B_iso_or_equiv', 'auth_seq_id', 'auth_asym_id',
+                     'pdbx_PDB_model_num'):
+            file.write(f'_atom_site.{item}\n')
+        entities = {}
+        for serial, (group, atom, element, residue, chain, number, (x, y, z)) in enumerate(records, start=1):
+            entity = entities.setdefault(residue, len(entities) + 1)
+            sequence = number if group == 'ATOM' else '.'
+            file.write(f'{group} {serial} {element} {atom} . {residue} {chain} {entity} {sequence} ? '
+                       f'{x:.3f} {y:.3f} {z:.3f} 1.00 0.00 {number} {chain} 1\n')
+        file.write('#\n')
+
+
+def build_molecule(carbons, rng):
+    """Returns atoms (element, coordinates) and bonds (first, second, order) of linear alkanol,
+    randomly rotated and translated"""
+    atoms = []
+    bonds = []
+    for i in range(carbons):
+        atoms.append(('C', [i * 1.26, 0.0 if i % 2 == 0 else 0.89, 0.0]))
+        if i:
+            bonds.append((i - 1, i, 1))
+    for i in range(carbons):
+        x, y, _ = atoms[i][1]
+        side = -1.0 if i % 2 == 0 else 1.0
+        hydrogens = [[x, y + side * 0.63, 0.89], [x, y + side * 0.63, -0.89]]
+        if i == 0:
+            hydrogens.append([x - 1.03, y - 0.36, 0.0])
+        for position in hydrogens:
+            atoms.append(('H', position))
+            bonds.append((i, len(atoms) - 1, 1))
+    # hydroxyl group on the last carbon
+    x, y, _ = atoms[carbons - 1][1]
+    atoms.append(('O', [x + 1.21, y + (0.7 if carbons % 2 else -0.7), 0.0]))
+    bonds.append((carbons - 1, len(atoms) - 1, 1))
+    atoms.append(('H', [atoms[-1][1][0] + 0.96, atoms[-1][1][1], 0.0]))
+    bonds.append((len(atoms) - 2, len(atoms) - 1, 1))
+
+    # random rotation around z and x axes and translation
+    alpha, beta = rng.uniform(0, 2 * math.pi), rng.uniform(0, 2 * math.pi)
+    shift = [rng.uniform(-50, 50) for _ in range(3)]
+    result = []
+    for element, (x, y, z) in atoms:
+        x, y = x * math.cos(alpha) - y * math.sin(alpha), x * math.sin(alpha) + y * math.cos(alpha)
+        y, z = y * math.cos(beta) - z * math.sin(beta), y * math.sin(beta) + z * math.cos(beta)
+        result.append((element, [x + shift[0], y + shift[1], z + shift[2]]))
+    return result, bonds
+
+
+def build_molecules(count, carbons=2, seed=0):
+    """Returns count molecules (name, atoms, bonds), number of carbons varies from 1 to carbons"""
+    rng = random.Random(seed)
+    return [(f'MOL{i:06d}', *build_molecule(rng.randint(1, carbons), rng)) for i in range(1, count + 1)]
+
+
+def write_sdf(path, molecules):
+    with open(path, mode='w') as file:
+        for name, atoms, bonds in molecules:
+            file.write(f'{name}\n  synthetic\n\n{len(atoms):3d}{len(bonds):3d}  0  0  0  0  0  0  0  0999 V2000\n')
+            for element, (x, y, z) in atoms:
+                file.write(f'{x:10.4f}{y:10.4f}{z:10.4f} {element:<3s} 0  0  0  0  0  0  0  0  0  0  0  0\n')
+            for first, second, order in bonds:
+                file.write(f'{first + 1:3d}{second + 1:3d}{order:3d}  0\n')
+            file.write('M  END\n$$$$\n')
+
+
+MOL2_TYPES = {'C': 'C.3', 'O': 'O.3', 'H': 'H'}
+
+
+def write_mol2(path, molecules):
+    with open(path, mode='w') as file:
+        for name, atoms, bonds in molecules:
+            file.write(f'@<TRIPOS>MOLECULE\n{name}\n{len(atoms)} {len(bonds)} 0 0 0\nSMALL\nNO_CHARGES\n\n'
+                       f'@<TRIPOS>ATOM\n')
+            for serial, (element, (x, y, z)) in enumerate(atoms, start=1):
+                file.write(f'{serial:7d} {element}{serial:<7d} {x:10.4f} {y:10.4f} {z:10.4f} '
+                           f'{MOL2_TYPES[element]:<5s} 1 UNL 0.0000\n')
+            file.write('@<TRIPOS>BOND\n')
+            for serial, (first, second, order) in enumerate(bonds, start=1):
+                file.write(f'{serial:6d} {first + 1:5d} {second + 1:5d} {order}\n')
+
+
+def generate(output, residues=0, molecules=0, waters=0, hetatms=0, carbons=2, seed=0):
+    """Generates protein (pdb, cif) and/or set of small molecules (sdf, mol2) into output directory,
+    returns paths to generated files"""
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    files = []
+    if residues:
+        records = build_protein(residues, waters, hetatms, seed)
+        stem = f'protein_{residues}'
+        write_pdb(output / f'{stem}.pdb', records)
+        write_cif(output / f'{stem}.cif', records, stem.upper())
+        files += [output / f'{stem}.pdb', output / f'{stem}.cif']
+    if molecules:
+        molecule_set = build_molecules(molecules, carbons, seed)
+        stem = f'molecules_{molecules}'
+        write_sdf(output / f'{stem}.sdf', molecule_set)
+        write_mol2(output / f'{stem}.mol2', molecule_set)
+        files += [output / f'{stem}.sdf', output / f'{stem}.mol2']
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic structures of parametrised size')
+    parser.add_argument('--output', help='Output directory', default='synthetic_structures')
+    parser.add_argument('--residues', type=int, default=0, help='Number of residues of protein (.pdb, .cif)')
+    parser.add_argument('--waters', type=int, default=0, help='Number of water molecules added to protein')
+    parser.add_argument('--hetatms', type=int, default=0, help='Number of ethanol ligands added to protein')
+    parser.add_argument('--molecules', type=int, default=0, help='Number of small molecules (.sdf, .mol2)')
+    parser.add_argument('--carbons', type=int, default=2, help='Maximal number of carbons of small molecules')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of random placement')
+    args = parser.parse_args()
+
+    for path in generate(args.output, args.residues, args.molecules, args.waters, args.hetatms, args.carbons,
+                         args.seed):
+        print(path)
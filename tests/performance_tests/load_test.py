@@ -0,0 +1,190 @@
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_MIX = 'upload=1,get_info=3,suitable_methods=2,calculate_charges=3,add_hydrogens=1'
+
+
+def parse_mix(mix):
+    """Parses request mix 'name=weight,name=weight'"""
+    result = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        if name not in REQUESTS:
+            raise ValueError(f'Unknown request {name}, use one of {", ".join(REQUESTS)}')
+        result[name] = float(weight)
+    return result
+
+
+def upload(session, url, file, structure_id, method, parameters):
+    with open(file) as fd:
+        return session.post(f'{url}/send_files', files={'file[]': fd})
+
+
+def get_info(session, url, file, structure_id, method, parameters):
+    return session.get(f'{url}/get_info', params={'structure_id': structure_id})
+
+
+def suitable_methods(session, url, file, structure_id, method, parameters):
+    return session.get(f'{url}/suitable_methods', params={'structure_id': structure_id})
+
+
+def calculate_charges(session, url, file, structure_id, method, parameters):
+    return session.get(f'{url}/calculate_charges', params={'structure_id': structure_id,
+                                                            'method': method,
+                                                            'parameters': parameters})
+
+
+def add_hydrogens(session, url, file, structure_id, method, parameters):
+    return session.post(f'{url}/add_hydrogens', params={'structure_id': structure_id})
+
+
+REQUESTS = {'upload': upload,
+            'get_info': get_info,
+            'suitable_methods': suitable_methods,
+            'calculate_charges': calculate_charges,
+            'add_hydrogens': add_hydrogens}
+
+
+def is_error(response):
+    """Returns whether response is error (HTTP status or status_code in json body)"""
+    if response.status_code != 200:
+        return True
+    try:
+        return response.json().get('status_code', 200) != 200
+    except ValueError:
+        return False
+
+
+def percentile(values, p):
+    """Returns percentile of sorted values (nearest rank)"""
+    return values[max(1, math.ceil(p / 100 * len(values))) - 1]
+
+
+def summarize(latencies, errors, duration):
+    """Returns throughput, error rate and latency percentiles (in ms)"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    if not count:
+        return {'requests': 0, 'errors': errors}
+    return {'requests': count,
+            'errors': errors,
+            'error_rate': round(errors / count, 4),
+            'throughput': round(count / duration, 2),
+            'mean': round(sum(latencies) / count * 1000, 2),
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2)}
+
+
+def start_server(port):
+    """Starts local instance of API (working directory has to contain utils/api.ini)"""
+    server = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'api_acc2', 'run', '--port', str(port),
+                               '--with-threads'],
+                              cwd=ROOT, env=dict(os.environ, PYTHONPATH=str(ROOT / 'src')),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{url}/available_methods', timeout=1)
+            return server, url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('Local instance of API did not start.')
+
+
+def run(url, file, method, parameters, mix, concurrency, count, duration, seed):
+    """Sends requests of the mix from concurrent clients, returns summary per request type and overall"""
+    structure_id = requests.post(f'{url}/send_files',
+                                 files={'file[]': open(file)}).json()['structure_ids'][Path(file).stem]
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    local = threading.local()
+    deadline = time.perf_counter() + duration if duration else None
+
+    def send(name):
+        if deadline and time.perf_counter() > deadline:
+            return
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            failed = is_error(REQUESTS[name](local.session, url, file, structure_id, method, parameters))
+        except requests.exceptions.RequestException:
+            failed = True
+        latency = time.perf_counter() - start
+        with lock:
+            latencies[name].append(latency)
+            errors[name] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # without count requests are sent until duration expires
+        total = count if count else sys.maxsize
+        sent = 0
+        while sent < total and (not deadline or time.perf_counter() < deadline):
+            batch = min(concurrency * 10, total - sent)
+            list(executor.map(send, rng.choices(names, weights, k=batch)))
+            sent += batch
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {'concurrency': concurrency,
+            'duration': round(elapsed, 2),
+            'overall': summarize(all_latencies, sum(errors.values()), elapsed),
+            'requests': {name: summarize(latencies[name], errors[name], elapsed) for name in names}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive API with concurrent clients and report latency percentiles')
+    parser.add_argument('--url', help='URL of API (e.g. http://localhost), local instance is started if not set')
+    parser.add_argument('--port', type=int, default=5055, help='Port of local instance of API')
+    parser.add_argument('--file', help='Path to file containing your structure',
+                        default=str(ROOT / 'tests/unit_tests/dependencies/1ner.pdb'))
+    parser.add_argument('--method', help='Computational method', default='eem')
+    parser.add_argument('--parameters', help='Parameters for method', default='EEM_00_NEEMP_ccd2016_npa')
+    parser.add_argument('--mix', help=f'Weights of requests (default: {DEFAULT_MIX})', default=DEFAULT_MIX)
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=1000, help='Number of requests (0 - until duration expires)')
+    parser.add_argument('--duration', type=float, default=0, help='Maximal duration of test in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of random choice of requests')
+    parser.add_argument('--output', help='Path to output json file (default: standard output)')
+    args = parser.parse_args()
+    if args.requests <= 0 and args.duration <= 0:
+        parser.error('either --requests or --duration has to be positive')
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_server(args.port)
+    try:
+        results = run(url, args.file, args.method, args.parameters, parse_mix(args.mix),
+                      args.concurrency, args.requests, args.duration, args.seed)
+    finally:
+        if server:
+            server.terminate()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, mode='w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
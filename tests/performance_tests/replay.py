@@ -0,0 +1,276 @@
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+import generate_structures
+from load_test import ROOT, is_error, start_server, summarize
+
+sys.path.insert(0, str(ROOT / 'src'))
+from Statistics import parse_record  # noqa: E402
+
+# endpoints replayed without structure (method and parameters are taken from record)
+STATELESS = {'/available_methods', '/available_parameters', '/get_limits', '/stats'}
+# endpoints downloading structures from external databases, replayed only on request
+EXTERNAL = {'/pdb_id', '/pubchem_cid'}
+POST = {'/pdb_id', '/pubchem_cid', '/remove_file', '/add_hydrogens', '/ph_sweep'}
+# approximate number of atoms of one residue of generated polyalanine
+ATOMS_PER_RESIDUE = 10
+
+
+def parse_timestamp(timestamp):
+    return datetime.fromisoformat(timestamp.replace(',', '.'))
+
+
+def read_records(files, start=None, end=None):
+    """Returns time-ordered records of statistics logs within window [start, end),
+    parsed timestamp is stored under datetime key (time key is calculation time)"""
+    records = []
+    for path in files:
+        with open(path, errors='replace') as file:
+            for line in file:
+                record = parse_record(line)
+                if record is None or record.get('level', 'INFO') != 'INFO' or 'endpoint_name' not in record:
+                    continue
+                record['datetime'] = parse_timestamp(record['timestamp'])
+                if (start and record['datetime'] < start) or (end and record['datetime'] >= end):
+                    continue
+                records.append(record)
+    return sorted(records, key=lambda record: record['datetime'])
+
+
+def get_structure_sizes(records):
+    """Returns size (suffix, number of atoms, number of molecules) of every structure referenced in records"""
+    sizes = {}
+    for record in records:
+        structure_id = record.get('structure_id')
+        if not structure_id or not isinstance(record.get('number_of_atoms'), int):
+            continue
+        size = sizes.setdefault(structure_id, {'suffix': None, 'atoms': 0, 'molecules': 1})
+        size['atoms'] = max(size['atoms'], record['number_of_atoms'])
+        size['molecules'] = max(size['molecules'], record.get('number_of_molecules') or 1)
+        if record.get('suffix'):
+            size['suffix'] = record['suffix'].lower()
+    return sizes
+
+
+def round_size(value):
+    """Rounds value to two significant digits, so that similar structures share generated file"""
+    digits = max(len(str(value)) - 2, 0)
+    return max(round(value, -digits), 1)
+
+
+class StructureCache:
+    """Generated structures of matching size (files are reused between structures and runs)"""
+
+    def __init__(self, directory):
+        self._directory = Path(directory)
+        self._lock = threading.Lock()
+
+    def get(self, suffix, atoms, molecules):
+        """Returns path to generated structure with approximately the same number of atoms and molecules"""
+        with self._lock:
+            if suffix in ('.sdf', '.mol2'):
+                count = round_size(molecules)
+                # linear alkanols with 1..carbons carbons have on average 1.5 * (carbons + 1) + 3 atoms
+                carbons = max(1, round((atoms / molecules - 3) / 1.5 - 1))
+                directory = self._directory / f'carbons_{carbons}'
+                path = directory / f'molecules_{count}{suffix}'
+                if not path.exists():
+                    generate_structures.generate(directory, molecules=count, carbons=carbons)
+            else:
+                suffix = '.cif' if suffix in ('.cif', '.mmcif') else '.pdb'
+                residues = round_size(max(atoms // ATOMS_PER_RESIDUE, 1))
+                path = self._directory / f'protein_{residues}{suffix}'
+                if not path.exists():
+                    generate_structures.generate(self._directory, residues=residues)
+            return path
+
+
+def build_workload(records, cache, default_atoms=1000, fetch_external=False):
+    """Turns records into time-ordered list of actions with offsets from the first record (in seconds),
+    upload of every structure is assigned to preceding send_files record of the same client"""
+    if not records:
+        return []
+    sizes = get_structure_sizes(records)
+    first = records[0]['datetime']
+    workload = []
+    uploads = set()
+    # send_files records of every client, which were not yet assigned to any structure
+    pending_uploads = defaultdict(list)
+    for record in records:
+        endpoint = record['endpoint_name']
+        offset = (record['datetime'] - first).total_seconds()
+        if endpoint == '/send_files':
+            pending_uploads[record.get('remote_addr')].append([offset, record.get('number_of_sent_files', 1)])
+            continue
+        if endpoint in EXTERNAL and not fetch_external:
+            continue
+        if endpoint in EXTERNAL or endpoint in STATELESS:
+            workload.append({'offset': offset, 'endpoint': endpoint, 'record': record})
+            continue
+        structure_id = record.get('structure_id')
+        if not structure_id:
+            continue
+        if structure_id not in uploads:
+            uploads.add(structure_id)
+            size = sizes.get(structure_id, {'suffix': None, 'atoms': default_atoms, 'molecules': 1})
+            upload_offset = offset
+            client_uploads = pending_uploads[record.get('remote_addr')]
+            if client_uploads:
+                upload_offset = client_uploads[-1][0]
+                client_uploads[-1][1] -= 1
+                if client_uploads[-1][1] <= 0:
+                    client_uploads.pop()
+            workload.append({'offset': upload_offset, 'endpoint': '/send_files', 'structure_id': structure_id,
+                             'file': str(cache.get(size['suffix'], size['atoms'], size['molecules']))})
+        workload.append({'offset': offset, 'endpoint': endpoint, 'structure_id': structure_id, 'record': record})
+    return sorted(workload, key=lambda action: action['offset'])
+
+
+def send(session, url, action, structure_id):
+    """Sends request of action, structure ID is ID of uploaded substitute structure"""
+    endpoint = action['endpoint']
+    record = action.get('record', {})
+    if endpoint == '/send_files':
+        with open(action['file']) as file:
+            return session.post(f'{url}/send_files', files={'file[]': file})
+    params = {'structure_id': structure_id} if structure_id else {}
+    if endpoint == '/calculate_charges':
+        for key in ('method', 'parameters', 'dry_run'):
+            if record.get(key):
+                params[key] = record[key]
+    elif endpoint == '/add_hydrogens' and record.get('pH'):
+        params['pH'] = record['pH']
+    elif endpoint == '/ph_sweep':
+        params['pH[]'] = record.get('pH_values') or [7.0]
+    elif endpoint == '/pdb_id':
+        params['pid[]'] = record.get('pdb_ids', [])
+    elif endpoint == '/pubchem_cid':
+        params['cid[]'] = record.get('cids', [])
+    elif endpoint == '/available_parameters':
+        params['method'] = record.get('method')
+    if endpoint in POST:
+        return session.post(f'{url}{endpoint}', params=params)
+    return session.get(f'{url}{endpoint}', params=params)
+
+
+def replay(url, workload, speed=1.0, concurrency=64):
+    """Sends actions of workload at their (accelerated) offsets, returns summary per endpoint and overall"""
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    delays = []
+    # structure ID from log: future with ID of uploaded substitute structure
+    uploads = {action['structure_id']: Future() for action in workload if action['endpoint'] == '/send_files'}
+    local = threading.local()
+
+    def run(action, scheduled):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        failed = True
+        try:
+            if action['endpoint'] == '/send_files':
+                response = send(local.session, url, action, None)
+                uploads[action['structure_id']].set_result(
+                    response.json()['structure_ids'][Path(action['file']).stem])
+            else:
+                # requests of structure wait until its upload is finished
+                structure_id = uploads[action['structure_id']].result() if action.get('structure_id') else None
+                response = send(local.session, url, action, structure_id)
+            failed = is_error(response)
+        except Exception as e:
+            # failed upload has to fail requests waiting for the structure
+            if action['endpoint'] == '/send_files':
+                uploads[action['structure_id']].set_exception(e)
+        latency = time.perf_counter() - start
+        with lock:
+            latencies[action['endpoint']].append(latency)
+            errors[action['endpoint']] += failed
+            delays.append(start - scheduled)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for action in workload:
+            scheduled = start + action['offset'] / speed
+            time.sleep(max(scheduled - time.perf_counter(), 0))
+            executor.submit(run, action, scheduled)
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    delays.sort()
+    return {'speed': speed,
+            'actions': len(workload),
+            'duration': round(elapsed, 2),
+            'recorded_duration': round(workload[-1]['offset'], 2) if workload else 0,
+            'schedule_delay': {'p50': round(delays[len(delays) // 2] * 1000, 2),
+                               'max': round(delays[-1] * 1000, 2)} if delays else {},
+            'overall': summarize(all_latencies, sum(errors.values()), elapsed),
+            'endpoints': {endpoint: summarize(values, errors[endpoint], elapsed)
+                          for endpoint, values in sorted(latencies.items())}}
+
+
+def write_workload(workload, path):
+    """Writes workload to json lines file (records without parsed time)"""
+    with open(path, mode='w') as file:
+        for action in workload:
+            action = dict(action)
+            if 'record' in action:
+                action['record'] = {key: value for key, value in action['record'].items() if key != 'datetime'}
+            file.write(json.dumps(action) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay workload from statistics logs against API')
+    parser.add_argument('files', nargs='+', help='Statistics log files (json lines or legacy text records)')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='Start of replayed window (ISO format)')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='End of replayed window (ISO format)')
+    parser.add_argument('--speed', type=float, default=1.0, help='Speed of replay (e.g. 10 - ten times faster)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximal number of concurrent requests')
+    parser.add_argument('--url', help='URL of API (e.g. http://localhost), local instance is started if not set')
+    parser.add_argument('--port', type=int, default=5055, help='Port of local instance of API')
+    parser.add_argument('--structures', help='Directory with cached generated structures '
+                                             '(default: temporary directory)')
+    parser.add_argument('--fetch_external', action='store_true',
+                        help='Replay also downloads from PDB and PubChem')
+    parser.add_argument('--workload', help='Only write workload to json lines file, nothing is replayed '
+                                           '(requires --structures, workload refers to generated structures)')
+    parser.add_argument('--output', help='Path to output json file (default: standard output)')
+    args = parser.parse_args()
+    if args.workload and not args.structures:
+        # structures in temporary directory would be removed when the workload is written
+        parser.error('--workload requires --structures')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = StructureCache(args.structures or tmpdir)
+        actions = build_workload(read_records(args.files, args.start, args.end), cache,
+                                 fetch_external=args.fetch_external)
+        if args.workload:
+            write_workload(actions, args.workload)
+            sys.exit(0)
+
+        server = None
+        api_url = args.url
+        if not api_url:
+            server, api_url = start_server(args.port)
+        try:
+            results = replay(api_url, actions, args.speed, args.concurrency)
+        finally:
+            if server:
+                server.terminate()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, mode='w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
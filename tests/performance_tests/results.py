@@ -0,0 +1,100 @@
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def get_git_revision():
+    """Returns git revision of the repository (None outside of git checkout)"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+
+def get_chargefw2_version():
+    try:
+        import chargefw2_python
+    except ImportError:
+        return None
+    return getattr(chargefw2_python, '__version__', None)
+
+
+def get_host_info():
+    """Returns description of machine running benchmark"""
+    return {'hostname': socket.gethostname(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'chargefw2_python': get_chargefw2_version()}
+
+
+def get_input_size(path):
+    """Returns size of input file or summed size of files in input folder (in bytes)"""
+    path = Path(path)
+    if path.is_dir():
+        return sum(file.stat().st_size for file in path.iterdir() if file.is_file())
+    return path.stat().st_size
+
+
+class BenchmarkRun:
+    """Collects records of one benchmark run, all records share run ID, git revision and host info"""
+
+    def __init__(self, name=None):
+        self.run_id = name or f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self.timestamp = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        self.git_revision = get_git_revision()
+        self.host = get_host_info()
+        self.records = []
+
+    def add(self, suite, layer, method, parameters, input_path, times):
+        """Adds record of repeated measurement (times in seconds)"""
+        record = {'run_id': self.run_id,
+                  'timestamp': self.timestamp,
+                  'git_revision': self.git_revision,
+                  'host': self.host,
+                  'suite': suite,
+                  'layer': layer,
+                  'method': method,
+                  'parameters': parameters,
+                  'input': Path(input_path).name,
+                  'input_size': get_input_size(input_path),
+                  'count': len(times),
+                  'mean': statistics.mean(times),
+                  'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+                  'min': min(times),
+                  'max': max(times),
+                  'times': list(times)}
+        self.records.append(record)
+        return record
+
+    def save(self, path):
+        """Appends records to json lines file"""
+        with open(path, mode='a') as file:
+            for record in self.records:
+                file.write(json.dumps(record) + '\n')
+
+
+def load_records(path, run_id=None):
+    """Loads records of one run from json lines file (the last run if run ID is not set)"""
+    with open(path) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    if not records:
+        raise ValueError(f'File {path} does not contain any benchmark records.')
+    if run_id is None:
+        run_id = records[-1]['run_id']
+    records = [record for record in records if record['run_id'] == run_id]
+    if not records:
+        raise ValueError(f'File {path} does not contain run {run_id}.')
+    return records
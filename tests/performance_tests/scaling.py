@@ -0,0 +1,204 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+
+import generate_structures
+
+DEFAULT_RESIDUES = '50,100,200,500,1000,2000'
+DEFAULT_MOLECULES = '10,100,1000,10000'
+
+
+def parse_sizes(sizes):
+    """Parses comma separated sizes"""
+    return [int(size) for size in sizes.split(',') if size]
+
+
+def get_default_parameters(molecules, method):
+    """Returns the first suitable parameters of method (None if method has no parameters or is not suitable)"""
+    import chargefw2_python
+    for suitable_method, parameters in chargefw2_python.get_suitable_methods(molecules):
+        if suitable_method == method:
+            return pathlib.Path(parameters[0]).stem if parameters else None
+    raise ValueError(f'Method {method} is not suitable for the structure.')
+
+
+def calculate(file, method, parameters, results):
+    """Loads structure and calculates charges, sends timings and peak memory (in MB) through results queue"""
+    import chargefw2_python
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        start = time.perf_counter()
+        molecules = chargefw2_python.Molecules(str(file))
+        loaded = time.perf_counter()
+        if parameters is None:
+            parameters = get_default_parameters(molecules, method)
+        calculation_start = time.perf_counter()
+        chargefw2_python.calculate_charges(molecules, method, parameters)
+        end = time.perf_counter()
+    except Exception as e:
+        results.put({'error': str(e)})
+        return
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({'parameters': parameters,
+                 'loading': round(loaded - start, 4),
+                 'calculation': round(end - calculation_start, 4),
+                 'peak_memory': round(peak / 1024, 2),
+                 'memory': round((peak - baseline) / 1024, 2)})
+
+
+def measure_pybind(file, method, parameters):
+    """Measures calculation via chargefw2_python in fresh process, so that peak memory belongs to one calculation"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=calculate, args=(file, method, parameters, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def measure_api(file, url, method, parameters):
+    """Measures upload and calculation via API (memory of server is not available)"""
+    import requests
+    start = time.perf_counter()
+    response = requests.post(f'{url}/send_files', files={'file[]': open(file)}).json()
+    if response['status_code'] != 200:
+        return {'error': response['message']}
+    structure_id = response['structure_ids'][pathlib.Path(file).stem]
+    calculation_start = time.perf_counter()
+    params = {'structure_id': structure_id, 'method': method}
+    if parameters:
+        params['parameters'] = parameters
+    response = requests.get(f'{url}/calculate_charges', params=params).json()
+    end = time.perf_counter()
+    if response['status_code'] != 200:
+        return {'error': response['message']}
+    return {'parameters': response['parameters'],
+            'upload': round(calculation_start - start, 4),
+            'calculation': round(end - calculation_start, 4)}
+
+
+def count_atoms(file):
+    """Returns number of atoms of generated file"""
+    count = 0
+    with open(file) as fd:
+        if file.suffix in ('.pdb', '.cif'):
+            return sum(line.startswith(('ATOM', 'HETATM')) for line in fd)
+        lines = iter(fd)
+        if file.suffix == '.sdf':
+            # counts line is the fourth line of every molecule
+            for header in lines:
+                next(lines), next(lines)
+                count += int(next(lines)[:3])
+                for line in lines:
+                    if line.startswith('$$$$'):
+                        break
+        else:
+            for line in lines:
+                if line.startswith('@<TRIPOS>MOLECULE'):
+                    next(lines)
+                    count += int(next(lines).split()[0])
+    return count
+
+
+def sweep(output, methods, residues, molecules, waters, hetatms, count, url=None, parameters=None):
+    """Generates structures of every size and measures every method on them, returns list of records"""
+    records = []
+    files = []
+    for size in residues:
+        files += [(file, 'residues', size) for file in
+                  generate_structures.generate(output, residues=size, waters=waters, hetatms=hetatms)]
+    for size in molecules:
+        files += [(file, 'molecules', size) for file in generate_structures.generate(output, molecules=size)]
+
+    for file, size_type, size in files:
+        atoms = count_atoms(file)
+        for method in methods:
+            for repetition in range(count):
+                if url:
+                    result = measure_api(file, url, method, parameters)
+                else:
+                    result = measure_pybind(file, method, parameters)
+                records.append({'file': file.name, 'format': file.suffix[1:], 'size_type': size_type, 'size': size,
+                                'atoms': atoms, 'method': method, 'repetition': repetition, **result})
+                print(f'{file.name} ({atoms} atoms), {method}: {result}', file=sys.stderr)
+    return records
+
+
+def plot(records, path):
+    """Plots latency and memory against number of atoms for every method (requires matplotlib)"""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed, plot is skipped', file=sys.stderr)
+        return
+    metrics = [metric for metric in ('calculation', 'memory') if any(metric in record for record in records)]
+    figure, axes = plt.subplots(1, len(metrics), figsize=(6 * len(metrics), 5), squeeze=False)
+    for axis, metric in zip(axes[0], metrics):
+        series = {}
+        for record in records:
+            if metric in record:
+                key = (record['method'], record['format'])
+                series.setdefault(key, []).append((record['atoms'], record[metric]))
+        for (method, file_format), points in sorted(series.items()):
+            points.sort()
+            axis.plot([atoms for atoms, _ in points], [value for _, value in points], marker='o',
+                      label=f'{method} ({file_format})')
+        axis.set_xscale('log')
+        axis.set_yscale('log')
+        axis.set_xlabel('Number of atoms')
+        axis.set_ylabel('Calculation time (s)' if metric == 'calculation' else 'Memory (MB)')
+        axis.legend(fontsize='small')
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def write_csv(records, path):
+    fields = []
+    for record in records:
+        fields += [field for field in record if field not in fields]
+    with open(path, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure latency and memory of methods against size of structure')
+    parser.add_argument('--methods', help='Comma separated computational methods', default='eem')
+    parser.add_argument('--parameters', help='Parameters for methods (default: first suitable parameters)')
+    parser.add_argument('--residues', help=f'Sizes of proteins (default: {DEFAULT_RESIDUES})',
+                        default=DEFAULT_RESIDUES)
+    parser.add_argument('--molecules', help=f'Sizes of sets of molecules (default: {DEFAULT_MOLECULES})',
+                        default=DEFAULT_MOLECULES)
+    parser.add_argument('--waters', type=int, default=0, help='Number of water molecules added to proteins')
+    parser.add_argument('--hetatms', type=int, default=0, help='Number of ethanol ligands added to proteins')
+    parser.add_argument('--count', type=int, default=3, help='How many times is every measurement repeated')
+    parser.add_argument('--url', help='URL of API (e.g. http://localhost), chargefw2_python is used if not set')
+    parser.add_argument('--structures', help='Directory for generated structures (default: temporary directory)')
+    parser.add_argument('--output', help='Path to output json or csv file (default: standard output)')
+    parser.add_argument('--plot', help='Path to output image with plots (requires matplotlib)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = sweep(args.structures or tmpdir, args.methods.split(','), parse_sizes(args.residues),
+                        parse_sizes(args.molecules), args.waters, args.hetatms, args.count, args.url, args.parameters)
+
+    if args.plot:
+        plot(results, args.plot)
+    if args.output and args.output.endswith('.csv'):
+        write_csv(results, args.output)
+    elif args.output:
+        with open(args.output, mode='w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -3,6 +3,7 @@ import argparse
 import time
 import test_one_file
 import test_sequentially
+from results import BenchmarkRun
 
 def get_calc_time(count, func, *args):
     calc_time = 0
@@ -42,13 +43,29 @@ def results_summary_sequentially(api, pybind, chargefw2, api_times, pybind_times
            f'Calculation via chargefw2: {chargefw2} - {chargefw2_times}\n\n'
 
 
-def main(count, output_file, file, folder, ip, method, parameters, parameters_file, chg_out_dir):
+def save_results(results_file, all_in_one_times, sequentially_times, file, folder, method, parameters):
+    """Appends structured records of the run (one per suite and layer) to json lines file"""
+    run = BenchmarkRun()
+    for suite, path, times in (('all_in_one', file, all_in_one_times), ('sequentially', folder, sequentially_times)):
+        for layer, layer_times in zip(('api', 'pybind', 'chargefw2'), times):
+            run.add(suite, layer, method, parameters, path, layer_times)
+    run.save(results_file)
+
+
+def main(count, output_file, file, folder, ip, method, parameters, parameters_file, chg_out_dir, results_file=None):
     # All molecules in one file
     api1, pybind1, chargefw21, api1_times, pybind1_times, chargefw21_times = all_in_one(count, file, ip, method, parameters, parameters_file, chg_out_dir)
 
     # Molecules sequentially
     api2, pybind2, chargefw22, api2_times, pybind2_times, chargefw22_times = sequentially(count, folder, ip, method, parameters, parameters_file, chg_out_dir)
 
+    if results_file:
+        save_results(results_file, (api1_times, pybind1_times, chargefw21_times),
+                     (api2_times, pybind2_times, chargefw22_times), file, folder, method, parameters)
+
+    if not output_file:
+        return
+
     with open(output_file, mode='a') as output:
         output.write(f'Count: {count}\n')
         output.write(f'{date.today().strftime("%d/%m/%Y")}, {time.strftime("%H:%M:%S", time.localtime())}\n')
@@ -62,7 +79,7 @@ def main(count, output_file, file, folder, ip, method, parameters, parameters_fi
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--count', help='How many times does the test repeats?')
+    parser.add_argument('--count', type=int, help='How many times does the test repeats?')
     parser.add_argument('--output_file', help='Path to output file containing results')
     parser.add_argument('--ip', help='IP adress of server')
     parser.add_argument('--method', help='Computational method')
@@ -71,14 +88,16 @@ if __name__ == '__main__':
     parser.add_argument('--folder', help='Path to folder with files')
     parser.add_argument('--parameters_file', help='Path to parameters for method')
     parser.add_argument('--chg_out_dir', help='Output directory for result from chargefw2')
+    parser.add_argument('--results_file', help='Path to json lines file with structured results (see compare.py)')
 
     args = parser.parse_args()
 
     try:
         main(args.count, args.output_file, args.file, args.folder, args.ip, args.method, args.parameters,
-             args.parameters_file, args.chg_out_dir)
+             args.parameters_file, args.chg_out_dir, args.results_file)
     except ValueError as e:
-        with open(args.output_file, mode='a') as output:
-            output.write(f'{date.today().strftime("%d/%m/%Y")}, {time.strftime("%H:%M:%S", time.localtime())}\n')
-            output.write(e)
-        raise ValueError(e)
\ No newline at end of file
+        if args.output_file:
+            with open(args.output_file, mode='a') as output:
+                output.write(f'{date.today().strftime("%d/%m/%Y")}, {time.strftime("%H:%M:%S", time.localtime())}\n')
+                output.write(f'{e}\n')
+        raise
\ No newline at end of file
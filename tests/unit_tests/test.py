@@ -1,6 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+
 import requests
 import pytest
 
+STATS_POLLS = 20
+STATS_POLL_INTERVAL = 0.5
+COALESCING_ROUNDS = 10
+
 
 def available_methods(url):
     return requests.get(f'http://{url}/available_methods')
@@ -11,6 +19,14 @@ def test_available_methods(url):
     assert 'eem' in response['available_methods']
 
 
+def test_available_methods_caching(url):
+    response = available_methods(url)
+    assert 'max-age' in response.headers['Cache-Control']
+    not_modified = requests.get(f'http://{url}/available_methods',
+                                headers={'If-None-Match': response.headers['ETag']})
+    assert not_modified.status_code == 304
+
+
 def available_parameters(method, url):
     return requests.get(f'http://{url}/available_parameters',
                         params={'method': method})
@@ -73,6 +89,97 @@ def test_calculate_charges(structure_id, method, parameters, expected, url, vali
     assert expected in response['message']
 
 
+def test_calculate_charges_server_timing(url, valid_id):
+    server_timing = calculate_charges(valid_id, 'eem', 'EEM_00_NEEMP_ccd2016_npa', url).headers['Server-Timing']
+    assert 'calculation;dur=' in server_timing
+    assert 'total;dur=' in server_timing
+
+
+def test_calculate_charges_dry_run(url, valid_id):
+    response = requests.get(f'http://{url}/calculate_charges',
+                            params={'structure_id': valid_id,
+                                    'method': 'eem',
+                                    'parameters': 'EEM_00_NEEMP_ccd2016_npa',
+                                    'dry_run': True}).json()
+    assert 'OK' in response['message']
+    assert 'charges' not in response
+    assert response['number_of_atoms'] > 0
+    assert 'estimated_calc_time' in response
+
+
+@pytest.mark.parametrize('method_selection, time_budget, expected', [
+    ('default', None, 'OK'),
+    ('fastest', None, 'OK'),
+    ('budget', 1000, 'OK'),
+    ('budget', None, 'Time budget has to be specified'),
+])
+def test_calculate_charges_method_selection(method_selection, time_budget, expected, url, valid_id):
+    response = requests.get(f'http://{url}/calculate_charges',
+                            params={'structure_id': valid_id,
+                                    'method_selection': method_selection,
+                                    'time_budget': time_budget,
+                                    'dry_run': True}).json()
+    assert expected in response['message']
+    if expected == 'OK':
+        assert response['method_selection'] == method_selection
+        assert 'estimated_calc_time' in response
+    if method_selection == 'budget' and expected == 'OK':
+        # default method fits large budget and it is kept also when its time is not predicted yet
+        default = requests.get(f'http://{url}/calculate_charges',
+                               params={'structure_id': valid_id, 'dry_run': True}).json()
+        assert response['method'] == default['method']
+        assert response['parameters'] == default['parameters']
+
+
+def test_calculate_charges_coalesced(url, valid_id):
+    coalesced_before = requests.get(f'http://{url}/stats').json()['single_flight']['coalesced']
+    # identical requests have to overlap to be coalesced, they are repeated until some of them do
+    for _ in range(COALESCING_ROUNDS):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda _: calculate_charges(valid_id, 'eem', 'EEM_00_NEEMP_ccd2016_npa',
+                                                                      url).json(), range(8)))
+        assert all('OK' in response['message'] for response in responses)
+        assert all(response['charges'] == responses[0]['charges'] for response in responses)
+        assert all(isinstance(response['coalesced'], bool) for response in responses)
+        if any(response['coalesced'] for response in responses):
+            break
+    assert any(response['coalesced'] for response in responses)
+    coalesced_after = requests.get(f'http://{url}/stats').json()['single_flight']['coalesced']
+    assert coalesced_after - coalesced_before >= sum(response['coalesced'] for response in responses)
+
+
+def test_calculate_charges_trajectory(url, valid_id, sdf_id):
+    response = requests.get(f'http://{url}/calculate_charges',
+                            params={'structure_id': valid_id,
+                                    'method': 'eem',
+                                    'parameters': 'EEM_00_NEEMP_ccd2016_npa',
+                                    'trajectory': True,
+                                    'frame_statistics': True})
+    assert response.headers['Content-Type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    header, frames, frame_statistics = lines[0], lines[1:-1], lines[-1]
+    assert header['number_of_frames'] == len(frames)
+    assert [frame['frame'] for frame in frames] == list(range(len(frames)))
+    assert len(frame_statistics['mean']) == len(frame_statistics['variance']) == len(frames[0]['charges'])
+
+    response = requests.get(f'http://{url}/calculate_charges', params={'structure_id': sdf_id,
+                                                                       'trajectory': True}).json()
+    assert 'Trajectory can be calculated only for .pdb or .cif structures' in response['message']
+
+
+def test_calculate_charges_trajectory_method_selection(url, valid_id):
+    # times of trajectory are proportional to times of single frame, so the same method is selected
+    selected = requests.get(f'http://{url}/calculate_charges', params={'structure_id': valid_id,
+                                                                       'method_selection': 'fastest',
+                                                                       'dry_run': True}).json()
+    response = requests.get(f'http://{url}/calculate_charges', params={'structure_id': valid_id,
+                                                                       'method_selection': 'fastest',
+                                                                       'trajectory': True})
+    header = json.loads(response.text.splitlines()[0])
+    assert header['method_selection'] == 'fastest'
+    assert (header['method'], header['parameters']) == (selected['method'], selected['parameters'])
+
+
 def cid(identifier, url):
     return requests.post(f'http://{url}/pubchem_cid', params={'cid[]': identifier})
 
@@ -111,10 +218,59 @@ def test_get_info(structure_id, expected, url, valid_id):
     assert expected in response["message"]
 
 
+def ph_sweep(identifier, ph_values, url, with_charges=False):
+    return requests.post(f'http://{url}/ph_sweep', params={'structure_id': identifier,
+                                                           'pH[]': ph_values,
+                                                           'calculate_charges': with_charges})
+
+
+def test_ph_sweep(url, valid_id, sdf_id):
+    response = ph_sweep(valid_id, [5.0, 7.0], url, with_charges=True).json()
+    assert 'OK' in response['message']
+    assert 'structure_id' in response['results']['5.0']
+    assert 'charges' in response['results']['7.0']
+    assert 'not in .pdb or .cif format' in ph_sweep(sdf_id, [7.0], url).json()['message']
+    assert 'No pH values specified' in ph_sweep(valid_id, [], url).json()['message']
+
+
+def get_structure_file(identifier, url, headers=None, archive=None):
+    return requests.get(f'http://{url}/get_structure_file', params={'structure_id': identifier, 'archive': archive},
+                        headers=headers)
+
+
+def test_get_structure_file(url, sdf_id):
+    response = get_structure_file(sdf_id, url)
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    not_modified = get_structure_file(sdf_id, url, headers={'If-None-Match': response.headers['ETag']})
+    assert not_modified.status_code == 304
+    assert get_structure_file(sdf_id, url, archive=False).headers['Content-Disposition'].endswith('.sdf')
+
+
+def test_stats(url, valid_id):
+    calculate_charges(valid_id, 'eem', 'EEM_00_NEEMP_ccd2016_npa', url)
+    # statistics log is written by log sink in batches, calculation is recorded with delay
+    for _ in range(STATS_POLLS):
+        response = requests.get(f'http://{url}/stats').json()
+        if 'eem' in response['calculation_times']:
+            break
+        time.sleep(STATS_POLL_INTERVAL)
+    assert 'OK' in response['message']
+    assert response['endpoints']['/calculate_charges'] >= 1
+    assert 'eem' in response['calculation_times']
+    assert 'cost_model' in response
+    assert set(response['scheduler']) == {'fast', 'slow'}
+    assert sum(lane['admitted'] for lane in response['scheduler'].values()) >= 1
+    for lane in response['scheduler'].values():
+        assert lane['running'] <= lane['max_concurrent']
+        assert lane['waiting_users'] <= lane['waiting']
+
+
 def remove_file(identifier, url):
     return requests.post(f'http://{url}/remove_file', params={'structure_id': identifier})
 
 
+# structure valid_id is removed, so the test runs after all tests using it
 def test_remove_file(url, valid_id):
     assert 'OK' in get_info(valid_id, url).json()['message']
     assert 'OK' in remove_file(valid_id, url).json()['message']
@@ -0,0 +1,148 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+from Batching import MicroBatcher, SingleFlight  # noqa: E402
+
+
+def submit_concurrently(batcher, items, process, key=lambda item: 'key'):
+    """Submits items from concurrent threads, returns their results (or raised exceptions)"""
+    barrier = threading.Barrier(len(items))
+
+    def submit(item):
+        barrier.wait()
+        try:
+            return batcher.submit(key(item), item, process)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(submit, items))
+
+
+def test_items_are_processed_in_one_batch():
+    batcher = MicroBatcher(delay=0.5, max_size=100)
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    assert submit_concurrently(batcher, [1, 2, 3, 4], process) == [10, 20, 30, 40]
+    assert len(batches) == 1
+    assert sorted(batches[0]) == [1, 2, 3, 4]
+    assert batcher.get_stats() == {'batches': 1, 'items': 4, 'average_size': 4.0}
+
+
+def test_full_batch_does_not_wait_for_delay():
+    batcher = MicroBatcher(delay=10.0, max_size=3)
+    start = time.monotonic()
+    assert submit_concurrently(batcher, [1, 2, 3], lambda items: items) == [1, 2, 3]
+    assert time.monotonic() - start < 5.0
+
+
+def test_items_with_different_keys_are_not_batched_together():
+    batcher = MicroBatcher(delay=0.2, max_size=100)
+    batches = []
+
+    def process(items):
+        batches.append(sorted(items))
+        return items
+
+    assert submit_concurrently(batcher, [1, 2, 3, 4], process, key=lambda item: item % 2) == [1, 2, 3, 4]
+    assert sorted(batches) == [[1, 3], [2, 4]]
+
+
+def test_errors_are_raised_in_threads_of_their_items():
+    batcher = MicroBatcher(delay=0.5, max_size=100)
+    results = submit_concurrently(batcher, [1, -1, 2],
+                                  lambda items: [ValueError('negative') if item < 0 else item for item in items])
+    assert results[0] == 1 and results[2] == 2
+    assert isinstance(results[1], ValueError)
+
+
+def test_failed_batch_is_raised_in_all_threads():
+    batcher = MicroBatcher(delay=0.5, max_size=100)
+
+    def process(items):
+        raise RuntimeError('batch failed')
+
+    results = submit_concurrently(batcher, [1, 2, 3], process)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_single_item_is_processed_after_delay():
+    batcher = MicroBatcher(delay=0.05, max_size=100)
+    assert batcher.submit('key', 1, lambda items: [len(items)]) == 1
+    with pytest.raises(ValueError):
+        batcher.submit('key', 1, lambda items: [ValueError('invalid')])
+
+
+def wait_in_thread(single_flight, key):
+    """Starts waiting for result of running task, returns thread and list which receives the result"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(single_flight.wait(key)))
+    thread.start()
+    return thread, result
+
+
+def test_single_flight_passes_result_to_waiting_tasks():
+    single_flight = SingleFlight(timeout=10.0)
+    assert single_flight.begin('key')
+    assert not single_flight.begin('key')
+    assert not single_flight.begin('key')
+    waiting = [wait_in_thread(single_flight, 'key') for _ in range(2)]
+    single_flight.finish('key', {'charges': [0.1]})
+    for thread, result in waiting:
+        thread.join(5.0)
+        assert result == [{'charges': [0.1]}]
+    assert single_flight.get_stats() == {'running': 0, 'started': 1, 'coalesced': 2}
+    # finished task is not reused, the next identical task runs again
+    assert single_flight.begin('key')
+
+
+def test_single_flight_different_keys_run_separately():
+    single_flight = SingleFlight(timeout=10.0)
+    assert single_flight.begin('first')
+    assert single_flight.begin('second')
+    single_flight.finish('first', 1)
+    single_flight.finish('second', 2)
+    assert single_flight.get_stats() == {'running': 0, 'started': 2, 'coalesced': 0}
+
+
+@pytest.mark.parametrize('result', [None, {'error': 'calculation failed'}])
+def test_single_flight_abandoned_and_failed_task(result):
+    single_flight = SingleFlight(timeout=10.0)
+    assert single_flight.begin('key')
+    assert not single_flight.begin('key')
+    thread, received = wait_in_thread(single_flight, 'key')
+    single_flight.finish('key', result)
+    thread.join(5.0)
+    assert received == [result]
+    assert single_flight.get_stats()['running'] == 0
+
+
+def test_single_flight_does_not_wait_for_stale_task():
+    single_flight = SingleFlight(timeout=0.2)
+    assert single_flight.begin('key')
+    assert not single_flight.begin('key')
+    start = time.monotonic()
+    assert single_flight.wait('key') is None
+    assert time.monotonic() - start < 5.0
+    time.sleep(0.2)
+    # task running longer than timeout is replaced by the next identical task
+    assert single_flight.begin('key')
+    single_flight.finish('key', 'new')
+    assert single_flight.get_stats() == {'running': 0, 'started': 2, 'coalesced': 1}
+
+
+def test_single_flight_wait_without_running_task():
+    single_flight = SingleFlight(timeout=10.0)
+    assert single_flight.wait('key') is None
+    single_flight.finish('key', 'ignored')
+    assert single_flight.get_stats() == {'running': 0, 'started': 0, 'coalesced': 0}
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+from Protonation import get_element, pqr_to_pdb_line  # noqa: E402
+
+
+@pytest.mark.parametrize('atom_name, residue_name, record, element, expected', [
+    ('CA', 'ALA', 'ATOM', '', 'C'),
+    ('ZN', 'ZN', 'HETATM', '', 'ZN'),
+    ('FE', 'HEM', 'HETATM', '', 'FE'),
+    ('CL1', 'LIG', 'HETATM', '', 'CL'),
+    ('BR2', 'LIG', 'HETATM', '', 'BR'),
+    ('C1', 'LIG', 'HETATM', '', 'C'),
+    ('CA', 'LIG', 'HETATM', 'Ca', 'CA'),
+])
+def test_get_element(atom_name, residue_name, record, element, expected):
+    assert get_element(atom_name, residue_name, record, element) == expected
+
+
+def test_pqr_to_pdb_line_element():
+    line = pqr_to_pdb_line('HETATM    1 FE   HEM A   1       1.000   2.000   3.000  0.5000 1.2000\n')
+    assert line[76:78] == 'FE'
+    line = pqr_to_pdb_line('HETATM    1 CL1  LIG A   1       1.000   2.000   3.000  0.5000 1.2000 CL\n')
+    assert line[76:78] == 'CL'
@@ -0,0 +1,84 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+from Scheduler import AdmissionRejected, CalculationScheduler  # noqa: E402
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition was not met in time'
+        time.sleep(0.01)
+
+
+def run_queued(scheduler, tasks):
+    """Queues tasks (name, user, weight, cost) one by one behind running task,
+    returns names of tasks in order in which they were started"""
+    blocker = scheduler.acquire('blocker')
+    started = []
+
+    def run(name, user, weight, cost):
+        ticket = scheduler.acquire(user, weight, cost)
+        started.append(name)
+        scheduler.release(ticket)
+
+    threads = []
+    for number, task in enumerate(tasks, start=1):
+        thread = threading.Thread(target=run, args=task)
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.get_stats()['waiting'] == number)
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join()
+    return started
+
+
+def test_fair_queuing_interleaves_users():
+    scheduler = CalculationScheduler(max_concurrent=1, queue_size=10, max_wait=10)
+    started = run_queued(scheduler, [('a1', 'a', 1.0, 1.0), ('a2', 'a', 1.0, 1.0), ('a3', 'a', 1.0, 1.0),
+                                     ('b1', 'b', 1.0, 1.0), ('b2', 'b', 1.0, 1.0)])
+    assert started == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+
+def test_fair_queuing_weights_and_costs():
+    scheduler = CalculationScheduler(max_concurrent=1, queue_size=10, max_wait=10)
+    started = run_queued(scheduler, [('a1', 'a', 1.0, 4.0), ('b1', 'b', 2.0, 1.0), ('b2', 'b', 2.0, 1.0),
+                                     ('b3', 'b', 2.0, 1.0), ('b4', 'b', 2.0, 1.0)])
+    assert started == ['b1', 'b2', 'b3', 'b4', 'a1']
+
+
+def test_rejected_task_is_not_charged():
+    scheduler = CalculationScheduler(max_concurrent=1, queue_size=10, max_wait=0.2)
+    blocker = scheduler.acquire('blocker')
+    with pytest.raises(AdmissionRejected):
+        scheduler.acquire('a', cost=100.0)
+    scheduler.release(blocker)
+    # without refund the next task of the user would be queued behind tasks of the other users
+    started = run_queued(scheduler, [('a1', 'a', 1.0, 1.0), ('b1', 'b', 1.0, 1.0)])
+    assert started == ['a1', 'b1']
+
+
+def test_queue_limits():
+    scheduler = CalculationScheduler(max_concurrent=1, queue_size=2, max_wait=10, user_queue_size=1)
+    blocker = scheduler.acquire('blocker')
+    threads = [threading.Thread(target=lambda user=user: scheduler.release(scheduler.acquire(user)))
+               for user in ('a', 'b')]
+    threads[0].start()
+    wait_until(lambda: scheduler.get_stats()['waiting'] == 1)
+    with pytest.raises(AdmissionRejected, match='Too many of your calculations'):
+        scheduler.acquire('a')
+    threads[1].start()
+    wait_until(lambda: scheduler.get_stats()['waiting'] == 2)
+    with pytest.raises(AdmissionRejected) as error:
+        scheduler.acquire('c')
+    assert error.value.retry_after >= 1
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join()
+    assert scheduler.get_stats()['rejected'] == 2
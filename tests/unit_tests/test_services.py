@@ -0,0 +1,59 @@
+import configparser
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('chargefw2_python')
+pytest.importorskip('gemmi')
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+from Services import Services  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[2]
+FORKED_UPDATES = 5000
+
+
+def load_config(path=ROOT / 'tests' / 'unit_tests' / 'dependencies' / 'api.ini'):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+@pytest.mark.parametrize('path', [ROOT / 'utils' / 'api.ini', ROOT / 'tests' / 'unit_tests' / 'dependencies' / 'api.ini'])
+def test_calculation_pool_of_shipped_config(path):
+    config = load_config(path)
+    # workers of deployment embedded in web server (mod_wsgi) can be started only by fork
+    assert config['chunking']['start_method'] == 'fork'
+    services = Services(config)
+    try:
+        assert services.calculation_pool.apply(os.getpid, timeout=60) != os.getpid()
+    finally:
+        services.calculation_pool.close()
+
+
+def test_forked_process_connects_to_private_state_of_parent():
+    config = load_config()
+    config['state']['address'] = ''
+    services = Services(config)
+    try:
+        services.long_calculations['parent'] = 0
+        pid = os.fork()
+        if not pid:
+            # process forked from preloaded application (not started by multiprocessing)
+            status = 1
+            try:
+                for number in range(FORKED_UPDATES):
+                    services.long_calculations['child'] = number
+                status = 0
+            finally:
+                os._exit(status)
+        # parent uses its connection at the same time as the forked process
+        for number in range(FORKED_UPDATES):
+            services.long_calculations['parent'] = number
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+        assert services.long_calculations.copy() == {'parent': FORKED_UPDATES - 1, 'child': FORKED_UPDATES - 1}
+    finally:
+        services.close()
+        services.manager.shutdown()
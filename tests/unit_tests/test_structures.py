@@ -0,0 +1,89 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('chargefw2_python')
+gemmi = pytest.importorskip('gemmi')
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+from Structures import calculate_chunk_charges, merge_molecule_files  # noqa: E402
+from Structures import Structure, split_merged_charges, split_molecule_file  # noqa: E402
+
+DEPENDENCIES = Path(__file__).resolve().parent / 'dependencies'
+
+SDF_MOLECULE = '''{name}
+  synthetic
+
+  1  0  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 {element:<3s} 0  0  0  0  0  0  0  0  0  0  0  0
+M  END
+$$$$
+'''
+
+MOL2_MOLECULE = '''@<TRIPOS>MOLECULE
+{name}
+1 0 0 0 0
+SMALL
+NO_CHARGES
+
+@<TRIPOS>ATOM
+      1 {element}1      0.0000     0.0000     0.0000 {element}     1 UNL 0.0000
+'''
+
+
+def write_molecules(path, template, names):
+    path.write_text(''.join(template.format(name=name, element='C') for name in names))
+    return path
+
+
+@pytest.mark.parametrize('suffix, template', [('.sdf', SDF_MOLECULE), ('.mol2', MOL2_MOLECULE)])
+def test_merge_molecule_files(tmp_path, suffix, template):
+    files = [write_molecules(tmp_path / f'first{suffix}', template, ['ethanol', 'methanol']),
+             write_molecules(tmp_path / f'second{suffix}', template, ['ethanol'])]
+    merged = tmp_path / f'merged{suffix}'
+    names = merge_molecule_files(files, merged)
+    assert names == [['ethanol', 'methanol'], ['ethanol']]
+    content = merged.read_text()
+    for unique_name in ('0_0', '0_1', '1_0'):
+        assert f'\n{unique_name}\n' in f'\n{content}'
+    assert 'ethanol' not in content and 'methanol' not in content
+
+
+def test_split_merged_charges():
+    charges = {'0_0': [0.1, -0.1], '0_1': [0.2], '1_0': [0.3, -0.3]}
+    names = [['ethanol', 'methanol'], ['ethanol']]
+    assert split_merged_charges(charges, names) == [{'ethanol': [0.1, -0.1], 'methanol': [0.2]},
+                                                    {'ethanol': [0.3, -0.3]}]
+
+
+def test_split_merged_charges_of_missing_molecule():
+    with pytest.raises(KeyError):
+        split_merged_charges({'0_0': [0.1]}, [['ethanol', 'methanol']])
+
+
+def test_chunked_charges_equal_charges_of_whole_structure(tmp_path):
+    # structure of many molecules, split into small chunks as if minimal size of chunked structure was lowered
+    molecule = (DEPENDENCIES / '1.sdf').read_text().split('\n', 1)[1]
+    structure = tmp_path / 'molecules.sdf'
+    structure.write_text(''.join(f'molecule_{index}\n{molecule}' for index in range(10)))
+    whole = calculate_chunk_charges(structure, 'eem', 'EEM_00_NEEMP_ccd2016_npa', True, False)
+    chunked = {}
+    for chunk_file in split_molecule_file(structure, 3, tmp_path):
+        chunked.update(calculate_chunk_charges(chunk_file, 'eem', 'EEM_00_NEEMP_ccd2016_npa', True, False))
+    assert len(whole) == 10
+    assert list(chunked) == list(whole)
+    for name, charges in whole.items():
+        assert chunked[name] == pytest.approx(charges)
+
+
+def test_pdb_input_file_of_cif_structure(tmp_path):
+    cif_file = tmp_path / '1ner.cif'
+    gemmi.read_structure(str(DEPENDENCIES / '1ner.pdb')).make_mmcif_document().write_file(str(cif_file))
+    sidecar_manager = {}
+    structure = Structure('1ner', {'1ner': str(cif_file)}, sidecar_manager)
+    pdb_file = structure.get_pdb_input_file()
+    assert pdb_file == str(tmp_path / '1ner.pdb')
+    assert sidecar_manager == {'1ner': [pdb_file]}
+    # converted file is moved into place, no temporary file is left
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['1ner.cif', '1ner.pdb']
+    assert 'ATOM' in (tmp_path / '1ner.pdb').read_text()
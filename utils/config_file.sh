@@ -35,11 +35,14 @@ export PYTHONPATH=/usr/local/lib
 # pdb2pqr installation
 sudo pip install pdb2pqr
 
+# gemmi python bindings installation
+sudo pip install gemmi
+
 # flask-restx installation
 sudo pip install flask-restx
 
-# dos2unix, openbabel installation
-sudo apt-get install -y dos2unix openbabel
+# dos2unix installation
+sudo apt-get install -y dos2unix
 
 # API
 sudo mkdir /home/api_acc2/api_acc2
@@ -49,6 +52,10 @@ sudo mkdir /home/api_acc2/api_acc2/logs
 sudo chown -R api_acc2:api_acc2 /home/api_acc2
 sudo chown -R api_acc2:api_acc2 /home/tmp
 
+# worker processes share state through state server, authentication key is generated for this machine
+sudo sed -i -e "s|^address =.*|address = /home/api_acc2/api_acc2/logs/state.sock|" \
+            -e "s|^authkey =.*|authkey = $(openssl rand -hex 16)|" /home/api_acc2/api_acc2/utils/api.ini
+
 # enable api configuration
 sudo mv /home/api_acc2/api_acc2/utils/api_acc2.conf /etc/apache2/sites-available/
 cd /etc/apache2/sites-available